@@ -1,34 +1,114 @@
 import os
 import requests
+from concurrent.futures import ThreadPoolExecutor, FIRST_COMPLETED, wait
+from requests.adapters import HTTPAdapter
 
-def download_csv_files(api_url, save_folder):
+def download_csv_files(api_url, save_folder, max_workers=8, session=None, chunk_size=1 << 16):
     """Download all CSV files from a GitHub repository.
 
+    The directories are listed and the files are downloaded concurrently by a pool of max_workers threads,
+    sharing one session with a pool of keep-alive connections. A directory is listed while the files found
+    so far are still downloading, and each file is streamed to the disk by chunks instead of being held in memory.
+
     Args:
         api_url (str): The URL of the GitHub API endpoint for the repository.
         save_folder (str): The path to save the downloaded CSV files.
+        max_workers (int, optional): The maximum number of concurrent requests. Defaults to 8.
+        session (requests.Session, optional): The session to use. Defaults to None, i.e., a new pooled session.
+        chunk_size (int, optional): The size of the chunks written to the disk. Defaults to 64 KiB.
+
+    Raises:
+        requests.HTTPError: If a directory could not be listed or a file could not be downloaded.
+    The crawl goes on after a failure, so the error lists every failed URL.
+
+    Returns:
+        list[str]: The paths of the downloaded CSV files.
     """
-    # Make a GET request to the GitHub API to fetch repository contents
-    response = requests.get(api_url)
-    if response.status_code == 200:
-        repo_contents = response.json()
-        for content in repo_contents:
-            if content["type"] == "file" and content["name"].endswith(".csv"):
-                file_url = content["download_url"]
-                file_name = content["name"]
-                file_path = os.path.join(save_folder, file_name)
-                file_data = requests.get(file_url).content
-                with open(file_path, "wb") as f:
-                    f.write(file_data)
-                print(f"{file_path} downloaded successfully.")
-            elif content["type"] == "dir":
-                sub_dir_url = content["url"]
-                download_csv_files(sub_dir_url, save_folder)
-    else:
-        print(f"Failed to fetch repository contents from the API {api_url=}. \nStatus code: {response.status_code}")
+    if session is None:
+        session = requests.Session()
+        adapter = HTTPAdapter(pool_connections=max_workers, pool_maxsize=max_workers)
+        session.mount('https://', adapter)
+        session.mount('http://', adapter)
+
+    os.makedirs(save_folder, exist_ok=True)
+    downloaded, failed = [], []
+    with ThreadPoolExecutor(max_workers=max_workers) as executor:
+        pending = {executor.submit(list_contents, session, api_url)}
+        while pending:
+            done, pending = wait(pending, return_when=FIRST_COMPLETED)
+            for future in done:
+                try:
+                    result = future.result()
+                except requests.RequestException as error:
+                    print(error)
+                    failed.append(error.request.url if error.request is not None else str(error))
+                    continue
+
+                if isinstance(result, str):
+                    # A downloaded file
+                    downloaded.append(result)
+                    print(f"{result} downloaded successfully.")
+                    continue
+
+                # The contents of a directory: download its files and list its sub-directories
+                for content in result:
+                    if content["type"] == "file" and content["name"].endswith(".csv"):
+                        file_path = os.path.join(save_folder, content["name"])
+                        pending.add(executor.submit(download_to_file, session, content["download_url"], file_path, chunk_size))
+                    elif content["type"] == "dir":
+                        pending.add(executor.submit(list_contents, session, content["url"]))
+
+    if failed:
+        raise requests.HTTPError(f"{len(failed)} requests failed, the CSV files in {save_folder} are incomplete: {failed}")
+    return downloaded
+
+def list_contents(session, api_url):
+    """List the contents of a directory with the GitHub API.
+
+    Args:
+        session (requests.Session): The session to use.
+        api_url (str): The URL of the GitHub API endpoint for the directory.
+
+    Raises:
+        requests.HTTPError: If the status code is not 200.
+
+    Returns:
+        list[dict]: The contents of the directory.
+    """
+    response = session.get(api_url)
+    if response.status_code != 200:
+        raise requests.HTTPError(f"Failed to fetch repository contents from the API {api_url=}. \nStatus code: {response.status_code}",
+                                 request=response.request, response=response)
+    return response.json()
+
+def download_to_file(session, file_url, file_path, chunk_size=1 << 16):
+    """Stream a file to the disk by chunks. It is written to file_path + '.part' and moved in place when complete.
+
+    Args:
+        session (requests.Session): The session to use.
+        file_url (str): The URL of the file.
+        file_path (str): The path to save the file.
+        chunk_size (int, optional): The size of the chunks written to the disk. Defaults to 64 KiB.
+
+    Raises:
+        requests.HTTPError: If the status code is not 200.
+
+    Returns:
+        str: file_path
+    """
+    partial_path = file_path + '.part'
+    with session.get(file_url, stream=True) as response:
+        if response.status_code != 200:
+            raise requests.HTTPError(f"Failed to download the file {file_url=}. \nStatus code: {response.status_code}",
+                                     request=response.request, response=response)
+        with open(partial_path, "wb") as f:
+            for chunk in response.iter_content(chunk_size=chunk_size):
+                f.write(chunk)
+    os.replace(partial_path, file_path)
+    return file_path
 
 if __name__ == "__main__":
-    
+
     repo_url = "https://api.github.com/repos/GiovanniGafa/EmoITA/contents/"
     save_folder = "EmotivITA/save_folder"
 
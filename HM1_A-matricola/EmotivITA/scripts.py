@@ -1,157 +1,444 @@
 import os
-import csv
-import json
+import sys
 import pandas as pd
-import copy
-import random
-# random.seed(49)
+import numpy as np
+from contextlib import ExitStack
+from typing import Iterable, Iterator
+
+# Make the shared helpers in HM1_A-matricola/common importable when this file is run as a script
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from common.binning import QuantileSketch, as_threshold_table, bin_values, uniform_thresholds
+from common.columnar import ColumnarWriter, SharedTextWriter, columnar_path, shared_text_path
+from common.dedup import DEDUP_MODES, DuplicateIndex, dedup_index_path, dedup_report_path
+from common.ingest import read_columns
+from common.lemma_cache import LEMMA_CACHE_PATH, fill_cache
+from common.manifest import ConversionManifest, RowCache
+from common.metrics import Metrics, metrics_path, profile_path, profiled
+from common.records import RecordBatch, encode_texts
+from common.serialization import BACKENDS, JsonlSerializer, write_encoded_chunks
+from common.sharding import StratifiedSplitter, split_file_path
+from common.shuffle import SEED, hash_keys, ordered_choices, record_keys, shuffle_labels_batch
+
+DIMENSIONS = ['Valence', 'Arousal', 'Dominance']
+
+# The EmotivITA files, relative to this folder rather than to the working directory
+EMOTIVITA_DIR = os.path.dirname(os.path.abspath(__file__))
+SAVE_FOLDER = os.path.join(EMOTIVITA_DIR, 'save_folder')
+REPO_URL = "https://api.github.com/repos/GiovanniGafa/EmoITA/contents/"
+
+# The input CSV file and the output JSONL files of each split
+SPLIT_FILES = {
+    'dev': ('Development set.csv', 'EmotivITA_{}_dev.jsonl'),
+    'test': ('Test set - Gold labels.csv', 'EmotivITA_{}_test.jsonl'),
+}
+
+def split_paths(split: str) -> tuple[str, str]:
+    """The input file path and the output file path (with a {} for the dimension) of 'dev' or 'test'."""
+    input_file_name, output_file_name = SPLIT_FILES[split]
+    return os.path.join(SAVE_FOLDER, input_file_name), os.path.join(EMOTIVITA_DIR, output_file_name)
+
+# The columns read from the input files, the others are skipped while parsing
+READ_COLUMNS = ['id', 'text', 'V', 'A', 'D']
+
+# Upper thresholds of each category but the last, for each --map_option.
+MAP_OPTION_THRESHOLDS = {
+    0: [3.2, 3.8],
+    1: [1.25, 2.5, 3.75],
+}
+
+# The thresholds computed by resolve_thresholds instead of given as a list
+THRESHOLD_MODES = ['balanced', 'uniform']
 
 def emotivITA(input_file_path: str, 
               output_file_path: str, 
               float_to_cat_list: list[str], 
               shuffle_labels: bool=False, 
-              verbose: bool=False
+              verbose: bool=False,
+              map_option: int=0,
+              seed: int=SEED,
+              key_column: str='id',
+              chunksize: int | None=None,
+              json_backend: str='auto',
+              use_cache: bool=True,
+              thresholds: list[float] | list[list[float]] | str | None=None,
+              columnar: bool=False,
+              shared_text: bool=False,
+              dedup: str | None=None,
+              dedup_against: list[str] | None=None,
+              metrics: Metrics | None=None,
+              split: int | list[float] | None=None
               ) -> None :
     """Reformat the data in the input file to a JSONL format in the output file.
+    
+    The conversion is column-wise: V/A/D are binned with array operations and the 
+    shuffled choices are drawn as one batched permutation matrix, instead of walking the rows one by one.
+    
+    With chunksize set, the input is read and converted chunk by chunk and the records are written 
+    as they are produced, so the memory stays flat whatever the size of the input. 
+    Since each ordering of the choices depends only on the seed and the key of its row, the output is byte-identical 
+    to the one of the batch path, and to the one of any other partitioning of the rows.
+    
+    With use_cache, the conversion is skipped when the input and the parameters did not change since the last run, 
+    and only the changed rows are converted again when some rows changed (see common.manifest).
+    
+    With columnar, each dimension is also written as a memory-mappable columnar folder next to its JSONL file, 
+    e.g., EmotivITA_Valence_dev.cols (see common.columnar). It is always written in full, without reusing rows.
+    
+    With shared_text, the three dimensions are written instead as a single folder, e.g., EmotivITA_dev.shared, 
+    where each distinct text is stored once and each dimension has its own label and choices columns 
+    (see common.columnar.SharedTextWriter). SharedTextDataset(path).view('Valence') gives back the records of a dimension.
+    
+    With dedup, the rows go through a DuplicateIndex before the conversion (see common.dedup): the exact and near duplicate 
+    texts are written to a report, e.g., EmotivITA_test.duplicates.tsv, and the index is saved as EmotivITA_test.dedup.npz. 
+    The rows that duplicate a row of the dedup_against indexes (e.g., the one of the dev set) are leaks, dropped with 'drop'.
+    
+    With metrics, the time and the rows of each stage (read, bin, shuffle, records, serialize, write, ...) and the histogram 
+    of the categories of each dimension are recorded in it (see common.metrics.Metrics).
+    
+    With split, each dimension is written as N shards (split=N) or as train/val/test splits (e.g., split=[0.8, 0.1, 0.1]) 
+    in the same pass, e.g., EmotivITA_Valence_dev.shard-00-of-04.jsonl or EmotivITA_Valence_dev.train.jsonl. 
+    The rows are stratified by their V/A/D categories, so each file has the same balance of the categories, 
+    and the three dimensions of a row always go to the same file (see common.sharding.StratifiedSplitter).
 
     Args:
         input_file_path (str): a valid path to the input file
         output_file_path (str): a non-valid path to the output file. Need to add one from ['Valence', 'Arousal', 'Dominance']. 
-        E.g., output_file_path.format('Dominance') =  HM1_A-1\EmotivITA\EmotivITA_Dominance_dev.jsonl
+        E.g., output_file_path.format('Dominance') =  HM1_A-1/EmotivITA/EmotivITA_Dominance_dev.jsonl
         float_to_cat_list: list[str]: a list of categorical values.
         shuffle_labels (bool, optional): Shuffle the choices so that the model learns not just the ordering of the labels, 
     but the actual semantic meaning of them. Defaults to False.
         verbose (bool, optional): whether to print or not. Defaults to False. Defaults to False.
+        map_option (int, optional): the thresholds to use, see MAP_OPTION_THRESHOLDS. Defaults to 0.
+        seed (int, optional): the global seed of the shuffle. Defaults to SEED.
+        key_column (str, optional): the column with a unique id per row. The ordering of the choices of a row depends 
+    only on the seed and on this key (or on the text if there is no such column). Defaults to 'id'.
+        chunksize (int, optional): the number of rows per chunk in the streaming mode. 
+    Defaults to None, i.e., read the whole file at once.
+        json_backend (str, optional): the JSON encoder, see JsonlSerializer. Defaults to 'auto'.
+        use_cache (bool, optional): whether to reuse the previous output, see ConversionManifest. Defaults to True.
+        thresholds (list[float] | list[list[float]] | str, optional): the thresholds of the categories instead of the ones 
+    of map_option: one list for the three dimensions, one list per dimension, 'balanced' to compute the thresholds 
+    that give each category about the same number of rows of each dimension, or 'uniform' for categories of the same width 
+    (see resolve_thresholds). Defaults to None, i.e., MAP_OPTION_THRESHOLDS[map_option].
+        columnar (bool, optional): whether to also write the columnar format, see ColumnarWriter. Defaults to False.
+        shared_text (bool, optional): whether to write the shared text layout instead of the JSONL files. Defaults to False.
+        dedup (str, optional): None, or one from DEDUP_MODES: report ('flag') or also drop ('drop') the leaked rows. 
+    Defaults to None.
+        dedup_against (list[str], optional): the saved indexes of the other splits. Defaults to None.
+        metrics (Metrics, optional): where to record the metrics of the stages. Defaults to None, i.e., no metrics.
+        split (int | list[float], optional): the number of shards, or the fractions of train/val(/test). 
+    Defaults to None, i.e., a single file per dimension.
         
     Raises:
-        ValueError: If the file extension is not .tsv or .csv.
+        ValueError: If the delimiter of the file is not a tab, a comma, a semicolon or a pipe, if both columnar and shared_text are set, 
+    if split is set with columnar or shared_text, or if dedup is not in DEDUP_MODES.
         
     Returns:
         None
         
     Examples:
-        emotivITA('HM1_A-1936515\EmotivITA\Development set.csv', 
-                'HM1_A-1936515\EmotivITA\EmotivITA_{}_dev.jsonl',
+        emotivITA('HM1_A-1936515/EmotivITA/Development set.csv', 
+                'HM1_A-1936515/EmotivITA/EmotivITA_{}_dev.jsonl',
                 float_to_cat_list=['Bassa', 'Media', 'Alta', 'Molto Alta'],
                 shuffle_labels=True,
-                verbose=True)
+                verbose=True,
+                map_option=1)
     """
     
-    file_extension = input_file_path.split('.')[-1]
-    print(f"File extension: {file_extension}")
-
-    # Read the data from a .tsv or .csv file
-    if file_extension == 'tsv':
-        data = pd.read_csv(input_file_path, sep='\t')
-    elif file_extension == 'csv':
-        data = pd.read_csv(input_file_path)
-    else:
-        raise ValueError(f'Invalid file format for the file: {input_file_path}. Only .tsv and .csv files are supported.')
+    if columnar and shared_text:
+        raise ValueError("columnar writes a copy of each JSONL file, and shared_text writes no JSONL file: choose one")
+    if split is not None and (columnar or shared_text):
+        raise ValueError("split writes the JSONL files only, it cannot be combined with columnar or shared_text")
+    if dedup is not None and dedup not in DEDUP_MODES:
+        raise ValueError(f"Invalid dedup mode: {dedup}. Choose one from {DEDUP_MODES}.")
     
-    # Create a list for each item to store the jsonl entries
-    jsonl_entry_V = []
-    jsonl_entry_A = []
-    jsonl_entry_D = []
+    metrics = metrics if metrics is not None else Metrics(enabled=False)
+    serializer = JsonlSerializer(json_backend)
+    output_file_paths = [output_file_path.format(dimension) for dimension in DIMENSIONS]
+    if shared_text:
+        shared_path = shared_text_path(output_file_path)
+        output_file_paths = [shared_path, os.path.join(shared_path, 'meta.json')]
+    if split is not None:
+        splitter = StratifiedSplitter(split, seed)
+        output_file_paths = [split_file_path(path, name) for path in output_file_paths for name in splitter.names]
     
-    if args.map_option == 0:
-        count_each_label = {'Bassa': 0, 'Media': 0, 'Alta': 0}
+    # The balanced thresholds depend on the data, so the resolved ones are the parameters of the output
+    threshold_table = resolve_thresholds(input_file_path, len(float_to_cat_list), map_option, thresholds, chunksize)
+    if verbose or thresholds is not None:
+        print('Thresholds:', dict(zip(DIMENSIONS, threshold_table.tolist())))
+    
+    # Every parameter that changes the output
+    params = {
+        'converter': 'emotivITA',
+        'float_to_cat_list': float_to_cat_list,
+        'shuffle_labels': shuffle_labels,
+        'thresholds': threshold_table.tolist(),
+        'seed': seed,
+        'key_column': key_column,
+        'json_backend': serializer.backend,
+        'columnar': columnar,
+        'shared_text': shared_text,
+        'dedup': dedup,
+        'split': split,
+    }
+    # The content of the reference indexes is tracked like the one of the input file
+    input_file_paths = [input_file_path, *(dedup_against or [])] if dedup else [input_file_path]
+    columnar_paths = [columnar_path(path) for path in output_file_paths] if columnar else []
+    manifest = ConversionManifest(*output_file_paths, *[os.path.join(path, 'meta.json') for path in columnar_paths])
+    if use_cache and manifest.is_up_to_date(input_file_paths, params):
+        print('Up to date, skipped:', output_file_paths + columnar_paths)
+        return
+    # The columnar and shared text folders and the splits are written in full, so there is no row to reuse with them
+    row_cache = manifest.row_cache(params) if use_cache and not columnar and not shared_text and split is None else RowCache()
+    
+    count_each_label = dict.fromkeys(float_to_cat_list, 0)
+    # Each stage of the generator pipeline is timed on its own, see Metrics.timed
+    data_chunks = metrics.timed(read_data(input_file_path, chunksize, [key_column, *READ_COLUMNS[1:]]), 'read', rows=len)
+    if dedup:
+        duplicate_index = DuplicateIndex(dedup_against, drop=dedup == 'drop')
+        data_chunks = metrics.timed(duplicate_index.stage(data_chunks, key_column), 'dedup', rows=len)
+    def count_reused(reused: pd.DataFrame) -> None:
+        # The categories of the reused rows are counted too, so the counts are the ones of the whole output
+        cat_idx = bin_values(reused[['V', 'A', 'D']].to_numpy(dtype=float), threshold_table)
+        count_labels(cat_idx, float_to_cat_list, count_each_label, metrics)
+    
+    data_chunks = metrics.timed(row_cache.filter(data_chunks, [key_column, 'text', 'V', 'A', 'D'], count_reused), 
+                                'cache', rows=len)
+    entries_chunks = emotivITA_chunks(data_chunks, float_to_cat_list, shuffle_labels, verbose, 
+                                      threshold_table, seed, key_column, count_each_label, metrics)
+    entries_chunks = metrics.timed(entries_chunks, 'records', rows=lambda batches: len(batches[0]))
+    if split is not None:
+        entries_chunks = metrics.timed(splitter.split(entries_chunks), 'split', 
+                                       rows=lambda batches: sum(map(len, batches[:len(splitter.names)])))
+    
+    if shared_text:
+        with SharedTextWriter(shared_path, DIMENSIONS, ordered_choices(float_to_cat_list)) as writer:
+            for jsonl_entries in entries_chunks:
+                with metrics.stage('write', len(jsonl_entries[0])):
+                    writer.write(jsonl_entries)
+        output_file_paths = [shared_path]
     else:
-        count_each_label = {'Bassa': 0, 'Media': 0, 'Alta': 0, 'Molto Alta': 0}
+        with ExitStack() as stack:
+            for dim_idx, (dimension, path) in enumerate(zip(DIMENSIONS, columnar_paths)):
+                writer = stack.enter_context(ColumnarWriter(path, ordered_choices(float_to_cat_list), dimension=dimension))
+                entries_chunks = metrics.timed(writer.tap(entries_chunks, dim_idx), 'columnar', 
+                                               rows=lambda batches: len(batches[0]))
+            
+            # Write the jsonl entries for each item to a file
+            # The rows of a chunk are the lines of a dimension, in one file or across its splits
+            encoded_chunks = metrics.timed(row_cache.merge(entries_chunks, serializer), 'serialize', 
+                                           rows=lambda encoded: sum(lines.count(b'\n') for lines in encoded) // len(DIMENSIONS))
+            with metrics.stage('write'):
+                write_encoded_chunks(output_file_paths, encoded_chunks)
+            metrics.add_rows('write', metrics.stages.get('serialize', {}).get('rows', 0))
+    manifest.record(input_file_paths, params, row_cache.all_digests())
+    for path in output_file_paths:
+        metrics.add_output(path)
+    
+    if dedup:
+        duplicate_index.save(dedup_index_path(output_file_path))
+        duplicate_index.write_report(dedup_report_path(output_file_path))
+        print('Duplicates:', duplicate_index.summary(), '-- see', dedup_report_path(output_file_path))
+    if split is not None:
+        print('Rows per split:', splitter.summary())
+    
+    for path in output_file_paths + columnar_paths:
+        print('Data written successfully to:', path, '!')
+    print(f"End -- {count_each_label=} ({row_cache.n_reused} unchanged rows reused)")
+    
+def read_data(input_file_path: str, 
+              chunksize: int | None=None,
+              columns: list[str] | None=None
+              ) -> Iterator[pd.DataFrame]:
+    """Read the data from a .tsv or .csv file, either at once or in chunks.
+    
+    Only the needed columns are parsed, with compact dtypes, and the delimiter and the compression (e.g., a .csv.gz file) 
+    are found from the content of the file (see common.ingest.read_columns).
+
+    Args:
+        input_file_path (str): a valid path to the input file
+        chunksize (int, optional): the number of rows per chunk. Defaults to None, i.e., a single chunk.
+        columns (list[str], optional): the columns to read. Defaults to None, i.e., READ_COLUMNS.
+
+    Raises:
+        ValueError: If the delimiter of the file is not a tab, a comma, a semicolon or a pipe.
+
+    Returns:
+        Iterator[pd.DataFrame]: the chunks of the data
+    """
+    # The ids are read as strings, so that they are the same keys of the shuffle whatever they look like
+    return read_columns(input_file_path, columns or READ_COLUMNS, chunksize)
+
+def emotivITA_chunks(data_chunks: Iterable[pd.DataFrame], 
+                     float_to_cat_list: list[str], 
+                     shuffle_labels: bool, 
+                     verbose: bool, 
+                     thresholds: np.ndarray, 
+                     seed: int, 
+                     key_column: str, 
+                     count_each_label: dict[str, int],
+                     metrics: Metrics | None=None
+                     ) -> Iterator[list[RecordBatch]]:
+    """Lazily convert each chunk of the data to the jsonl entries of the three dimensions.
+    
+    The ordering of the choices of a row depends only on the seed, the key of the row and the dimension, 
+    so the chunking does not change the output.
+
+    Args:
+        data_chunks (Iterable[pd.DataFrame]): the chunks of the data, with the text, V, A and D columns
+        float_to_cat_list (list[str]): a list of categorical values.
+        shuffle_labels (bool): whether to shuffle the choices
+        verbose (bool): whether to print the first rows or not
+        thresholds (np.ndarray): the thresholds of each dimension, see resolve_thresholds
+        seed (int): the global seed of the shuffle
+        key_column (str): the column with a unique id per row, see record_keys
+        count_each_label (dict[str, int]): the counts of each category, updated in place
+        metrics (Metrics, optional): where to time the bin and shuffle stages and count the categories of each dimension. 
+    Defaults to None, i.e., no metrics.
+
+    Yields:
+        list[RecordBatch]: the jsonl entries of the chunk for each dimension, in DIMENSIONS order. 
+    The three batches share the same text buffer.
+    """
+    metrics = metrics if metrics is not None else Metrics(enabled=False)
+    n_choices = len(float_to_cat_list)
+    
+    # Only k! distinct orderings exist, so share one choices list per ordering 
+    # instead of building a new list for every record.
+    choices_lists = ordered_choices(float_to_cat_list)
+    
+    # One salt per dimension, so that the three dimensions of a row get independent orderings
+    salts = np.arange(len(DIMENSIONS))
+    
+    for chunk_idx, data in enumerate(data_chunks):
+        # Map the three dimensions at once. Shape: (n_rows, 3), columns in DIMENSIONS order.
+        with metrics.stage('bin', len(data)):
+            cat_idx = bin_values(data[['V', 'A', 'D']].to_numpy(dtype=float), thresholds)
         
-    # Iterate over each row in the data
-    for index, row in data.iterrows():
-        text = row['text']
-        V = float(row['V'])
-        A = float(row['A'])
-        D = float(row['D'])
+        if shuffle_labels:
+            with metrics.stage('shuffle', len(data)):
+                key_hashes = hash_keys(record_keys(data, key_column), seed)
+                codes, labels = shuffle_labels_batch(n_choices, cat_idx, key_hashes[:, None], salts)
+        else:
+            # The row 0 of the permutation table is the original ordering
+            codes = np.zeros_like(cat_idx)
+            labels = cat_idx
         
-        v = map_float_to_cat_idx(V)
-        a = map_float_to_cat_idx(A)
-        d = map_float_to_cat_idx(D)
+        count_labels(cat_idx, float_to_cat_list, count_each_label, metrics)
         
-        if shuffle_labels:
-            shuffle_choices_v, shuffle_label_v = shuffle_labels_func(float_to_cat_list, v, verbose)
-            count_each_label[shuffle_choices_v[shuffle_label_v]] += 1
-            
-            shuffle_choices_a, shuffle_label_a = shuffle_labels_func(float_to_cat_list, a, verbose)
-            count_each_label[shuffle_choices_a[shuffle_label_a]] += 1
-            
-            shuffle_choices_d, shuffle_label_d = shuffle_labels_func(float_to_cat_list, d, verbose)
-            count_each_label[shuffle_choices_d[shuffle_label_d]] += 1
-
-            if index >= 5: 
-                verbose = False
-            else:
-                print(f"""{shuffle_choices_v[shuffle_label_v]=}, \t{shuffle_choices_a[shuffle_label_a]=}, \t{shuffle_choices_d[shuffle_label_d]=}
-                      \n{count_each_label=}
-                      """)
-                print(f"{float_to_cat_list=}, \t{shuffle_choices_d=}")
+        if verbose and chunk_idx == 0:
+            for index in range(min(5, len(data))):
+                categories = [float_to_cat_list[i] for i in cat_idx[index]]
+                choices = [choices_lists[c] for c in codes[index].tolist()]
+                print(f"Row {index}: {categories=}, \t{choices=}, \tlabels={labels[index].tolist()}")
         
-        # Create a jsonl entry.
+        text_buffer, text_offsets = encode_texts(data['text'].tolist())
+        
+        # Create the jsonl entries for each dimension.
         # Add the dimension so that the model can differentiate between the three dimensions.
         # Said by one of the TAs on Google Classroom.
-        jsonl_entry_V.append(
-            {
-                'text': text,
-                'choices': shuffle_choices_v,
-                'label': shuffle_label_v,
-                'dimension': 'Valence'
-            }
-        )
-        jsonl_entry_A.append(
-            {
-                'text': text,
-                'choices': shuffle_choices_a,
-                'label': shuffle_label_a,
-                'dimension': 'Arousal'
-            }
-        )
-        jsonl_entry_D.append(
-            {
-                'text': text,
-                'choices': shuffle_choices_d,
-                'label': shuffle_label_d,
-                'dimension': 'Dominance'
-            }
-        )
-    
-    print(f"End -- {count_each_label=}")
+        yield [
+            RecordBatch(text_buffer, text_offsets, labels[:, dim_idx], codes[:, dim_idx], choices_lists, dimension=dimension)
+            for dim_idx, dimension in enumerate(DIMENSIONS)
+        ]
+    
+def count_labels(cat_idx: np.ndarray, 
+                 float_to_cat_list: list[str], 
+                 count_each_label: dict[str, int], 
+                 metrics: Metrics
+                 ) -> None:
+    """Count the categories of a chunk, in count_each_label and in the histogram of each dimension of the metrics.
 
-    # Write the jsonl entries for each item to a file
-    open_and_write_jsonl(output_file_path.format('Valence'), jsonl_entry_V)
-    open_and_write_jsonl(output_file_path.format('Arousal'), jsonl_entry_A)
-    open_and_write_jsonl(output_file_path.format('Dominance'), jsonl_entry_D)
+    Args:
+        cat_idx (np.ndarray): the category index of each row and dimension. Shape: (n_rows, 3).
+        float_to_cat_list (list[str]): a list of categorical values.
+        count_each_label (dict[str, int]): the counts of each category, updated in place
+        metrics (Metrics): where to count the categories of each dimension
+    """
+    for idx, count in zip(*np.unique(cat_idx, return_counts=True)):
+        count_each_label[float_to_cat_list[idx]] += int(count)
+    if metrics.enabled:
+        for dim_idx, dimension in enumerate(DIMENSIONS):
+            counts = np.bincount(cat_idx[:, dim_idx], minlength=len(float_to_cat_list))
+            metrics.add_histogram(dimension, dict(zip(float_to_cat_list, counts.tolist())))
     
 def open_and_write_jsonl(output_file_path: str, 
-                         jsonl_entries: list[dict]
+                         jsonl_entries: list[dict],
+                         serializer: JsonlSerializer | None=None
                          ) -> None:
     """Takes a list of jsonl entries and writes them to a file.
 
     Args:
         output_file_path (str): a valid path to the output file
         jsonl_entries (list(Dict)): a list of jsonl entries
+        serializer (JsonlSerializer, optional): the JSON encoder. Defaults to None, i.e., JsonlSerializer('auto').
         
     Returns:
         None
         
     Example:
-        open_and_write_jsonl('HM1_A-1\EmotivITA\EmotivITA_{Dominance}_dev.jsonl', jsonl_entries)
+        open_and_write_jsonl('HM1_A-1/EmotivITA/EmotivITA_{Dominance}_dev.jsonl', jsonl_entries)
     """
+    serializer = serializer or JsonlSerializer()
+    
     # Write the jsonl entries to a file
-    with open(output_file_path, 'w', encoding='utf-8') as f:
-        for entry in jsonl_entries:
-            json_string = json.dumps(entry, ensure_ascii=False)
-            f.write(json_string + '\n')
+    with open(output_file_path, 'wb') as f:
+        serializer.write(f, jsonl_entries)
             
     print('Data written successfully to:', output_file_path, '!')
     
-def map_float_to_cat_idx(float_value: float) -> int:
+def resolve_thresholds(input_file_path: str, 
+                       n_categories: int, 
+                       map_option: int=0, 
+                       thresholds: list[float] | list[list[float]] | str | None=None, 
+                       chunksize: int | None=None
+                       ) -> np.ndarray:
+    """Get the thresholds of the categories of each dimension.
+    
+    With thresholds='balanced', the V/A/D values are read once, chunk by chunk, into a QuantileSketch 
+    (see common.binning), and the thresholds of each dimension are the ones that split its rows 
+    into n_categories categories of about the same size. 
+    With thresholds='uniform', the scale [0, 5] is split into n_categories intervals of the same width, 
+    e.g., [1.25, 2.5, 3.75] for 4 categories, like map_option 1.
+
+    Args:
+        input_file_path (str): a valid path to the input file, read only with thresholds='balanced'
+        n_categories (int): the number of categories, i.e., len(float_to_cat_list)
+        map_option (int, optional): the key of the thresholds in MAP_OPTION_THRESHOLDS. Defaults to 0.
+        thresholds (list[float] | list[list[float]] | str, optional): see emotivITA. Defaults to None.
+        chunksize (int, optional): the number of rows per chunk of the balanced pass. Defaults to None.
+
+    Raises:
+        ValueError: If the thresholds do not make n_categories categories, or if they are a string other than 
+    'balanced' and 'uniform'.
+
+    Returns:
+        np.ndarray: the thresholds of each dimension, shape (3, n_categories - 1)
+    """
+    if isinstance(thresholds, str) and thresholds not in THRESHOLD_MODES:
+        raise ValueError(f"Invalid thresholds: {thresholds}. Choose one from {THRESHOLD_MODES} or give a list.")
+    if thresholds is None:
+        thresholds = MAP_OPTION_THRESHOLDS[map_option]
+    elif thresholds == 'uniform':
+        thresholds = uniform_thresholds(n_categories)
+    elif thresholds == 'balanced':
+        sketch = QuantileSketch(n_columns=len(DIMENSIONS))
+        for data in read_data(input_file_path, chunksize, ['V', 'A', 'D']):
+            sketch.update(data[['V', 'A', 'D']].to_numpy(dtype=float))
+        thresholds = sketch.balanced_thresholds(n_categories)
+    
+    table = as_threshold_table(thresholds, len(DIMENSIONS))
+    if table.shape[1] != n_categories - 1:
+        raise ValueError(f"{n_categories} categories need {n_categories - 1} thresholds, got {table.shape[1]}")
+    return table
+    
+def map_float_to_cat_idx(float_value: float, map_option: int=0) -> int:
     """This function maps a float value to the index of the corresponding category.
     
     If map_option == 0:
-        [0.0,2.5) -> "bassa" -> idx 0 \\
-        [2.5, 4.0) -> "media" -> idx 1 \\
-        [4.0, 5.0] -> "alta" -> idx 2 \\
+        [0.0, 3.2) -> "Bassa" -> idx 0 \\
+        [3.2, 3.8) -> "Media" -> idx 1 \\
+        [3.8, 5.0] -> "Alta" -> idx 2 \\
         
     If map_option == 1:
         "Bassa" (Low): 0 ≤ value < 1.25 -> idx 0 \\
@@ -161,63 +448,25 @@ def map_float_to_cat_idx(float_value: float) -> int:
 
     Args:
         float_value (float): A float value from the dataset in range [0.0,5.0]
+        map_option (int, optional): the key of the thresholds in MAP_OPTION_THRESHOLDS. Defaults to 0.
 
     Returns:
         int: The index of the category that the float value belongs to.
     """
+    return int(bin_values(np.array([float_value]), MAP_OPTION_THRESHOLDS[map_option])[0])
     
-    if args.map_option == 0:
-        if float_value < 3.2:
-            return 0
-        elif float_value < 3.8:
-            return 1
-        else:
-            return 2
-    else:
-        if float_value < 1.25:
-            return 0
-        elif float_value < 2.5:
-            return 1
-        elif float_value < 3.75:
-            return 2
-        else:
-            return 3
-    
-def shuffle_labels_func(float_to_cat_list: list[str], 
-                        label_index: int, 
-                        verbose: bool=False
-                        ) -> tuple[list[str], int] :
-    """Shuffle the choices so that the model learns not just the ordering of the labels, 
-    but the actual semantic meaning of them. 
-    Note that there is a paper on this that models sometimes memorize the ordering of the labels, 
-    and that if the ordering is changed, there may be some (drastic) drop in accuracy.
+def map_float_array_to_cat_idx(float_values: np.ndarray, map_option: int=0) -> np.ndarray:
+    """Array version of map_float_to_cat_idx: maps every float value to the index of its category at once.
 
     Args:
-        float_to_cat_list (list(str)): the string of choices to shuffle
-        label_index (int): the index of the choice that is true among the choices
-        verbose (bool, optional): whether to print or not. Defaults to False.
+        float_values (np.ndarray): float values from the dataset in range [0.0,5.0], shape (n_rows,) or (n_rows, 3)
+        map_option (int, optional): the key of the thresholds in MAP_OPTION_THRESHOLDS. Defaults to 0.
 
     Returns:
-        choices (list(str)): the shuffled choices (float_to_cat_list)
-        label_index (int): the shuffle index of the original choice in the shuffled choices
+        np.ndarray: the category indices, same shape as float_values.
     """
+    return bin_values(float_values, MAP_OPTION_THRESHOLDS[map_option])
     
-    choices = copy.deepcopy(float_to_cat_list)
-    
-    # Get the labels from the choices. str
-    label_str = choices[label_index]
-    if verbose: print(f"Before shuffle {choices=}, {label_str=}, {label_index=}")
-
-    # shuffle labels so that the model doesn't memorize the ordering.
-    random.shuffle(choices)
-    
-    # Get the index of the original label in the shuffled choices
-    label_index = choices.index(label_str)
-    if verbose: print(f"After shuffle {choices=}, {label_str=}, {label_index=}")
-    
-    # Return the shuffled choices and the index of the original label.
-    return choices, label_index
-
 if __name__ == '__main__':
     
     # Download the EmotivITA dataset files from the URL 
@@ -248,9 +497,9 @@ if __name__ == '__main__':
         "--map_option",
         type=int,
         default=0,
-        help="""0 for   [0.0, 2.5) -> "Bassa"
-                        [2.5, 4.0) -> "Media"
-                        [4.0, 5.0] -> "Alta" \n
+        help="""0 for   [0.0, 3.2) -> "Bassa"
+                        [3.2, 3.8) -> "Media"
+                        [3.8, 5.0] -> "Alta" \n
                         AND \n
                 1 for   [0.0,1.25) -> "Bassa"
                         [1.25, 2.5) -> "Media"
@@ -258,21 +507,119 @@ if __name__ == '__main__':
                         [3.75, 5] -> "Molto Alta"
                         """
     )
+    parser.add_argument(
+        "--thresholds",
+        type=str,
+        nargs='+',
+        default=None,
+        help="The thresholds of the categories instead of the ones of --map_option (e.g., --thresholds 3.0 3.5 4.0), "
+             "'balanced' to give each category about the same number of rows of each dimension, "
+             "or 'uniform' for categories of the same width over the scale [0, 5]."
+    )
+    parser.add_argument(
+        "--categories",
+        type=str,
+        nargs='+',
+        default=None,
+        help="The names of the categories, one more than the thresholds. Defaults to the ones of --map_option."
+    )
+    parser.add_argument(
+        "--seed",
+        type=int,
+        default=SEED,
+        help="The global seed of the shuffle. The ordering of the choices of a row depends only on it and on the id of the row."
+    )
+    parser.add_argument(
+        "--chunksize",
+        type=int,
+        default=None,
+        help="Stream the input by chunks of this many rows, with a flat memory usage (e.g., --chunksize 100000)."
+    )
+    parser.add_argument(
+        "--json_backend",
+        type=str,
+        default='auto',
+        choices=BACKENDS,
+        help="The JSON encoder. 'auto' uses orjson or msgspec if installed, else the standard json module."
+    )
+    parser.add_argument(
+        "--no_cache",
+        action='store_true',
+        default=False,
+        help="Convert everything again, even if the input and the arguments did not change since the last run."
+    )
+    parser.add_argument(
+        "--columnar",
+        action='store_true',
+        default=False,
+        help="Also write each dimension as a memory-mappable columnar folder (.cols) next to its JSONL file."
+    )
+    parser.add_argument(
+        "--shared_text",
+        action="store_true",
+        help="Write the three dimensions as one folder (e.g., EmotivITA_dev.shared) with each distinct text stored once, instead of the three JSONL files."
+    )
+    parser.add_argument(
+        "--dedup",
+        type=str,
+        default=None,
+        choices=DEDUP_MODES,
+        help="Find the exact and near duplicate texts and report them ('flag'), or also drop the rows leaked from the --dedup_against splits ('drop')."
+    )
+    parser.add_argument(
+        "--dedup_against",
+        type=str,
+        nargs='+',
+        default=None,
+        help="The duplicate indexes of the other splits (e.g., EmotivITA/EmotivITA_dev.dedup.npz). Defaults to the index of the dev set with --test, if it exists."
+    )
+    parser.add_argument(
+        "--shards",
+        type=int,
+        default=None,
+        help="Write each dimension as this many shards with the same balance of the categories, e.g., EmotivITA_Valence_dev.shard-00-of-04.jsonl."
+    )
+    parser.add_argument(
+        "--split",
+        type=float,
+        nargs='+',
+        default=None,
+        help="Write each dimension as stratified train/val(/test) files with these fractions instead, e.g., --split 0.8 0.1 0.1."
+    )
     parser.add_argument(
         "--download",
         action='store_true',
         default=False,
         help="Whether to download the EmotivITA dataset or not."
     )
+    parser.add_argument(
+        "--lemmatize",
+        action='store_true',
+        default=False,
+        help="After the conversion, tokenize and lemmatize each distinct text once with spaCy into the lemma cache (see common/lemma_cache.py)."
+    )
+    parser.add_argument(
+        "--n_process",
+        type=int,
+        default=-1,
+        help="The number of spaCy processes of --lemmatize, -1 for all the CPUs."
+    )
+    parser.add_argument(
+        "--metrics",
+        action='store_true',
+        default=False,
+        help="Write the time, rows and rows/s of each stage and the histogram of the categories to EmotivITA_<split>.metrics.json."
+    )
+    parser.add_argument(
+        "--profile",
+        action='store_true',
+        default=False,
+        help="Run the conversion under cProfile, print the slowest functions and save the stats to EmotivITA_<split>.prof."
+    )
     args = parser.parse_args()
     
     # If true, then use the test set instead of the development set.
-    if args.test:
-        input_file_path = 'EmotivITA\save_folder\Test set - Gold labels.csv'
-        output_file_path = 'EmotivITA\EmotivITA_{}_test.jsonl'
-    else:
-        input_file_path = 'EmotivITA\save_folder\Development set.csv'
-        output_file_path = 'EmotivITA\EmotivITA_{}_dev.jsonl'
+    input_file_path, output_file_path = split_paths('test' if args.test else 'dev')
         
     if args.map_option == 0:
         float_to_cat_list = ['Bassa', 'Media', 'Alta']
@@ -280,16 +627,47 @@ if __name__ == '__main__':
         float_to_cat_list = ['Bassa', 'Media', 'Alta', 'Molto Alta']
     else:
         raise ValueError("args.map_option must be 0 or 1")
+    if args.categories is not None:
+        float_to_cat_list = args.categories
     
-    repo_url = "https://api.github.com/repos/GiovanniGafa/EmoITA/contents/"
-    save_folder = "EmotivITA/save_folder"
-
-    # Create the save folder if it doesn't exist
-    os.makedirs(save_folder, exist_ok=True)
-
-    download_csv_files(repo_url, save_folder)
+    if args.thresholds is None:
+        thresholds = None
+    elif len(args.thresholds) == 1 and args.thresholds[0] in THRESHOLD_MODES:
+        thresholds = args.thresholds[0]
+    else:
+        thresholds = [float(threshold) for threshold in args.thresholds]
+        if len(thresholds) + 1 != len(float_to_cat_list):
+            parser.error(f"{len(thresholds)} thresholds make {len(thresholds) + 1} categories: "
+                         f"give their names with --categories (got {float_to_cat_list})")
+    
+    if args.shards is not None and args.split is not None:
+        parser.error("--shards and --split are exclusive: choose one")
+    split = args.shards if args.shards is not None else args.split
+    
+    # The test set is checked for leaks from the dev set, once the dev set has been converted with --dedup
+    dev_dedup_index = dedup_index_path(split_paths('dev')[1])
+    if args.dedup and args.dedup_against is None and args.test and os.path.exists(dev_dedup_index):
+        args.dedup_against = [dev_dedup_index]
+    
+    if args.download:
+        # Create the save folder if it doesn't exist
+        os.makedirs(SAVE_FOLDER, exist_ok=True)
+        download_csv_files(REPO_URL, SAVE_FOLDER)
+    
+    metrics = Metrics(enabled=args.metrics, converter='emotivITA', input_file_path=input_file_path, chunksize=args.chunksize)
+    with profiled(profile_path(output_file_path) if args.profile else None):
+        emotivITA(input_file_path, output_file_path, float_to_cat_list, args.shuffle_labels, args.verbose, 
+                  map_option=args.map_option, seed=args.seed, chunksize=args.chunksize, json_backend=args.json_backend, 
+                  use_cache=not args.no_cache, columnar=args.columnar, shared_text=args.shared_text, 
+                  dedup=args.dedup, dedup_against=args.dedup_against, thresholds=thresholds, metrics=metrics, 
+                  split=split)
+    if args.metrics:
+        metrics.write(metrics_path(output_file_path))
     
-    emotivITA(input_file_path, output_file_path, float_to_cat_list, args.shuffle_labels, args.verbose)
+    if args.lemmatize:
+        # The three dimensions share their texts, so each text is analyzed once
+        fill_cache((text for data in read_data(input_file_path, args.chunksize, ['text']) for text in data['text'].tolist()), 
+                   cache_path=LEMMA_CACHE_PATH, n_process=args.n_process)
     
     
     
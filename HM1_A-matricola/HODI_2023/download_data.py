@@ -1,45 +1,223 @@
 # This part is for downloading the password-protected HODI dataset zip file
 
 import os
+import json
+import hashlib
 import requests
 import pyzipper
+from contextlib import contextmanager
+from concurrent.futures import ProcessPoolExecutor
 
-def download_file(url, save_path):
+def download_file(url, save_path, cache_dir=None, session=None, expected_sha256=None, chunk_size=1 << 16):
     """Download the password-protected HODI dataset zip file from the URL and save it to the specified path.
+    
+    The download is cached:
+        - If the file was already downloaded, one HEAD request with If-None-Match/If-Modified-Since checks 
+        whether the remote file changed. If not, nothing is downloaded.
+        - An interrupted download is kept as save_path + '.part' and resumed with an HTTP Range request,
+        guarded by If-Range so that a changed remote file is downloaded again from the start.
+        - The SHA-256 of the file is kept in the cache directory together with the ETag/Last-Modified of the URL, 
+        and the local file is checked against it before being reused.
 
     Args:
         url (str): the GitHub URL of the zip file
         save_path (str): the path to save the downloaded file
+        cache_dir (str, optional): where to keep the validators and the checksum. 
+    Defaults to None, i.e., a .download_cache folder next to save_path.
+        session (requests.Session, optional): the session to use, e.g., to reuse connections. Defaults to None.
+        expected_sha256 (str, optional): if given, the downloaded file must have this SHA-256. Defaults to None.
+        chunk_size (int, optional): the size of the chunks written to the disk. Defaults to 64 KiB.
 
     Returns:
-        bool: True if the file was downloaded successfully, False otherwise
+        bool: True if the file was downloaded successfully or is up to date, False otherwise
     """
-    with requests.get(url, stream=True) as response:
-        if response.status_code == 200:
-            with open(save_path, 'wb') as f:
-                for chunk in response.iter_content(chunk_size=8192):
-                    f.write(chunk)
-            print(f"File downloaded successfully to: {save_path}")
+    session = session or requests.Session()
+    cache = DownloadCache(url, save_path, cache_dir)
+    
+    # Revalidate the local copy with a single HEAD request
+    if cache.local_file_is_valid():
+        response = session.head(url, headers=cache.conditional_headers(), allow_redirects=True)
+        if response.status_code == 304 or (response.status_code == 200 and cache.matches(response.headers)):
+            print(f"File is up to date: {save_path}")
             return True
+    
+    partial_path = save_path + '.part'
+    headers = {}
+    if os.path.exists(partial_path) and cache.validator():
+        # Resume from the end of the partial file, only if the remote file is still the same (If-Range)
+        headers = {'Range': f'bytes={os.path.getsize(partial_path)}-', 'If-Range': cache.validator()}
+    
+    with session.get(url, headers=headers, stream=True) as response:
+        if response.status_code == 206:
+            mode = 'ab'
+            print(f"Resuming the download of {url} from byte {os.path.getsize(partial_path)}")
+        elif response.status_code == 200:
+            mode = 'wb'
+            # Keep the validators of this response, so that the partial file can be resumed if the transfer breaks
+            cache.update(response.headers, sha256=None)
+        elif response.status_code == 416 and headers:
+            # The partial file is already complete, it was interrupted before being moved in place
+            mode = None
         else:
             print(f"Failed to download file from: {url}")
             return False
+        
+        if mode is not None:
+            with open(partial_path, mode) as f:
+                for chunk in response.iter_content(chunk_size=chunk_size):
+                    f.write(chunk)
+    
+    sha256 = file_sha256(partial_path)
+    if expected_sha256 is not None and sha256 != expected_sha256:
+        os.remove(partial_path)
+        print(f"Checksum mismatch for {url}: expected {expected_sha256}, got {sha256}")
+        return False
+    
+    os.replace(partial_path, save_path)
+    cache.update(response.headers if response.status_code == 200 else {}, sha256=sha256)
+    print(f"File downloaded successfully to: {save_path}")
+    return True
+
+def file_sha256(file_path):
+    """The SHA-256 of the content of a file, read by blocks of 1 MiB."""
+    digest = hashlib.sha256()
+    with open(file_path, 'rb') as f:
+        while block := f.read(1 << 20):
+            digest.update(block)
+    return digest.hexdigest()
 
-def unzip_file(zip_path, extract_dir, password=None):
+class DownloadCache:
+    """The ETag, Last-Modified and SHA-256 of a downloaded file, saved as JSON in the cache directory."""
+    
+    def __init__(self, url, save_path, cache_dir=None):
+        self.url = url
+        self.save_path = save_path
+        cache_dir = cache_dir or os.path.join(os.path.dirname(os.path.abspath(save_path)), '.download_cache')
+        os.makedirs(cache_dir, exist_ok=True)
+        self.cache_path = os.path.join(cache_dir, os.path.basename(save_path) + '.json')
+        
+        try:
+            with open(self.cache_path, encoding='utf-8') as f:
+                self.entry = json.load(f)
+        except (FileNotFoundError, json.JSONDecodeError):
+            self.entry = {}
+        if self.entry.get('url') != url:
+            self.entry = {'url': url}
+    
+    def local_file_is_valid(self):
+        """Whether the local file exists and has the SHA-256 of the last complete download."""
+        if not self.entry.get('sha256') or not os.path.exists(self.save_path):
+            return False
+        
+        # Hash the file only if it was modified since it was checked
+        stat = os.stat(self.save_path)
+        if [stat.st_size, stat.st_mtime_ns] == self.entry.get('stat'):
+            return True
+        if file_sha256(self.save_path) != self.entry['sha256']:
+            return False
+        self.entry['stat'] = [stat.st_size, stat.st_mtime_ns]
+        self._save()
+        return True
+    
+    def validator(self):
+        """The ETag, else the Last-Modified date, of the cached file. None if the server gave neither."""
+        return self.entry.get('etag') or self.entry.get('last_modified')
+    
+    def conditional_headers(self):
+        headers = {}
+        if self.entry.get('etag'):
+            headers['If-None-Match'] = self.entry['etag']
+        if self.entry.get('last_modified'):
+            headers['If-Modified-Since'] = self.entry['last_modified']
+        return headers
+    
+    def matches(self, headers):
+        """Whether the response headers describe the cached file, for servers that ignore the conditional headers."""
+        if headers.get('ETag') and self.entry.get('etag'):
+            return headers['ETag'] == self.entry['etag']
+        if headers.get('Last-Modified') and self.entry.get('last_modified'):
+            return headers['Last-Modified'] == self.entry['last_modified']
+        return False
+    
+    def update(self, headers, sha256):
+        if headers:
+            self.entry['etag'] = headers.get('ETag')
+            self.entry['last_modified'] = headers.get('Last-Modified')
+        self.entry['sha256'] = sha256
+        if sha256 is not None:
+            stat = os.stat(self.save_path)
+            self.entry['stat'] = [stat.st_size, stat.st_mtime_ns]
+        self._save()
+    
+    def _save(self):
+        with open(self.cache_path, 'w', encoding='utf-8') as f:
+            json.dump(self.entry, f, indent=2)
+
+def unzip_file(zip_path, extract_dir, password=None, max_workers=None):
     """Unzip the password-protected HODI dataset zip file to the specified directory.
     
     Make sure to have already installed the pyzipper (pip install pyzipper)
+    
+    The members are decrypted and decompressed in parallel, one process per member, 
+    since the decryption runs in pure Python and holds the GIL.
 
     Args:
         zip_path (str): the path to the zip file
         extract_dir (str): the directory to extract the zip file
         password (str, optional): the password to decrypt the zip file. Defaults to None.
+        max_workers (int, optional): the maximum number of processes. Defaults to None, i.e., one per member up to the CPU count.
+    """
+    with pyzipper.AESZipFile(zip_path, 'r', compression=pyzipper.ZIP_LZMA) as zf:
+        members = zf.namelist()
+    
+    max_workers = min(len(members), max_workers or os.cpu_count() or 1)
+    if max_workers <= 1:
+        for member in members:
+            extract_member(zip_path, member, extract_dir, password)
+    else:
+        with ProcessPoolExecutor(max_workers=max_workers) as executor:
+            list(executor.map(extract_member, *zip(*[(zip_path, member, extract_dir, password) for member in members])))
+    print(f"File unzipped successfully to: {extract_dir}")
+
+def extract_member(zip_path, member, extract_dir, password=None):
+    """Extract a single member of the zip file. Each call opens its own handle, so it can run in another process.
+
+    Args:
+        zip_path (str): the path to the zip file
+        member (str): the name of the member in the zip file
+        extract_dir (str): the directory to extract the member
+        password (str, optional): the password to decrypt the zip file. Defaults to None.
+
+    Returns:
+        str: the path of the extracted file
     """
     with pyzipper.AESZipFile(zip_path, 'r', compression=pyzipper.ZIP_LZMA) as zf:
         if password:
             zf.setpassword(password.encode())
-        zf.extractall(extract_dir)
-    print(f"File unzipped successfully to: {extract_dir}")
+        return zf.extract(member, extract_dir)
+
+@contextmanager
+def open_zip_member(zip_path, member, password=None):
+    """Open a member of the (encrypted) zip file as a binary stream, decrypted and decompressed on the fly, 
+    without extracting it to the disk.
+
+    Args:
+        zip_path (str): the path to the zip file
+        member (str): the name of the member in the zip file
+        password (str, optional): the password to decrypt the zip file. Defaults to None.
+
+    Yields:
+        BinaryIO: the content of the member
+        
+    Example:
+        with open_zip_member('HODI_2023/save_folder/HODI_2023_train.zip', 'HODI_2023_train_subtaskA.tsv', 'hodi23evalita') as f:
+            data = pd.read_csv(f, sep='\t')
+    """
+    with pyzipper.AESZipFile(zip_path, 'r', compression=pyzipper.ZIP_LZMA) as zf:
+        if password:
+            zf.setpassword(password.encode())
+        with zf.open(member) as f:
+            yield f
     
 def download_and_unzip(zip_url, zip_save_path, extract_dir):
     """Download the password-protected HODI dataset zip file from the URL 
@@ -58,18 +236,24 @@ def download_and_unzip(zip_url, zip_save_path, extract_dir):
                            'HODI_2023/save_folder/HODI_2023_train.zip',
                            'HODI_2023/save_folder/HODI_2023_train')
     """
+    sha256_before = DownloadCache(zip_url, zip_save_path).entry.get('sha256')
+    
     # Download the password-protected ZIP file
     if download_file(zip_url, zip_save_path):
-        # Unzip the downloaded file
+        # Unzip the downloaded file, unless it is the same as the one already extracted
+        if DownloadCache(zip_url, zip_save_path).entry.get('sha256') == sha256_before and os.path.isdir(extract_dir):
+            print(f"Already unzipped to: {extract_dir}")
+            return
         unzip_file(zip_save_path, extract_dir, password="hodi23evalita")
     
 if __name__ == "__main__":
-    # URL and file paths
+    # URL and file paths, next to this file whatever the working directory
+    hodi_dir = os.path.dirname(os.path.abspath(__file__))
     zip_url = "https://github.com/HODI-EVALITA/HODI_2023_data/raw/main/HODI_2023_train.zip"
-    zip_save_path = "HODI_2023/save_folder/HODI_2023_train.zip"
-    extract_dir = "HODI_2023/save_folder/HODI_2023_train"
+    zip_save_path = os.path.join(hodi_dir, "save_folder", "HODI_2023_train.zip")
+    extract_dir = os.path.join(hodi_dir, "save_folder", "HODI_2023_train")
     
     # Create the save folder if it doesn't exist
-    os.makedirs("HODI_2023/save_folder", exist_ok=True)
+    os.makedirs(os.path.dirname(zip_save_path), exist_ok=True)
 
     download_and_unzip(zip_url, zip_save_path, extract_dir)
\ No newline at end of file
@@ -1,115 +1,421 @@
 import os
-import csv
-import json
-import pandas as pd
+import sys
+import numpy as np
+from contextlib import ExitStack
 
-def hodi_a(input_file_path, output_file_path, shuffle_labels=False, verbose=False):
+# Make the shared helpers in HM1_A-matricola/common importable when this file is run as a script
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from common.columnar import ColumnarWriter, columnar_path
+from common.dedup import DEDUP_MODES, DuplicateIndex, dedup_index_path, dedup_report_path
+from common.ingest import read_columns
+from common.lemma_cache import LEMMA_CACHE_PATH, fill_cache
+from common.manifest import ConversionManifest, RowCache
+from common.metrics import Metrics, metrics_path, profile_path, profiled
+from common.rationales import TOKENIZERS, RationaleBatch, index_spans, load_tokenizer, parse_rationales, tokenizer_offsets, whitespace_offsets
+from common.records import RecordBatch, encode_texts
+from common.serialization import BACKENDS, JsonlSerializer, write_encoded_chunks
+from common.sharding import StratifiedSplitter, split_file_path
+from common.shuffle import SEED, hash_keys, ordered_choices, record_keys, shuffle_labels_batch
+
+# The password of the HODI zip file
+ZIP_PASSWORD = "hodi23evalita"
+
+# The HODI files, relative to this folder rather than to the working directory
+HODI_DIR = os.path.dirname(os.path.abspath(__file__))
+ZIP_URL = "https://github.com/HODI-EVALITA/HODI_2023_data/raw/main/HODI_2023_train.zip"
+ZIP_SAVE_PATH = os.path.join(HODI_DIR, 'save_folder', 'HODI_2023_train.zip')
+EXTRACT_DIR = os.path.join(HODI_DIR, 'save_folder', 'HODI_2023_train')
+OUTPUT_FILE_PATH = os.path.join(HODI_DIR, 'HODI_2023_train_subtaskA.jsonl')
+OUTPUT_FILE_PATH_B = os.path.join(HODI_DIR, 'HODI_2023_train_subtaskB.jsonl')
+
+# The columns read from the input files of subtask A and B, the others are skipped while parsing
+READ_COLUMNS = ['id', 'text', 'homotransphobic']
+READ_COLUMNS_B = ['id', 'text', 'rationales']
+
+# The choices of subtask A, in their original order
+CHOICES = ['Vero', 'Falso']
+
+def hodi_a(input_file_path, output_file_path, shuffle_labels=False, verbose=False, seed=SEED, key_column='id', 
+           chunksize=None, json_backend='auto', use_cache=True, zip_path=None, password=None, columnar=False, 
+           dedup=None, dedup_against=None, metrics=None, split=None):
     """Reformat the data in the input file to a JSONL format in the output file.
+    
+    With chunksize set, the input is read chunk by chunk and the jsonl entries are written as they are produced, 
+    so the memory stays flat whatever the size of the input. 
+    Since each ordering of the choices depends only on the seed and the key of its row, the output is byte-identical 
+    to the one of the batch path, and to the one of any other partitioning of the rows.
+    
+    With zip_path set, input_file_path is the name of the member in the (encrypted) zip file, which is read as a stream 
+    straight out of the archive, without extracting it to the disk.
+    
+    With use_cache, the conversion is skipped when the input and the parameters did not change since the last run, 
+    and only the changed rows are converted again when some rows changed (see common.manifest).
+    
+    With columnar, the data is also written as a memory-mappable columnar folder next to the JSONL file, 
+    e.g., HODI_2023_train_subtaskA.cols (see common.columnar). It is always written in full, without reusing rows.
+    
+    With dedup, the rows go through a DuplicateIndex before the conversion (see common.dedup): the exact and near duplicate 
+    tweets are written to HODI_2023_train_subtaskA.duplicates.tsv and the index to HODI_2023_train_subtaskA.dedup.npz. 
+    The rows that duplicate a row of the dedup_against indexes (e.g., the one of another split) are leaks, dropped with 'drop'.
+    
+    With metrics, the time and the rows of each stage (read, shuffle, records, serialize, write, ...) and the histogram 
+    of the labels are recorded in it (see common.metrics.Metrics).
+    
+    With split, the data is written as N shards (split=N) or as train/val/test splits (e.g., split=[0.8, 0.1, 0.1]) 
+    in the same pass, e.g., HODI_2023_train_subtaskA.shard-00-of-04.jsonl or HODI_2023_train_subtaskA.train.jsonl, 
+    with the same ratio of homotransphobic tweets in each file (see common.sharding.StratifiedSplitter).
 
     Args:
-        input_file_path (str): a valid path to the input file
+        input_file_path (str): a valid path to the input file, or the name of the member in the zip file
         output_file_path (str): a valid path to the output file. 
         shuffle_labels (bool, optional): Shuffle the choices so that the model learns not just the ordering of the labels, 
     but the actual semantic meaning of them. Defaults to False.
         verbose (bool, optional): whether to print or not. Defaults to False. Defaults to False.
+        seed (int, optional): the global seed of the shuffle. Defaults to SEED.
+        key_column (str, optional): the column with a unique id per row. The ordering of the choices of a row depends 
+    only on the seed and on this key (or on the text if there is no such column). Defaults to 'id'.
+        chunksize (int, optional): the number of rows per chunk in the streaming mode. 
+    Defaults to None, i.e., read the whole file at once.
+        json_backend (str, optional): the JSON encoder, see JsonlSerializer. Defaults to 'auto'.
+        use_cache (bool, optional): whether to reuse the previous output, see ConversionManifest. Defaults to True.
+        zip_path (str, optional): the zip file to read the input from. Defaults to None, i.e., input_file_path is a file.
+        password (str, optional): the password to decrypt the zip file. Defaults to None.
+        columnar (bool, optional): whether to also write the columnar format, see ColumnarWriter. Defaults to False.
+        dedup (str, optional): None, or one from DEDUP_MODES: report ('flag') or also drop ('drop') the leaked rows. 
+    Defaults to None.
+        dedup_against (list[str], optional): the saved indexes of the other splits. Defaults to None.
+        metrics (Metrics, optional): where to record the metrics of the stages. Defaults to None, i.e., no metrics.
+        split (int | list[float], optional): the number of shards, or the fractions of train/val(/test). 
+    Defaults to None, i.e., a single file.
         
     Raises:
-        ValueError: If the file extension is not .tsv or .csv.
+        ValueError: If the delimiter of the file is not a tab, a comma, a semicolon or a pipe, if split is set with columnar, 
+    or if dedup is not in DEDUP_MODES.
         
     Returns:
         None
         
     Examples:
-        hodi_a('HM1_A-1936515\HODI_2023\subtaskA-train.tsv', 
-                'HM1_A-1936515\HODI_2023\subtaskA-train.jsonl',
+        hodi_a('HM1_A-1936515/HODI_2023/subtaskA-train.tsv', 
+                'HM1_A-1936515/HODI_2023/subtaskA-train.jsonl',
                 shuffle_labels=True,
                 verbose=True)
+        
+        hodi_a('HODI_2023_train_subtaskA.tsv', 
+                'HODI_2023/HODI_2023_train_subtaskA.jsonl',
+                zip_path='HODI_2023/save_folder/HODI_2023_train.zip',
+                password='hodi23evalita')
     """
     
-    file_extension = input_file_path.split('.')[-1]
-    print(f"File extension: {file_extension}")
+    if dedup is not None and dedup not in DEDUP_MODES:
+        raise ValueError(f"Invalid dedup mode: {dedup}. Choose one from {DEDUP_MODES}.")
+    if split is not None and columnar:
+        raise ValueError("split writes the JSONL files only, it cannot be combined with columnar")
+    
+    metrics = metrics if metrics is not None else Metrics(enabled=False)
+    serializer = JsonlSerializer(json_backend)
+    output_file_paths = [output_file_path]
+    if split is not None:
+        splitter = StratifiedSplitter(split, seed)
+        output_file_paths = [split_file_path(output_file_path, name) for name in splitter.names]
+    
+    # Every parameter that changes the output
+    params = {
+        'converter': 'hodi_a',
+        'shuffle_labels': shuffle_labels,
+        'seed': seed,
+        'key_column': key_column,
+        'json_backend': serializer.backend,
+        'zip_member': input_file_path if zip_path else None,
+        'columnar': columnar,
+        'dedup': dedup,
+        'split': split,
+    }
+    # The content of the reference indexes is tracked like the one of the input file
+    input_file_paths = [zip_path or input_file_path, *((dedup_against or []) if dedup else [])]
+    columnar_paths = [columnar_path(output_file_path)] if columnar else []
+    manifest = ConversionManifest(*output_file_paths, *[os.path.join(path, 'meta.json') for path in columnar_paths])
+    if use_cache and manifest.is_up_to_date(input_file_paths, params):
+        print('Up to date, skipped: %s' % ', '.join(output_file_paths))
+        return
+    # The columnar folder and the splits are written in full, so there is no row to reuse with them
+    row_cache = manifest.row_cache(params) if use_cache and not columnar and split is None else RowCache()
+    
+    # Each stage of the generator pipeline is timed on its own, see Metrics.timed
+    data_chunks = metrics.timed(read_data(input_file_path, chunksize, zip_path, password, [key_column, *READ_COLUMNS[1:]]), 
+                                'read', rows=len)
+    if dedup:
+        duplicate_index = DuplicateIndex(dedup_against, drop=dedup == 'drop')
+        data_chunks = metrics.timed(duplicate_index.stage(data_chunks, key_column), 'dedup', rows=len)
+    # The labels of the reused rows are counted too, so the histogram is the one of the whole output
+    data_chunks = metrics.timed(row_cache.filter(data_chunks, [key_column, 'text', 'homotransphobic'], 
+                                                 lambda reused: count_labels(reused, metrics)), 'cache', rows=len)
+    entries_chunks = hodi_a_chunks(data_chunks, shuffle_labels, verbose, seed, key_column, metrics)
+    entries_chunks = metrics.timed(entries_chunks, 'records', rows=lambda batches: len(batches[0]))
+    if split is not None:
+        entries_chunks = metrics.timed(splitter.split(entries_chunks), 'split', rows=lambda batches: sum(map(len, batches)))
 
-    # Read the data from a .tsv or .csv file
-    if file_extension == 'tsv':
-        data = pd.read_csv(input_file_path, sep='\t')
-    elif file_extension == 'csv':
-        data = pd.read_csv(input_file_path)
-    else:
-        raise ValueError(f'Invalid file format for the file: {input_file_path}. Only .tsv and .csv files are supported.')
+    with ExitStack() as stack:
+        for path in columnar_paths:
+            writer = stack.enter_context(ColumnarWriter(path, ordered_choices(CHOICES)))
+            entries_chunks = metrics.timed(writer.tap(entries_chunks), 'columnar', rows=lambda batches: len(batches[0]))
+
+        # Write the jsonl entries to a file
+        encoded_chunks = metrics.timed(row_cache.merge(entries_chunks, serializer), 'serialize', 
+                                       rows=lambda encoded: sum(lines.count(b'\n') for lines in encoded))
+        with metrics.stage('write'):
+            write_encoded_chunks(output_file_paths, encoded_chunks)
+        metrics.add_rows('write', metrics.stages.get('serialize', {}).get('rows', 0))
+    manifest.record(input_file_paths, params, row_cache.all_digests())
+    for path in output_file_paths:
+        metrics.add_output(path)
+
+    print('Data written to: %s (%d unchanged rows reused)' % (', '.join(output_file_paths), row_cache.n_reused))
+    if split is not None:
+        print('Rows per split: %s' % splitter.summary())
+    if dedup:
+        duplicate_index.save(dedup_index_path(output_file_path))
+        duplicate_index.write_report(dedup_report_path(output_file_path))
+        print('Duplicates: %s -- see %s' % (duplicate_index.summary(), dedup_report_path(output_file_path)))
+    
+def read_data(input_file_path, chunksize=None, zip_path=None, password=None, columns=None):
+    """Read the data from a .tsv or .csv file, either at once or in chunks.
     
-    # Create a list to store the jsonl entries
-    jsonl_entries = []
+    Only the needed columns are parsed, with compact dtypes, and the delimiter and the compression 
+    are found from the content of the file (see common.ingest.read_columns).
 
-    # Iterate over each row in the data
-    for index, row in data.iterrows():
-        text = row['text']
-        label = row['homotransphobic']
-        
-        # Define the choices. 
-        # This will be modified inplace by the random.shuffle, so instantiate every time.
-        choices = ['Vero', 'Falso']
+    Args:
+        input_file_path (str): a valid path to the input file, or the name of the member in the zip file
+        chunksize (int, optional): the number of rows per chunk. Defaults to None, i.e., a single chunk.
+        zip_path (str, optional): the zip file to stream the member from. Defaults to None.
+        password (str, optional): the password to decrypt the zip file. Defaults to None.
+        columns (list[str], optional): the columns to read. Defaults to None, i.e., READ_COLUMNS.
+
+    Raises:
+        ValueError: If the delimiter of the file is not a tab, a comma, a semicolon or a pipe.
+
+    Returns:
+        Iterator[pd.DataFrame]: the chunks of the data
+    """
+    columns = columns or READ_COLUMNS
+    if zip_path is not None:
+        return _read_zip_member(zip_path, input_file_path, password, columns, chunksize)
+    # The ids are read as strings, so that they are the same keys of the shuffle whatever they look like
+    return read_columns(input_file_path, columns, chunksize)
+
+def _read_zip_member(zip_path, member, password, columns, chunksize):
+    # Keep the member open while the chunks are consumed
+    from HODI_2023.download_data import open_zip_member
+    
+    with open_zip_member(zip_path, member, password) as f:
+        yield from read_columns(f, columns, chunksize)
+    
+def hodi_a_chunks(data_chunks, shuffle_labels=False, verbose=False, seed=SEED, key_column='id', metrics=None):
+    """Lazily convert the rows of each chunk to jsonl entries.
+
+    Args:
+        data_chunks (Iterable[pd.DataFrame]): the chunks of the data, with the text and homotransphobic columns
+        shuffle_labels (bool, optional): whether to shuffle the choices. Defaults to False.
+        verbose (bool, optional): whether to print or not. Defaults to False.
+        seed (int, optional): the global seed of the shuffle. Defaults to SEED.
+        key_column (str, optional): the column with a unique id per row, see record_keys. Defaults to 'id'.
+        metrics (Metrics, optional): where to time the shuffle stage and count the labels. Defaults to None, i.e., no metrics.
+
+    Yields:
+        list[RecordBatch]: the jsonl entries of each chunk, as a single batch (one output file)
+    """
+    # Only two orderings exist, so share their lists instead of building new choices for every row.
+    choices_lists = ordered_choices(CHOICES)
+    metrics = metrics if metrics is not None else Metrics(enabled=False)
+    
+    for chunk_idx, data in enumerate(data_chunks):
+        labels = data['homotransphobic'].to_numpy()
+        count_labels(data, metrics)
         
         if shuffle_labels:
-            shuffle_choices, shuffle_label = shuffle_labels_func(choices, label, verbose)
-            if index >= 12: verbose = False
+            with metrics.stage('shuffle', len(data)):
+                key_hashes = hash_keys(record_keys(data, key_column), seed)
+                codes, shuffle_labels_ = shuffle_labels_batch(len(CHOICES), labels, key_hashes)
+        else:
+            # The row 0 of the permutation table is the original ordering
+            codes, shuffle_labels_ = np.zeros_like(labels), labels
         
-        # Create a jsonl entry
-        jsonl_entry = {
-            'text': text,
-            'choices': shuffle_choices,
-            'label': shuffle_label
-        }
+        if verbose and chunk_idx == 0:
+            for index in range(min(12, len(data))):
+                print(f"Before shuffle {CHOICES}, label_index={labels[index]}. "
+                      f"After shuffle {choices_lists[codes[index]]}, label_index={shuffle_labels_[index]}")
         
-        jsonl_entries.append(jsonl_entry)
-
-    # Write the jsonl entries to a file
-    with open(output_file_path, 'w', encoding='utf-8') as f:
-        for entry in jsonl_entries:
-            json_string = json.dumps(entry, ensure_ascii=False)
-            f.write(json_string + '\n')
+        # Create the jsonl entries
+        text_buffer, text_offsets = encode_texts(data['text'].tolist())
+        yield [RecordBatch(text_buffer, text_offsets, shuffle_labels_, codes, choices_lists)]
+    
+def count_labels(data, metrics):
+    """Count the labels of a chunk in the histogram of the metrics."""
+    if metrics.enabled:
+        metrics.add_histogram('homotransphobic', dict(enumerate(np.bincount(data['homotransphobic'], minlength=2).tolist())))
 
-    print('Data written to: %s' % output_file_path)
+def count_spans(data, metrics):
+    """Count the rows of a chunk by number of rationale spans in the histogram of the metrics."""
+    if metrics.enabled:
+        n_spans = np.diff(index_spans(*parse_rationales(data['rationales'].tolist()))[2])
+        metrics.add_histogram('spans', dict(enumerate(np.bincount(n_spans).tolist())))
+    
+def hodi_b(input_file_path, output_file_path, tokenizer='whitespace', verbose=False, key_column='id', chunksize=None, 
+           json_backend='auto', use_cache=True, zip_path=None, password=None, metrics=None):
+    """Reformat the rationales of subtask B to a JSONL format in the output file, with their labels aligned to a tokenizer.
     
-def shuffle_labels_func(choices, label_index, verbose=False):
-    """Shuffle the choices so that the model learns not just the ordering of the labels, 
-    but the actual semantic meaning of them. 
-    Note that there is a paper on this that models sometimes memorize the ordering of the labels, 
-    and that if the ordering is changed, there may be some (drastic) drop in accuracy.
+    The rationales column lists the indices of the characters of the text that make it homotransphobic, e.g., '[0, 1, 2]', 
+    and is empty for the other tweets. Each chunk is parsed at once into compact span arrays (see common.rationales), 
+    and the labels of the tokens are computed from their character offsets for the whole chunk, without a loop over the tokens.
+    
+    Each entry is {"text": str, "rationales": [[start, end], ...], "offsets": [[start, end], ...], "labels": list[int]}: 
+    the [start, end) character spans of the rationales, the character offsets of the tokens, and the label of each token, 
+    1 if it overlaps a rationale, 0 if not, -100 if it covers no character (the special tokens of a transformer). 
+    With tokenizer='char', the labels are the ones of the characters and there are no offsets.
+    
+    The chunks, the cache and the metrics work as in hodi_a.
 
     Args:
-        choices (list(str)): the string of choices to shuffle
-        label_index (int): the index of the choice that is true among the choices
-        verbose (bool, optional): whether to print or not. Defaults to False.
-
+        input_file_path (str): a valid path to the input file, or the name of the member in the zip file
+        output_file_path (str): a valid path to the output file. 
+        tokenizer (str, optional): 'char', 'whitespace', or the name of a Hugging Face fast tokenizer 
+    (e.g., 'dbmdz/bert-base-italian-cased'), which requires transformers. Defaults to 'whitespace'.
+        verbose (bool, optional): whether to print the rationales of the first rows. Defaults to False.
+        key_column (str, optional): the column with a unique id per row, used to find the unchanged rows. Defaults to 'id'.
+        chunksize (int, optional): the number of rows per chunk in the streaming mode. 
+    Defaults to None, i.e., read the whole file at once.
+        json_backend (str, optional): the JSON encoder, see JsonlSerializer. Defaults to 'auto'.
+        use_cache (bool, optional): whether to reuse the previous output, see ConversionManifest. Defaults to True.
+        zip_path (str, optional): the zip file to read the input from. Defaults to None, i.e., input_file_path is a file.
+        password (str, optional): the password to decrypt the zip file. Defaults to None.
+        metrics (Metrics, optional): where to record the metrics of the stages. Defaults to None, i.e., no metrics.
+        
+    Raises:
+        ValueError: If the delimiter of the file is not a tab, a comma, a semicolon or a pipe, 
+    if a rationale is not a list of character indices of its text, or if the tokenizer needs transformers and it is not installed.
+        
     Returns:
-        choices (list(str)): the shuffled choices
-        label_index (int): the shuffle index of the original choice in the shuffled choices
+        None
+        
+    Examples:
+        hodi_b('HODI_2023/save_folder/HODI_2023_train/HODI_2023_train_subtaskB.tsv', 
+                'HODI_2023/HODI_2023_train_subtaskB.jsonl',
+                tokenizer='whitespace')
     """
-    import random
-    # random.seed(49)
     
-    # Get the labels from the choices. str
-    label_str = choices[label_index]
-    if verbose: print(f"Before shuffle {choices=}, {label_str=}, {label_index=}")
-
-    # shuffle labels so that the model doesn't memorize the ordering.
-    random.shuffle(choices)
+    metrics = metrics if metrics is not None else Metrics(enabled=False)
+    serializer = JsonlSerializer(json_backend)
+    
+    # Every parameter that changes the output
+    params = {
+        'converter': 'hodi_b',
+        'tokenizer': tokenizer,
+        'key_column': key_column,
+        'json_backend': serializer.backend,
+        'zip_member': input_file_path if zip_path else None,
+    }
+    input_file_paths = [zip_path or input_file_path]
+    manifest = ConversionManifest(output_file_path)
+    if use_cache and manifest.is_up_to_date(input_file_paths, params):
+        print('Up to date, skipped: %s' % output_file_path)
+        return
+    row_cache = manifest.row_cache(params) if use_cache else RowCache()
+    # Load the tokenizer once for all the chunks
+    tokenizer = tokenizer if tokenizer in TOKENIZERS else load_tokenizer(tokenizer)
     
-    # Get the index of the original label in the shuffled choices
-    label_index = choices.index(label_str)
-    if verbose: print(f"After shuffle {choices=}, {label_str=}, {label_index=}")
+    data_chunks = metrics.timed(read_data(input_file_path, chunksize, zip_path, password, [key_column, *READ_COLUMNS_B[1:]]), 
+                                'read', rows=len)
+    # The spans of the reused rows are counted too, as in hodi_a
+    data_chunks = metrics.timed(row_cache.filter(data_chunks, [key_column, 'text', 'rationales'], 
+                                                 lambda reused: count_spans(reused, metrics)), 'cache', rows=len)
+    entries_chunks = hodi_b_chunks(data_chunks, tokenizer, verbose, metrics)
+    entries_chunks = metrics.timed(entries_chunks, 'records', rows=lambda entries: len(entries[0]))
     
-    # Return the shuffled choices and the index of the original label.
-    return choices, label_index
+    encoded_chunks = metrics.timed(row_cache.merge(entries_chunks, serializer), 'serialize', 
+                                   rows=lambda encoded: encoded[0].count(b'\n'))
+    with metrics.stage('write'):
+        write_encoded_chunks([output_file_path], encoded_chunks)
+    metrics.add_rows('write', metrics.stages.get('serialize', {}).get('rows', 0))
+    manifest.record(input_file_paths, params, row_cache.all_digests())
+    metrics.add_output(output_file_path)
+    
+    print('Data written to: %s (%d unchanged rows reused)' % (output_file_path, row_cache.n_reused))
+    
+def hodi_b_chunks(data_chunks, tokenizer='whitespace', verbose=False, metrics=None):
+    """Lazily convert the rows of each chunk to jsonl entries with their rationale spans and labels.
+
+    Args:
+        data_chunks (Iterable[pd.DataFrame]): the chunks of the data, with the text and rationales columns
+        tokenizer (str | PreTrainedTokenizerFast, optional): 'char', 'whitespace', or a loaded fast tokenizer. 
+    Defaults to 'whitespace'.
+        verbose (bool, optional): whether to print the rationales of the first rows. Defaults to False.
+        metrics (Metrics, optional): where to time the parse and align stages and count the spans. Defaults to None, i.e., no metrics.
 
+    Yields:
+        list[list[dict]]: the jsonl entries of each chunk, as a single list (one output file)
+    """
+    metrics = metrics if metrics is not None else Metrics(enabled=False)
+    
+    for chunk_idx, data in enumerate(data_chunks):
+        texts = data['text'].tolist()
+        with metrics.stage('parse', len(data)):
+            batch = RationaleBatch(texts, *parse_rationales(data['rationales'].tolist()))
+        if metrics.enabled:
+            metrics.add_histogram('spans', dict(enumerate(np.bincount(batch.n_spans()).tolist())))
+        
+        with metrics.stage('align', len(data)):
+            if tokenizer == 'char':
+                labels, token_offsets = batch.char_mask, batch.char_offsets
+                offsets = None
+            else:
+                if tokenizer == 'whitespace':
+                    starts, ends, token_offsets = whitespace_offsets(texts)
+                else:
+                    starts, ends, token_offsets = tokenizer_offsets(texts, tokenizer)
+                labels = batch.token_labels(starts, ends, token_offsets)
+                offsets = np.stack([starts, ends], axis=1).tolist()
+            
+            # One list per chunk, sliced per row, instead of a conversion per token
+            labels = labels.tolist()
+            bounds = token_offsets.tolist()
+            span_pairs = np.stack([batch.span_starts, batch.span_ends], axis=1).tolist()
+            span_bounds = batch.span_offsets.tolist()
+        
+        jsonl_entries = []
+        for idx, text in enumerate(texts):
+            entry = {'text': text, 'rationales': span_pairs[span_bounds[idx]:span_bounds[idx + 1]]}
+            if offsets is not None:
+                entry['offsets'] = offsets[bounds[idx]:bounds[idx + 1]]
+            entry['labels'] = labels[bounds[idx]:bounds[idx + 1]]
+            jsonl_entries.append(entry)
+        
+        if verbose and chunk_idx == 0:
+            for entry in jsonl_entries[:12]:
+                print(f"Rationales {[entry['text'][start:end] for start, end in entry['rationales']]}, "
+                      f"{sum(label == 1 for label in entry['labels'])}/{len(entry['labels'])} labels in a rationale")
+        yield [jsonl_entries]
+    
 if __name__ == '__main__':
     
     # Download the password-protected HODI dataset zip file from the URL 
     # and save it to the specified path
-    from download_data import download_and_unzip
+    from download_data import download_and_unzip, download_file
     
     import argparse
     parser = argparse.ArgumentParser(description='Args to be used in the HODI task')
+    parser.add_argument(
+        "--subtask",
+        type=str,
+        default='A',
+        choices=['A', 'B'],
+        help="A: the homotransphobic label of each tweet. B: the rationale spans of each tweet, with a label per token of --tokenizer."
+    )
+    parser.add_argument(
+        "--tokenizer",
+        type=str,
+        default='whitespace',
+        help="The tokens of the labels of subtask B: 'char', 'whitespace', or the name of a Hugging Face fast tokenizer (requires transformers)."
+    )
     parser.add_argument(
         "--shuffle_labels",
         action='store_true',
@@ -122,27 +428,141 @@ if __name__ == '__main__':
         default=False,
         help="Whether to before and after the shuffle."
     )
+    parser.add_argument(
+        "--seed",
+        type=int,
+        default=SEED,
+        help="The global seed of the shuffle. The ordering of the choices of a row depends only on it and on the id of the row."
+    )
+    parser.add_argument(
+        "--chunksize",
+        type=int,
+        default=None,
+        help="Stream the input by chunks of this many rows, with a flat memory usage (e.g., --chunksize 100000)."
+    )
+    parser.add_argument(
+        "--json_backend",
+        type=str,
+        default='auto',
+        choices=BACKENDS,
+        help="The JSON encoder. 'auto' uses orjson or msgspec if installed, else the standard json module."
+    )
+    parser.add_argument(
+        "--no_cache",
+        action='store_true',
+        default=False,
+        help="Convert everything again, even if the input and the arguments did not change since the last run."
+    )
+    parser.add_argument(
+        "--from_zip",
+        action='store_true',
+        default=False,
+        help="Read the TSV straight out of the zip file, without extracting it to the disk."
+    )
+    parser.add_argument(
+        "--columnar",
+        action='store_true',
+        default=False,
+        help="Also write the data as a memory-mappable columnar folder (.cols) next to the JSONL file."
+    )
+    parser.add_argument(
+        "--dedup",
+        type=str,
+        default=None,
+        choices=DEDUP_MODES,
+        help="Find the exact and near duplicate tweets and report them ('flag'), or also drop the rows leaked from the --dedup_against splits ('drop')."
+    )
+    parser.add_argument(
+        "--dedup_against",
+        type=str,
+        nargs='+',
+        default=None,
+        help="The duplicate indexes of the other splits, e.g., written by a previous --dedup run."
+    )
+    parser.add_argument(
+        "--shards",
+        type=int,
+        default=None,
+        help="Write the data as this many shards with the same ratio of the labels, e.g., HODI_2023_train_subtaskA.shard-00-of-04.jsonl."
+    )
+    parser.add_argument(
+        "--split",
+        type=float,
+        nargs='+',
+        default=None,
+        help="Write the data as stratified train/val(/test) files with these fractions instead, e.g., --split 0.8 0.1 0.1."
+    )
     parser.add_argument(
         "--download",
         action='store_true',
         default=False,
         help="Whether to download the HODI dataset or not."
     )
+    parser.add_argument(
+        "--lemmatize",
+        action='store_true',
+        default=False,
+        help="After the conversion, tokenize and lemmatize each distinct text once with spaCy into the lemma cache (see common/lemma_cache.py)."
+    )
+    parser.add_argument(
+        "--n_process",
+        type=int,
+        default=-1,
+        help="The number of spaCy processes of --lemmatize, -1 for all the CPUs."
+    )
+    parser.add_argument(
+        "--metrics",
+        action='store_true',
+        default=False,
+        help="Write the time, rows and rows/s of each stage and the histogram of the labels to HODI_2023_train_subtaskA.metrics.json."
+    )
+    parser.add_argument(
+        "--profile",
+        action='store_true',
+        default=False,
+        help="Run the conversion under cProfile, print the slowest functions and save the stats to HODI_2023_train_subtaskA.prof."
+    )
     args = parser.parse_args()
-    
-    # URL and file paths
-    zip_url = "https://github.com/HODI-EVALITA/HODI_2023_data/raw/main/HODI_2023_train.zip"
-    zip_save_path = "HODI_2023/save_folder/HODI_2023_train.zip"
-    extract_dir = "HODI_2023/save_folder/HODI_2023_train"
+    if args.shards is not None and args.split is not None:
+        parser.error("--shards and --split are exclusive: choose one")
+    if args.subtask == 'B' and (args.shuffle_labels or args.columnar or args.dedup or args.shards or args.split):
+        parser.error("--shuffle_labels, --columnar, --dedup, --shards and --split are options of subtask A")
     
     if args.download:
         # Create the save folder if it doesn't exist
-        os.makedirs("HODI_2023/save_folder", exist_ok=True)
-        download_and_unzip(zip_url, zip_save_path, extract_dir)
+        os.makedirs(os.path.dirname(ZIP_SAVE_PATH), exist_ok=True)
+        if args.from_zip:
+            download_file(ZIP_URL, ZIP_SAVE_PATH)
+        else:
+            download_and_unzip(ZIP_URL, ZIP_SAVE_PATH, EXTRACT_DIR)
 
-    input_file_path = os.path.join(extract_dir, 'HODI_2023_train_subtaskA.tsv')
-    output_file_path = 'HODI_2023\HODI_2023_train_subtaskA.jsonl'
+    output_file_path = OUTPUT_FILE_PATH if args.subtask == 'A' else OUTPUT_FILE_PATH_B
+    input_file_name = f'HODI_2023_train_subtask{args.subtask}.tsv'
+    
+    if args.from_zip:
+        input_file_path, zip_path = input_file_name, ZIP_SAVE_PATH
+    else:
+        input_file_path, zip_path = os.path.join(EXTRACT_DIR, input_file_name), None
+    
+    metrics = Metrics(enabled=args.metrics, converter=f'hodi_{args.subtask.lower()}', input_file_path=input_file_path, 
+                      chunksize=args.chunksize)
+    with profiled(profile_path(output_file_path) if args.profile else None):
+        if args.subtask == 'B':
+            hodi_b(input_file_path, output_file_path, tokenizer=args.tokenizer, verbose=args.verbose, 
+                   chunksize=args.chunksize, json_backend=args.json_backend, use_cache=not args.no_cache, 
+                   zip_path=zip_path, password=ZIP_PASSWORD, metrics=metrics)
+        else:
+            hodi_a(input_file_path, output_file_path, shuffle_labels=args.shuffle_labels, verbose=args.verbose, 
+                   seed=args.seed, chunksize=args.chunksize, json_backend=args.json_backend, 
+                   use_cache=not args.no_cache, zip_path=zip_path, password=ZIP_PASSWORD, columnar=args.columnar, 
+                   dedup=args.dedup, dedup_against=args.dedup_against, metrics=metrics, 
+                   split=args.shards if args.shards is not None else args.split)
+    if args.metrics:
+        metrics.write(metrics_path(output_file_path))
     
-    hodi_a(input_file_path, output_file_path, shuffle_labels=args.shuffle_labels, verbose=args.verbose)
+    if args.lemmatize:
+        # The texts already in the cache (e.g., from a previous run) are not analyzed again
+        fill_cache((text for data in read_data(input_file_path, args.chunksize, zip_path, ZIP_PASSWORD, ['text']) for text in data['text'].tolist()), 
+                   cache_path=LEMMA_CACHE_PATH, n_process=args.n_process)
     
 
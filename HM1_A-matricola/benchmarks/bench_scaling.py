@@ -0,0 +1,343 @@
+# This part is for measuring how the conversion stages scale with the number of rows, and for catching regressions
+
+import io
+import os
+import sys
+import json
+import time
+import platform
+import argparse
+import tempfile
+from contextlib import redirect_stdout
+from concurrent.futures import ProcessPoolExecutor
+from multiprocessing import get_context
+
+import numpy as np
+
+try:
+    import resource
+except ImportError:
+    # Not on Windows: the peak RSS is not measured there
+    resource = None
+
+# Make the shared helpers in HM1_A-matricola/common importable when this file is run as a script
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+from common.binning import bin_values
+from common.dedup import DuplicateIndex
+from common.serialization import BACKENDS, JsonlSerializer, write_encoded_chunks
+from common.shuffle import SEED, hash_keys, record_keys, shuffle_labels_batch
+from benchmarks.synthetic_corpus import corpus_path, parse_rows
+
+BENCHMARKS_DIR = os.path.dirname(os.path.abspath(__file__))
+BASELINE_PATH = os.path.join(BENCHMARKS_DIR, 'baseline_scaling.json')
+CORPUS_DIR = os.path.join(BENCHMARKS_DIR, '.corpus')
+
+# The stages of each schema. read, bin, shuffle, serialize, write and dedup are timed alone, convert is the whole conversion.
+STAGES = {
+    'emotivita': ['read', 'bin', 'shuffle', 'serialize', 'write', 'dedup', 'convert'],
+    'hodi': ['read', 'convert'],
+}
+
+CATEGORIES = ['Bassa', 'Media', 'Alta']
+
+def peak_rss_mb() -> float | None:
+    """The peak resident memory of this process so far, in MB."""
+    # On Linux, ru_maxrss keeps the peak of the parent when a spawned process is forked before its exec,
+    # while VmHWM is the peak of the memory of the new program only
+    if os.path.exists('/proc/self/status'):
+        with open('/proc/self/status') as f:
+            for line in f:
+                if line.startswith('VmHWM:'):
+                    return round(int(line.split()[1]) / 1024, 1)
+    if resource is None:
+        return None
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # Bytes on macOS, KiB elsewhere
+    return round(peak / (1 << 20 if sys.platform == 'darwin' else 1 << 10), 1)
+
+def _emotivita_stage(stage: str, corpus_file: str, chunksize: int, serializer: JsonlSerializer, output_dir: str) -> tuple[int, float, int]:
+    """Run a stage of the EmotivITA conversion on every chunk, timing that stage only.
+
+    The stages before it run on each chunk too, untimed, so that the memory is the one of the streaming conversion.
+
+    Returns:
+        tuple[int, float, int]: the number of rows, the seconds spent in the stage and the number of bytes it produced
+    """
+    from EmotivITA.scripts import DIMENSIONS, MAP_OPTION_THRESHOLDS, emotivITA_chunks, read_data
+
+    elapsed, n_rows, n_bytes = 0.0, 0, 0
+    salts = np.arange(len(DIMENSIONS))
+
+    def encoded_chunks():
+        # The lines of each chunk, read and encoded untimed, for the write stage
+        nonlocal elapsed
+        chunks = iter(read_data(corpus_file, chunksize))
+        while True:
+            start = time.perf_counter()
+            data = next(chunks, None)
+            if data is None:
+                elapsed -= time.perf_counter() - start
+                return
+            batches = next(emotivITA_chunks([data], CATEGORIES, True, False, MAP_OPTION_THRESHOLDS[0], SEED, 'id',
+                                            dict.fromkeys(CATEGORIES, 0)))
+            encoded = [serializer.encode(batch) for batch in batches]
+            elapsed -= time.perf_counter() - start
+            yield encoded
+
+    if stage == 'write':
+        output_file_paths = [os.path.join(output_dir, f'EmotivITA_{dimension}.jsonl') for dimension in DIMENSIONS]
+        start = time.perf_counter()
+        n_bytes = sum(write_encoded_chunks(output_file_paths, encoded_chunks()))
+        elapsed += time.perf_counter() - start
+        with open(output_file_paths[0], 'rb') as f:
+            n_rows = sum(1 for _ in f)
+        return n_rows, elapsed, n_bytes
+
+    duplicate_index = DuplicateIndex() if stage == 'dedup' else None
+    chunks = iter(read_data(corpus_file, chunksize))
+    while True:
+        start = time.perf_counter()
+        data = next(chunks, None)
+        if stage == 'read':
+            elapsed += time.perf_counter() - start
+        if data is None:
+            break
+        n_rows += len(data)
+        if stage == 'read':
+            n_bytes = os.path.getsize(corpus_file)
+            continue
+        if stage == 'dedup':
+            keys, texts = record_keys(data, 'id'), data['text'].astype(str).tolist()
+            start = time.perf_counter()
+            duplicate_index.check(keys, texts)
+            elapsed += time.perf_counter() - start
+            continue
+
+        values = data[['V', 'A', 'D']].to_numpy(dtype=float)
+        if stage == 'bin':
+            start = time.perf_counter()
+            cat_idx = bin_values(values, MAP_OPTION_THRESHOLDS[0])
+            elapsed += time.perf_counter() - start
+            n_bytes += cat_idx.nbytes
+        elif stage == 'shuffle':
+            cat_idx = bin_values(values, MAP_OPTION_THRESHOLDS[0])
+            start = time.perf_counter()
+            key_hashes = hash_keys(record_keys(data, 'id'), SEED)
+            codes, labels = shuffle_labels_batch(len(CATEGORIES), cat_idx, key_hashes[:, None], salts)
+            elapsed += time.perf_counter() - start
+            n_bytes += codes.nbytes + labels.nbytes
+        elif stage == 'serialize':
+            batches = next(emotivITA_chunks([data], CATEGORIES, True, False, MAP_OPTION_THRESHOLDS[0], SEED, 'id',
+                                            dict.fromkeys(CATEGORIES, 0)))
+            start = time.perf_counter()
+            encoded = [serializer.encode(batch) for batch in batches]
+            elapsed += time.perf_counter() - start
+            n_bytes += sum(map(len, encoded))
+
+    if duplicate_index is not None:
+        # The saved index, which grows with the kept rows
+        index_path = os.path.join(output_dir, 'EmotivITA.dedup.npz')
+        duplicate_index.save(index_path)
+        n_bytes = os.path.getsize(index_path)
+    return n_rows, elapsed, n_bytes
+
+def measure(schema: str, stage: str, corpus_file: str, n_rows: int, chunksize: int, json_backend: str) -> dict:
+    """Measure a stage in this process, meant to be a new one so that the peak RSS is the one of the stage.
+
+    Returns:
+        dict: the rows, seconds, rows_per_s, peak_rss_mb and bytes of the stage
+    """
+    # The converters print their progress, which is not part of the benchmark
+    with tempfile.TemporaryDirectory() as output_dir, redirect_stdout(io.StringIO()):
+        serializer = JsonlSerializer(json_backend)
+        if stage == 'convert':
+            start = time.perf_counter()
+            if schema == 'emotivita':
+                from EmotivITA.scripts import DIMENSIONS, emotivITA
+                output_file_path = os.path.join(output_dir, 'EmotivITA_{}.jsonl')
+                emotivITA(corpus_file, output_file_path, CATEGORIES, shuffle_labels=True, chunksize=chunksize,
+                          json_backend=json_backend, use_cache=False)
+                output_file_paths = [output_file_path.format(dimension) for dimension in DIMENSIONS]
+            else:
+                from HODI_2023.scripts import hodi_a
+                output_file_paths = [os.path.join(output_dir, 'HODI_2023_subtaskA.jsonl')]
+                hodi_a(corpus_file, output_file_paths[0], shuffle_labels=True, chunksize=chunksize,
+                       json_backend=json_backend, use_cache=False)
+            elapsed = time.perf_counter() - start
+            n_bytes = sum(os.path.getsize(path) for path in output_file_paths)
+        elif schema == 'hodi':
+            from HODI_2023.scripts import read_data
+            start = time.perf_counter()
+            for data in read_data(corpus_file, chunksize):
+                pass
+            elapsed = time.perf_counter() - start
+            n_bytes = os.path.getsize(corpus_file)
+        else:
+            n_rows, elapsed, n_bytes = _emotivita_stage(stage, corpus_file, chunksize, serializer, output_dir)
+
+    return {
+        'rows': n_rows,
+        'seconds': round(elapsed, 4),
+        'rows_per_s': round(n_rows / elapsed) if elapsed > 0 else None,
+        'peak_rss_mb': peak_rss_mb(),
+        'bytes': n_bytes,
+    }
+
+def run_suite(rows: list[int], schemas: list[str], stages: list[str] | None=None, chunksize: int=100_000,
+              json_backend: str='auto', repeat: int=3, corpus_dir: str=CORPUS_DIR) -> dict:
+    """Measure every (schema, stage, rows) in a new process each time, and keep the best of repeat runs.
+
+    Args:
+        rows (list[int]): the sizes of the synthetic corpora, e.g., [10_000, 100_000, 10_000_000]
+        schemas (list[str]): the datasets to generate, see STAGES
+        stages (list[str], optional): the stages to measure. Defaults to None, i.e., all of them.
+        chunksize (int, optional): the number of rows per chunk. Defaults to 100_000.
+        json_backend (str, optional): the JSON encoder. Defaults to 'auto'.
+        repeat (int, optional): the number of runs of each measure. Defaults to 3.
+        corpus_dir (str, optional): where the corpora are generated once and kept. Defaults to CORPUS_DIR.
+
+    Returns:
+        dict: the machine, the settings, and the results by 'schema/stage/rows'
+    """
+    results = {}
+    # A new process per run, so that the peak RSS of a stage does not include the previous ones
+    context = get_context('spawn')
+    for schema in schemas:
+        for n_rows in rows:
+            corpus_file = corpus_path(corpus_dir, schema, n_rows)
+            for stage in STAGES[schema]:
+                if stages and stage not in stages:
+                    continue
+                runs = []
+                for _ in range(repeat):
+                    with ProcessPoolExecutor(max_workers=1, mp_context=context) as executor:
+                        runs.append(executor.submit(measure, schema, stage, corpus_file, n_rows, chunksize, json_backend).result())
+                best = min(runs, key=lambda run: run['seconds'])
+                best['peak_rss_mb'] = min((run['peak_rss_mb'] for run in runs), default=None)
+                results[f'{schema}/{stage}/{n_rows}'] = best
+                print(f"{schema + '/' + stage:<20} {n_rows:>11,} rows {best['rows_per_s'] or 0:>13,} rows/s "
+                      f"{best['peak_rss_mb'] or 0:>9,.1f} MB peak {best['bytes']:>15,} bytes")
+
+    return {
+        'machine': {'platform': platform.platform(), 'python': platform.python_version(), 'cpus': os.cpu_count()},
+        'chunksize': chunksize,
+        'json_backend': JsonlSerializer(json_backend).backend,
+        'results': results,
+    }
+
+def compare(report: dict, baseline: dict, tolerance: float=0.25, min_seconds: float=0.05) -> list[str]:
+    """The regressions of a report against a baseline.
+
+    A measure regresses when its rows/s drop, or its peak RSS grows, by more than tolerance, or when the stage
+    produces a different number of bytes with the same JSON backend (i.e., the output changed).
+    The rows/s of the measures shorter than min_seconds in the baseline are too noisy to be compared.
+
+    Returns:
+        list[str]: one message per regression, empty if there is none
+    """
+    regressions = []
+    same_backend = report['json_backend'] == baseline.get('json_backend')
+    for key, result in report['results'].items():
+        reference = baseline['results'].get(key)
+        if reference is None:
+            continue
+        if reference['seconds'] >= min_seconds and (result['rows_per_s'] or 0) < reference['rows_per_s'] * (1 - tolerance):
+            regressions.append(f"{key}: {result['rows_per_s']:,} rows/s, baseline {reference['rows_per_s']:,}")
+        if result['peak_rss_mb'] and reference['peak_rss_mb'] and result['peak_rss_mb'] > reference['peak_rss_mb'] * (1 + tolerance):
+            regressions.append(f"{key}: {result['peak_rss_mb']:,} MB peak RSS, baseline {reference['peak_rss_mb']:,}")
+        if same_backend and result['bytes'] != reference['bytes']:
+            regressions.append(f"{key}: {result['bytes']:,} bytes, baseline {reference['bytes']:,}")
+    return regressions
+
+if __name__ == '__main__':
+
+    parser = argparse.ArgumentParser(description='Measure the rows/s, peak RSS and bytes of each conversion stage on synthetic corpora')
+    parser.add_argument(
+        "--rows",
+        type=str,
+        nargs='+',
+        default=['10k', '100k'],
+        help="The sizes of the corpora, e.g., --rows 10k 100k 1M 10M"
+    )
+    parser.add_argument(
+        "--schemas",
+        type=str,
+        nargs='+',
+        default=list(STAGES),
+        choices=list(STAGES),
+        help="The datasets to benchmark"
+    )
+    parser.add_argument(
+        "--stages",
+        type=str,
+        nargs='+',
+        default=None,
+        help="The stages to measure, e.g., --stages serialize write. Defaults to all of them."
+    )
+    parser.add_argument(
+        "--chunksize",
+        type=int,
+        default=100_000,
+        help="The number of rows per chunk"
+    )
+    parser.add_argument(
+        "--json_backend",
+        type=str,
+        default='auto',
+        choices=BACKENDS,
+        help="The JSON encoder of the serialize, write and convert stages"
+    )
+    parser.add_argument(
+        "--repeat",
+        type=int,
+        default=3,
+        help="The number of runs of each measure, the best one is kept"
+    )
+    parser.add_argument(
+        "--baseline",
+        type=str,
+        default=BASELINE_PATH,
+        help="The baseline to compare with, or to write with --save_baseline"
+    )
+    parser.add_argument(
+        "--save_baseline",
+        action='store_true',
+        default=False,
+        help="Write the results as the new baseline instead of comparing with it"
+    )
+    parser.add_argument(
+        "--tolerance",
+        type=float,
+        default=0.25,
+        help="The relative slow down or memory growth that counts as a regression"
+    )
+    parser.add_argument(
+        "--output",
+        type=str,
+        default=None,
+        help="Also write the results to this JSON file"
+    )
+    args = parser.parse_args()
+
+    report = run_suite([parse_rows(rows) for rows in args.rows], args.schemas, args.stages, args.chunksize,
+                       args.json_backend, args.repeat)
+    if args.output:
+        with open(args.output, 'w', encoding='utf-8') as f:
+            json.dump(report, f, indent=2)
+
+    if args.save_baseline:
+        with open(args.baseline, 'w', encoding='utf-8') as f:
+            json.dump(report, f, indent=2)
+        print('Baseline written to:', args.baseline)
+    elif os.path.exists(args.baseline):
+        with open(args.baseline, encoding='utf-8') as f:
+            baseline = json.load(f)
+        regressions = compare(report, baseline, args.tolerance)
+        for regression in regressions:
+            print('REGRESSION', regression)
+        if regressions:
+            raise SystemExit(1)
+        print(f"No regression against {args.baseline} (tolerance {args.tolerance:.0%})")
+    else:
+        print(f"No baseline at {args.baseline}, write one with --save_baseline")
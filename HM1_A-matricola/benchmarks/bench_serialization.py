@@ -0,0 +1,79 @@
+# This part is for comparing the JSON backends of JsonlSerializer on the shipped EmotivITA and HODI files
+
+import os
+import io
+import sys
+import json
+import glob
+import time
+
+# Make the shared helpers in HM1_A-matricola/common importable when this file is run as a script
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+from common.records import RecordBatch, encode_texts
+from common.serialization import JsonlSerializer, orjson, msgspec
+
+def load_jsonl(file_path: str) -> list[dict]:
+    with open(file_path, encoding='utf-8') as f:
+        return [json.loads(line) for line in f]
+
+def write_per_record(f: io.BytesIO, jsonl_entries: list[dict]) -> None:
+    """The previous writer: one json.dumps and one write per line."""
+    for entry in jsonl_entries:
+        f.write((json.dumps(entry, ensure_ascii=False) + '\n').encode('utf-8'))
+
+def to_record_batch(jsonl_entries: list[dict]) -> RecordBatch:
+    """The entries as a RecordBatch, with the distinct lists of choices of the file as the table."""
+    choices_table = [list(choices) for choices in dict.fromkeys(tuple(entry['choices']) for entry in jsonl_entries)]
+    choices_codes = {tuple(choices): code for code, choices in enumerate(choices_table)}
+    extra = {key: value for key, value in jsonl_entries[0].items() if key not in ('text', 'choices', 'label')}
+    text_buffer, text_offsets = encode_texts(entry['text'] for entry in jsonl_entries)
+    return RecordBatch(text_buffer, text_offsets, 
+                       [entry['label'] for entry in jsonl_entries], 
+                       [choices_codes[tuple(entry['choices'])] for entry in jsonl_entries], 
+                       choices_table, **extra)
+
+def time_best_of(func, repeat: int) -> float:
+    best = float('inf')
+    for _ in range(repeat):
+        start = time.perf_counter()
+        func()
+        best = min(best, time.perf_counter() - start)
+    return best
+
+def bench_file(file_path: str, repeat: int=5) -> None:
+    jsonl_entries = load_jsonl(file_path)
+    print(f"\n{os.path.relpath(file_path, ROOT)}: {len(jsonl_entries)} entries")
+    
+    buffer = io.BytesIO()
+    write_per_record(buffer, jsonl_entries)
+    n_bytes = len(buffer.getvalue())
+    baseline = time_best_of(lambda: write_per_record(io.BytesIO(), jsonl_entries), repeat)
+    print(f"  {'json.dumps per record':<22} {len(jsonl_entries) / baseline:>12,.0f} entries/s {n_bytes / baseline / 1e6:>8.1f} MB/s  x1.00")
+    
+    backends = ['json'] + ['orjson'] * (orjson is not None) + ['msgspec'] * (msgspec is not None)
+    for backend in backends:
+        serializer = JsonlSerializer(backend)
+        
+        buffer = io.BytesIO()
+        serializer.write(buffer, jsonl_entries)
+        lines = buffer.getvalue().decode('utf-8').splitlines()
+        assert [json.loads(line) for line in lines] == jsonl_entries, f"{backend} does not round-trip"
+        
+        elapsed = time_best_of(lambda: serializer.write(io.BytesIO(), jsonl_entries), repeat)
+        print(f"  {'JsonlSerializer ' + backend:<22} {len(jsonl_entries) / elapsed:>12,.0f} entries/s "
+              f"{len(buffer.getvalue()) / elapsed / 1e6:>8.1f} MB/s  x{baseline / elapsed:.2f}")
+        
+        batch = to_record_batch(jsonl_entries)
+        assert serializer.encode(batch) == buffer.getvalue(), f"{backend} writes a RecordBatch differently"
+        elapsed = time_best_of(lambda: serializer.write(io.BytesIO(), batch), repeat)
+        print(f"  {'  from a RecordBatch':<22} {len(jsonl_entries) / elapsed:>12,.0f} entries/s "
+              f"{len(buffer.getvalue()) / elapsed / 1e6:>8.1f} MB/s  x{baseline / elapsed:.2f}")
+
+if __name__ == '__main__':
+    
+    file_paths = sorted(glob.glob(os.path.join(ROOT, 'EmotivITA', 'EmotivITA_*.jsonl')))
+    file_paths += sorted(glob.glob(os.path.join(ROOT, 'HODI_2023', 'HODI_2023_train_subtaskA.jsonl')))
+    
+    for file_path in file_paths:
+        bench_file(file_path)
@@ -0,0 +1,137 @@
+# This part is for generating synthetic EmotivITA and HODI files of any size, offline, with the schemas of the real ones
+
+import os
+import argparse
+
+import numpy as np
+import pandas as pd
+
+# Common Italian words, most frequent first, so that a Zipf law over their ranks gives realistic repetitions
+WORDS = """
+di e il la che a in un è per non una i si con le da del l' al come ma sono lo più anche della ha gli ci se ho o
+nel alla mi ti ne questo questa essere tutto tutti fatto fare molto così sempre ancora solo perché quando dove
+anno anni giorno giorni vita tempo casa famiglia amore amico amici paese governo stato lavoro mondo città gente
+persone parte notizie direttore consiglio agenzia sede presidente ministro legge voto elezioni partito politica
+grande nuovo nuova buono bella bello brutto vero falso primo ultimo altro altra stesso proprio pieno felice triste
+gioia paura rabbia dolore speranza pace guerra sangue morte notte sera mattina domani oggi ieri sempre mai
+detto dire fa va viene vuole può deve sa sembra credo penso voglio posso devo dobbiamo andare venire vedere sentire
+auguriamo vostra vostro nostra nostro loro sua suo mia mio tua tuo ogni nessuno qualcosa niente tanto poco troppo
+dopo prima durante contro senza sopra sotto dentro fuori insieme verso tra fra secondo circa quasi però quindi allora
+""".split()
+
+# The extra tokens of the tweets
+TWEET_TOKENS = ['@user', '#gay', '#famiglia', '#politica', '#amore', '#italia', 'https://t.co/xyz', '👆', '😂', '❤️', '🏳️‍🌈', '...', '!!', '?', '"ok"']
+
+# The schema of each dataset: file extension, separator, and the mean and std of the number of words per text
+SCHEMAS = {
+    'emotivita': {'extension': 'csv', 'sep': ',', 'words_mean': 16.2, 'words_std': 12.4, 'words_max': 120},
+    'hodi': {'extension': 'tsv', 'sep': '\t', 'words_mean': 24.0, 'words_std': 13.9, 'words_max': 60},
+}
+
+def parse_rows(rows: str | int) -> int:
+    """A number of rows, with an optional k or M suffix, e.g., '10k' -> 10_000, '10M' -> 10_000_000."""
+    if isinstance(rows, int):
+        return rows
+    multiplier = {'k': 1_000, 'm': 1_000_000}.get(rows[-1].lower(), 1)
+    return int(float(rows.rstrip('kKmM')) * multiplier)
+
+def generate_texts(rng: np.random.Generator, n_rows: int, schema: str) -> list[str]:
+    """The texts of n_rows rows, as sequences of words drawn from a Zipf law, with the length distribution of the schema."""
+    spec = SCHEMAS[schema]
+    vocabulary = np.array(WORDS + (TWEET_TOKENS if schema == 'hodi' else []) + [',', '.'], dtype=object)
+    ranks = np.arange(1, len(vocabulary) + 1)
+    probabilities = 1 / ranks
+    probabilities /= probabilities.sum()
+
+    # A gamma distribution with the mean and the std of the real texts
+    shape = (spec['words_mean'] / spec['words_std']) ** 2
+    n_words = np.clip(rng.gamma(shape, spec['words_mean'] / shape, n_rows).round(), 1, spec['words_max']).astype(np.int64)
+
+    # Join all the words at once, with a new line after the last word of each text, then split the texts
+    words = vocabulary[rng.choice(len(vocabulary), size=int(n_words.sum()), p=probabilities)]
+    ends = np.cumsum(n_words) - 1
+    words[ends] = words[ends] + '\n'
+    texts = ' '.join(words.tolist()).split('\n ')
+    texts[-1] = texts[-1].rstrip('\n')
+
+    # Capitalize the first letter, as in a sentence
+    return [text[:1].upper() + text[1:] for text in texts]
+
+def generate_chunk(schema: str, start: int, n_rows: int, seed: int) -> pd.DataFrame:
+    """The rows start to start + n_rows of the synthetic dataset. A row depends only on the seed and its chunk."""
+    rng = np.random.default_rng([seed, start])
+    data = {'id': np.arange(start + 1, start + n_rows + 1), 'text': generate_texts(rng, n_rows, schema)}
+    if schema == 'emotivita':
+        # The means and the stds of V, A and D in the development set
+        for column, mean, std in [('V', 3.48, 0.61), ('A', 3.75, 0.47), ('D', 3.42, 0.45)]:
+            data[column] = np.clip(rng.normal(mean, std, n_rows), 1.0, 5.5).round(2)
+    else:
+        data['homotransphobic'] = (rng.random(n_rows) < 0.4).astype(np.int8)
+    return pd.DataFrame(data)
+
+def write_corpus(output_file_path: str, schema: str, n_rows: int, seed: int=49, chunksize: int=200_000) -> str:
+    """Write a synthetic dataset of n_rows rows by chunks, so the memory stays flat whatever n_rows.
+
+    The chunks depend only on the seed and their position, so the first rows of a large corpus are the rows of a small one.
+
+    Args:
+        output_file_path (str): the CSV (emotivita) or TSV (hodi) file to write
+        schema (str): 'emotivita' (id, text, V, A, D) or 'hodi' (id, text, homotransphobic)
+        n_rows (int): the number of rows
+        seed (int, optional): the seed of the generator. Defaults to 49.
+        chunksize (int, optional): the number of rows generated at once. Defaults to 200_000.
+
+    Returns:
+        str: output_file_path
+    """
+    if schema not in SCHEMAS:
+        raise ValueError(f"Unknown schema {schema!r}, expected one of {list(SCHEMAS)}")
+    tmp_path = output_file_path + '.tmp'
+    with open(tmp_path, 'w', encoding='utf-8', newline='') as f:
+        for start in range(0, n_rows, chunksize):
+            chunk = generate_chunk(schema, start, min(chunksize, n_rows - start), seed)
+            chunk.to_csv(f, sep=SCHEMAS[schema]['sep'], index=False, header=start == 0)
+    os.replace(tmp_path, output_file_path)
+    return output_file_path
+
+def corpus_path(corpus_dir: str, schema: str, n_rows: int, seed: int=49) -> str:
+    """The cached synthetic dataset of (schema, n_rows, seed), written first if it does not exist."""
+    os.makedirs(corpus_dir, exist_ok=True)
+    file_path = os.path.join(corpus_dir, f"{schema}_{n_rows}_s{seed}.{SCHEMAS[schema]['extension']}")
+    if not os.path.exists(file_path):
+        print(f"Generating {file_path}")
+        write_corpus(file_path, schema, n_rows, seed)
+    return file_path
+
+if __name__ == '__main__':
+
+    parser = argparse.ArgumentParser(description='Write a synthetic EmotivITA or HODI dataset')
+    parser.add_argument(
+        "--schema",
+        type=str,
+        default='emotivita',
+        choices=list(SCHEMAS),
+        help="The schema of the dataset: emotivita (id, text, V, A, D) or hodi (id, text, homotransphobic)"
+    )
+    parser.add_argument(
+        "--rows",
+        type=str,
+        default='10k',
+        help="The number of rows, e.g., 10k or 10M"
+    )
+    parser.add_argument(
+        "--seed",
+        type=int,
+        default=49,
+        help="The seed of the generator"
+    )
+    parser.add_argument(
+        "--output",
+        type=str,
+        required=True,
+        help="The file to write"
+    )
+    args = parser.parse_args()
+
+    write_corpus(args.output, args.schema, parse_rows(args.rows), args.seed)
+    print('Corpus written to:', args.output)
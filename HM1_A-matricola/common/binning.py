@@ -0,0 +1,158 @@
+# This part is for mapping the continuous scores (e.g., the EmotivITA V/A/D) to categories with array operations
+
+from typing import Iterable
+
+import numpy as np
+
+def as_threshold_table(thresholds: Iterable[float] | Iterable[Iterable[float]], n_columns: int | None=None) -> np.ndarray:
+    """Check a threshold table and give it a (n_columns, n_categories - 1) shape.
+
+    Args:
+        thresholds (Iterable[float] | Iterable[Iterable[float]]): the upper thresholds of each category but the last,
+    either one list shared by all the columns or one list per column
+        n_columns (int, optional): the number of columns to bin. Defaults to None, i.e., the number of lists given.
+
+    Raises:
+        ValueError: If the thresholds are not increasing, or if there is not one list per column.
+
+    Returns:
+        np.ndarray: the float thresholds of each column
+    """
+    table = np.atleast_2d(np.asarray(thresholds, dtype=float))
+    if table.ndim != 2:
+        raise ValueError(f"Expected a list of thresholds or one list per column, got shape {table.shape}")
+    if n_columns is not None and len(table) == 1:
+        table = np.repeat(table, n_columns, axis=0)
+    if n_columns is not None and len(table) != n_columns:
+        raise ValueError(f"Expected one list of thresholds per column ({n_columns}), got {len(table)}")
+    if np.any(np.diff(table, axis=1) <= 0):
+        raise ValueError(f"The thresholds must be strictly increasing, got {table.tolist()}")
+    return table
+
+def bin_values(values: np.ndarray, thresholds: Iterable[float] | Iterable[Iterable[float]]) -> np.ndarray:
+    """Map every value to the index of its category at once.
+
+    A value v is in category i when thresholds[i-1] <= v < thresholds[i], so there are len(thresholds) + 1 categories.
+
+    Args:
+        values (np.ndarray): the values, shape (n_rows,) or (n_rows, n_columns)
+        thresholds (Iterable[float] | Iterable[Iterable[float]]): one list of thresholds, or one per column
+
+    Returns:
+        np.ndarray: the category indices, same shape as values
+
+    Example:
+        bin_values(data[['V', 'A', 'D']].to_numpy(), [3.2, 3.8])    # the same thresholds for the three columns
+    """
+    values = np.asarray(values, dtype=float)
+    table = as_threshold_table(thresholds, values.shape[1] if values.ndim == 2 else None)
+    if values.ndim != 2:
+        if len(table) != 1:
+            raise ValueError(f"Expected a single list of thresholds for 1-D values, got {len(table)}")
+        return np.digitize(values, table[0])
+
+    cat_idx = np.empty(values.shape, dtype=np.intp)
+    for column, column_thresholds in enumerate(table):
+        cat_idx[:, column] = np.digitize(values[:, column], column_thresholds)
+    return cat_idx
+
+def uniform_thresholds(n_categories: int, low: float=0.0, high: float=5.0) -> list[float]:
+    """Thresholds that split [low, high] into n_categories intervals of the same width, e.g., 4 -> [1.25, 2.5, 3.75]."""
+    return np.linspace(low, high, n_categories + 1)[1:-1].tolist()
+
+class QuantileSketch:
+    """The approximate quantiles of one or more streams of bounded values, in a single pass with a fixed memory.
+
+    Each column is summarized by a histogram of n_bins bins of the same width over [low, high] (the values outside
+    are counted in the first or the last bin), so the quantiles are exact up to the width of a bin,
+    e.g., 5 / 16384 = 0.0003 for the EmotivITA scores, whatever the number of rows.
+    Two sketches of the same range can be merged, e.g., the ones of several chunks or workers.
+
+    Example:
+        sketch = QuantileSketch(n_columns=3)
+        for data in read_data('EmotivITA/save_folder/Development set.csv', chunksize=10_000):
+            sketch.update(data[['V', 'A', 'D']].to_numpy(dtype=float))
+        sketch.balanced_thresholds(3)   # one [t1, t2] per column, with about a third of the rows in each category
+    """
+
+    def __init__(self, n_columns: int=1, low: float=0.0, high: float=5.0, n_bins: int=1 << 14):
+        """
+        Args:
+            n_columns (int, optional): the number of columns. Defaults to 1.
+            low (float, optional): the lowest value. Defaults to 0.0.
+            high (float, optional): the highest value. Defaults to 5.0.
+            n_bins (int, optional): the number of bins of each histogram. Defaults to 16384.
+        """
+        self.low = low
+        self.high = high
+        self.n_bins = n_bins
+        self.edges = np.linspace(low, high, n_bins + 1)
+        self.counts = np.zeros((n_columns, n_bins), dtype=np.int64)
+
+    def update(self, values: np.ndarray) -> 'QuantileSketch':
+        """Add a chunk of values, shape (n_rows,) or (n_rows, n_columns). The NaN values are ignored."""
+        values = np.asarray(values, dtype=float).reshape(len(values), -1)
+        for column in range(self.counts.shape[0]):
+            column_values = values[:, column]
+            column_values = column_values[~np.isnan(column_values)]
+            bins = np.clip(((column_values - self.low) / (self.high - self.low) * self.n_bins).astype(np.int64),
+                           0, self.n_bins - 1)
+            self.counts[column] += np.bincount(bins, minlength=self.n_bins)
+        return self
+
+    def merge(self, other: 'QuantileSketch') -> 'QuantileSketch':
+        if (other.low, other.high, other.n_bins) != (self.low, self.high, self.n_bins):
+            raise ValueError("Only the sketches of the same range and number of bins can be merged")
+        self.counts += other.counts
+        return self
+
+    def quantiles(self, qs: Iterable[float]) -> np.ndarray:
+        """The approximate quantiles of each column.
+
+        Args:
+            qs (Iterable[float]): the quantiles, in [0, 1]
+
+        Returns:
+            np.ndarray: shape (n_columns, len(qs))
+        """
+        qs = np.asarray(list(qs), dtype=float)
+        cumulative = np.cumsum(self.counts, axis=1)
+        result = np.empty((len(self.counts), len(qs)))
+        for column, column_cumulative in enumerate(cumulative):
+            ranks = qs * column_cumulative[-1]
+            bins = np.minimum(np.searchsorted(column_cumulative, ranks, side='left'), self.n_bins - 1)
+            result[column] = self.edges[bins + 1]
+        return result
+
+    def balanced_thresholds(self, n_categories: int) -> list[list[float]]:
+        """The thresholds that split the rows of each column into n_categories categories of about the same size.
+
+        The values are often ties (e.g., many scores of exactly 3.0), so each threshold is the bin edge
+        whose fraction of the rows below it is the closest to the target, rather than the quantile itself.
+
+        Args:
+            n_categories (int): the number of categories
+
+        Raises:
+            ValueError: If the sketch is empty, or if the ties leave fewer distinct thresholds than needed.
+
+        Returns:
+            list[list[float]]: the n_categories - 1 thresholds of each column, see bin_values
+        """
+        totals = self.counts.sum(axis=1)
+        if not totals.all():
+            raise ValueError("Cannot compute balanced thresholds from an empty sketch")
+
+        # The fraction of the rows strictly below each inner edge
+        below = np.cumsum(self.counts, axis=1)[:, :-1] / totals[:, None]
+        table = []
+        for column_below in below:
+            edges = []
+            for q in np.arange(1, n_categories) / n_categories:
+                # The last of the closest edges, i.e., the one right below the next value, among the edges of a gap
+                distance = np.abs(column_below - q)[::-1]
+                edges.append(float(self.edges[len(distance) - np.argmin(distance)]))
+            if len(set(edges)) != len(edges):
+                raise ValueError(f"Not enough distinct values for {n_categories} balanced categories, got {edges}")
+            table.append([round(edge, 6) for edge in edges])
+        return table
@@ -0,0 +1,479 @@
+# This part is for a columnar, memory-mappable copy of the converted datasets
+
+import os
+import json
+import shutil
+from typing import Iterable, Iterator
+
+import numpy as np
+
+from common.hash_table import SortedTable
+from common.records import RecordBatch, record_columns
+from common.shuffle import hash_keys
+
+FORMAT = 'columnar-v1'
+
+# The dtype of each column file
+COLUMNS = {
+    'text_offsets': np.int64,   # n_rows + 1 offsets into text.bin. Row i is text.bin[offsets[i]:offsets[i + 1]]
+    'label': np.int8,           # the index of the true choice
+    'choices': np.uint8,        # the row of the choices of each record in the choices_table of meta.json
+}
+
+def columnar_path(jsonl_file_path: str) -> str:
+    """The columnar folder of a JSONL file, e.g., HODI_2023_train_subtaskA.jsonl -> HODI_2023_train_subtaskA.cols"""
+    return os.path.splitext(jsonl_file_path)[0] + '.cols'
+
+def _memmap(file_path: str, dtype: np.dtype) -> np.ndarray:
+    if os.path.getsize(file_path) == 0:
+        # np.memmap cannot map an empty file
+        return np.empty(0, dtype=dtype)
+    return np.memmap(file_path, dtype=dtype, mode='r')
+
+class ColumnarWriter:
+    """Write converted records as columns: the UTF-8 texts back to back with an offset buffer, and one small integer per
+    record for the label and for the choices (an index into the few possible orderings of the choices).
+
+    Each column is a raw little-endian file, appended chunk by chunk, so the memory stays flat.
+    The folder is written as path + '.tmp' and moved in place on close.
+
+    Example:
+        with ColumnarWriter('HODI_2023/HODI_2023_train_subtaskA.cols', ordered_choices(['Vero', 'Falso'])) as writer:
+            for jsonl_entries in entries_chunks:
+                writer.write(jsonl_entries)
+    """
+
+    def __init__(self, path: str, choices_table: list[list[str]], **meta):
+        """
+        Args:
+            path (str): the folder to write
+            choices_table (list[list[str]]): every possible list of choices, see common.shuffle.ordered_choices
+            meta: the fields shared by all the records, e.g., dimension='Valence'. Saved in meta.json.
+        """
+        self.path = path
+        self.tmp_path = path + '.tmp'
+        self.choices_table = choices_table
+        self.choices_codes = {tuple(choices): code for code, choices in enumerate(choices_table)}
+        self.meta = meta
+        self.n_rows = 0
+        self.n_text_bytes = 0
+
+        shutil.rmtree(self.tmp_path, ignore_errors=True)
+        os.makedirs(self.tmp_path)
+        self.files = {name: open(os.path.join(self.tmp_path, name + '.bin'), 'wb') for name in ['text', *COLUMNS]}
+        self.files['text_offsets'].write(np.zeros(1, dtype='<i8').tobytes())
+
+    def write(self, jsonl_entries: RecordBatch | list[dict]) -> None:
+        """Append a chunk of records, each with a text, choices and label."""
+        if not len(jsonl_entries):
+            return
+
+        texts, labels, codes = record_columns(jsonl_entries, self.choices_codes)
+        lengths = np.fromiter(map(len, texts), dtype=np.int64, count=len(texts))
+        offsets = self.n_text_bytes + np.cumsum(lengths)
+
+        self.files['text'].write(b''.join(texts))
+        self.files['text_offsets'].write(offsets.astype('<i8').tobytes())
+        self.files['label'].write(labels.astype('<i1').tobytes())
+        self.files['choices'].write(codes.astype('<u1').tobytes())
+
+        self.n_rows += len(texts)
+        self.n_text_bytes = int(offsets[-1])
+
+    def tap(self, entries_chunks: Iterable[list], output_idx: int=0) -> Iterator[list]:
+        """A stage of the generator pipeline: write the entries of one output of each chunk and pass the chunks on."""
+        for jsonl_entries in entries_chunks:
+            self.write(jsonl_entries[output_idx])
+            yield jsonl_entries
+
+    def close(self) -> None:
+        for f in self.files.values():
+            f.close()
+
+        meta = {
+            'format': FORMAT,
+            'n_rows': self.n_rows,
+            'columns': {name: np.dtype(dtype).str for name, dtype in COLUMNS.items()},
+            'choices_table': self.choices_table,
+            **self.meta,
+        }
+        with open(os.path.join(self.tmp_path, 'meta.json'), 'w', encoding='utf-8') as f:
+            json.dump(meta, f, ensure_ascii=False, indent=2)
+
+        shutil.rmtree(self.path, ignore_errors=True)
+        os.replace(self.tmp_path, self.path)
+
+    def __enter__(self) -> 'ColumnarWriter':
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback) -> None:
+        if exc_type is None:
+            self.close()
+        else:
+            for f in self.files.values():
+                f.close()
+            shutil.rmtree(self.tmp_path, ignore_errors=True)
+
+class ColumnarDataset:
+    """Read a columnar folder through memory maps: opening it costs a few mmap calls whatever its size,
+    and the labels and choices are numpy arrays backed by the files (no copy, no parsing).
+
+    Example:
+        dataset = ColumnarDataset('EmotivITA/EmotivITA_Valence_dev.cols')
+        dataset.labels                  # np.memmap, int8
+        dataset.text(0)                 # 'Auguriamo a voi ...'
+        dataset[0]                      # {'text': ..., 'choices': [...], 'label': 1, 'dimension': 'Valence'}
+    """
+
+    def __init__(self, path: str):
+        with open(os.path.join(path, 'meta.json'), encoding='utf-8') as f:
+            self.meta = json.load(f)
+        if self.meta.get('format') != FORMAT:
+            raise ValueError(f"Unknown columnar format in {path}: {self.meta.get('format')}")
+
+        self.path = path
+        self.n_rows = self.meta['n_rows']
+        self.choices_table = self.meta['choices_table']
+        self.extra = {key: value for key, value in self.meta.items()
+                      if key not in ('format', 'n_rows', 'columns', 'choices_table')}
+
+        columns = {name: self._memmap(name, np.dtype(dtype)) for name, dtype in self.meta['columns'].items()}
+        self.text_offsets = columns['text_offsets']
+        self.labels = columns['label']
+        self.choices_codes = columns['choices']
+        self.text_buffer = self._memmap('text', np.dtype(np.uint8))
+
+    def _memmap(self, name: str, dtype: np.dtype) -> np.ndarray:
+        return _memmap(os.path.join(self.path, name + '.bin'), dtype)
+
+    def __len__(self) -> int:
+        return self.n_rows
+
+    def text(self, idx: int) -> str:
+        return self.text_buffer[self.text_offsets[idx]:self.text_offsets[idx + 1]].tobytes().decode('utf-8')
+
+    def choices(self, idx: int) -> list[str]:
+        return self.choices_table[self.choices_codes[idx]]
+
+    def __getitem__(self, idx: int) -> dict:
+        """The record at row idx, in the same format as the JSONL line."""
+        if idx < 0:
+            idx += self.n_rows
+        if not 0 <= idx < self.n_rows:
+            raise IndexError(f"Row {idx} out of range for {self.n_rows} rows")
+        return {'text': self.text(idx), 'choices': self.choices(idx), 'label': int(self.labels[idx]), **self.extra}
+
+    def __iter__(self) -> Iterator[dict]:
+        for idx in range(self.n_rows):
+            yield self[idx]
+
+    def texts(self) -> list[str]:
+        """Decode all the texts at once, e.g., to build a DataFrame."""
+        buffer = self.text_buffer.tobytes()
+        offsets = self.text_offsets.tolist()
+        return [buffer[start:end].decode('utf-8') for start, end in zip(offsets[:-1], offsets[1:])]
+
+    def to_dataframe(self) -> 'pd.DataFrame':
+        """The records as a DataFrame with the columns of the JSONL records, like load_data in the HM1_B notebook."""
+        import pandas as pd
+
+        data = pd.DataFrame({
+            'text': self.texts(),
+            'label': np.asarray(self.labels, dtype=np.int64),
+            'choices': [self.choices_table[code] for code in self.choices_codes.tolist()],
+        })
+        for key, value in self.extra.items():
+            data[key] = value
+        return data
+
+# The shared text layout: the records of several dimensions of the same rows (e.g., the EmotivITA Valence, Arousal
+# and Dominance files) in one folder, with each distinct text stored once
+SHARED_FORMAT = 'shared-text-v1'
+
+SHARED_COLUMNS = {
+    'text_offsets': np.int64,   # n_texts + 1 offsets into text.bin, one text per distinct text
+    'text_id': np.uint32,       # the text of each row
+}
+
+# The dtype of the columns of each dimension, in <dimension>.<column>.bin
+DIMENSION_COLUMNS = {
+    'label': np.int8,
+    'choices': np.uint8,
+}
+
+def shared_text_path(output_file_path: str) -> str:
+    """The shared text folder of the per-dimension JSONL files, e.g., EmotivITA_{}_dev.jsonl -> EmotivITA_dev.shared"""
+    return os.path.splitext(output_file_path.replace('_{}', '').replace('{}', ''))[0] + '.shared'
+
+class SharedTextWriter:
+    """Write the records of several dimensions of the same rows in one folder, in the shared text layout.
+
+    The text of a row is written once for all the dimensions, and once for all the rows with the same text.
+    Each row keeps the id of its text and, for each dimension, an int8 label and a uint8 choices column,
+    so the folder is about a third of the per-dimension JSONL files.
+
+    The texts are found by their 64-bit BLAKE2b digest (see common.shuffle.hash_keys), in a SortedTable of 12 bytes
+    per distinct text, looked up once per chunk. A digest is only a candidate: the text is compared with the bytes
+    stored for it, read back from text.bin, and a different text with the same digest gets its own id in collisions.
+
+    Example:
+        with SharedTextWriter('EmotivITA/EmotivITA_dev.shared', DIMENSIONS, ordered_choices(float_to_cat_list)) as writer:
+            for jsonl_entries in entries_chunks:    # one list of entries per dimension, aligned by row
+                writer.write(jsonl_entries)
+    """
+
+    def __init__(self, path: str, dimensions: list[str], choices_table: list[list[str]], **meta):
+        """
+        Args:
+            path (str): the folder to write
+            dimensions (list[str]): the dimension of each list of entries given to write
+            choices_table (list[list[str]]): every possible list of choices, see common.shuffle.ordered_choices
+            meta: the fields shared by all the records. Saved in meta.json.
+        """
+        self.path = path
+        self.tmp_path = path + '.tmp'
+        self.dimensions = dimensions
+        self.choices_table = choices_table
+        self.choices_codes = {tuple(choices): code for code, choices in enumerate(choices_table)}
+        self.meta = meta
+        self.text_ids = SortedTable()
+        # The ids of the texts whose digest is already the one of another text, by their bytes
+        self.collisions = {}
+        self.n_texts = 0
+        self.n_rows = 0
+        self.n_text_bytes = 0
+
+        shutil.rmtree(self.tmp_path, ignore_errors=True)
+        os.makedirs(self.tmp_path)
+        names = ['text', *SHARED_COLUMNS] + [f'{dimension}.{name}' for dimension in dimensions for name in DIMENSION_COLUMNS]
+        # The texts and their offsets are read back to compare the texts with the same digest
+        self.files = {name: open(os.path.join(self.tmp_path, name + '.bin'), 'w+b' if name in ('text', 'text_offsets') else 'wb')
+                      for name in names}
+        self.files['text_offsets'].write(np.zeros(1, dtype='<i8').tobytes())
+
+    def write(self, jsonl_entries: list[RecordBatch | list[dict]]) -> None:
+        """Append a chunk of rows, given as one batch or list of entries per dimension, aligned by row."""
+        if not jsonl_entries or not len(jsonl_entries[0]):
+            return
+
+        columns = [record_columns(entries, self.choices_codes) for entries in jsonl_entries]
+
+        # Add the new texts to the text table, with consecutive ids in the order of their first row
+        texts = columns[0][0]
+        digests, first_rows, inverse = np.unique(hash_keys(texts, seed=0), return_index=True, return_inverse=True)
+        table_ids = self.text_ids.lookup(digests)
+        found = table_ids >= 0
+        text_ids = table_ids.copy()
+        # A digest found in the table is the same text only if the stored bytes are the same
+        hits = np.flatnonzero(found)
+        collided = hits[self._differ(table_ids[hits], [texts[row] for row in first_rows[hits].tolist()])]
+        new = np.flatnonzero(~found)
+        new = new[np.argsort(first_rows[new])]
+        text_ids[new] = self.n_texts + np.arange(len(new))
+        self.text_ids.insert(digests[new], text_ids[new])
+        self.n_texts += len(new)
+        new_texts = [texts[row] for row in first_rows[new].tolist()]
+        text_ids[collided] = [self._collision_id(texts[row], new_texts) for row in first_rows[collided].tolist()]
+        row_text_ids = text_ids[inverse].astype('<u4')
+
+        # The rows with the digest of an earlier row of the chunk, but another text: the one in the table, or a collision
+        repeats = np.flatnonzero(first_rows[inverse] != np.arange(len(texts)))
+        for row, first in zip(repeats.tolist(), first_rows[inverse[repeats]].tolist()):
+            if texts[row] == texts[first]:
+                continue
+            digest = inverse[row]
+            if found[digest] and not self._differ(table_ids[digest:digest + 1], [texts[row]])[0]:
+                row_text_ids[row] = table_ids[digest]
+            else:
+                row_text_ids[row] = self._collision_id(texts[row], new_texts)
+
+        if new_texts:
+            offsets = self.n_text_bytes + np.cumsum(np.fromiter(map(len, new_texts), dtype=np.int64, count=len(new_texts)))
+            self.files['text'].write(b''.join(new_texts))
+            self.files['text_offsets'].write(offsets.astype('<i8').tobytes())
+            self.n_text_bytes = int(offsets[-1])
+        self.files['text_id'].write(row_text_ids.tobytes())
+
+        for dimension, (_, labels, codes) in zip(self.dimensions, columns):
+            self.files[f'{dimension}.label'].write(labels.astype('<i1').tobytes())
+            self.files[f'{dimension}.choices'].write(codes.astype('<u1').tobytes())
+
+        self.n_rows += len(row_text_ids)
+
+    def _differ(self, text_ids: np.ndarray, texts: list[bytes]) -> np.ndarray:
+        """Whether the text stored for each id differs from each given text, read back from the files being written."""
+        differ = np.zeros(len(texts), dtype=bool)
+        if not texts:
+            return differ
+        self.files['text'].flush()
+        self.files['text_offsets'].flush()
+        text_fd, offsets_fd = self.files['text'].fileno(), self.files['text_offsets'].fileno()
+        for i, (text_id, text) in enumerate(zip(text_ids.tolist(), texts)):
+            start, end = np.frombuffer(os.pread(offsets_fd, 16, text_id * 8), dtype='<i8').tolist()
+            differ[i] = end - start != len(text) or os.pread(text_fd, end - start, start) != text
+        return differ
+
+    def _collision_id(self, text: bytes, new_texts: list[bytes]) -> int:
+        """The id of a text whose digest is the one of another text, added to new_texts the first time."""
+        if text not in self.collisions:
+            self.collisions[text] = self.n_texts
+            self.n_texts += 1
+            new_texts.append(text)
+        return self.collisions[text]
+
+    def tap(self, entries_chunks: Iterable[list]) -> Iterator[list]:
+        """A stage of the generator pipeline: write the entries of each chunk and pass the chunks on."""
+        for jsonl_entries in entries_chunks:
+            self.write(jsonl_entries)
+            yield jsonl_entries
+
+    def close(self) -> None:
+        for f in self.files.values():
+            f.close()
+
+        meta = {
+            'format': SHARED_FORMAT,
+            'n_rows': self.n_rows,
+            'n_texts': self.n_texts,
+            'dimensions': self.dimensions,
+            'columns': {name: np.dtype(dtype).str for name, dtype in SHARED_COLUMNS.items()},
+            'dimension_columns': {name: np.dtype(dtype).str for name, dtype in DIMENSION_COLUMNS.items()},
+            'choices_table': self.choices_table,
+            **self.meta,
+        }
+        with open(os.path.join(self.tmp_path, 'meta.json'), 'w', encoding='utf-8') as f:
+            json.dump(meta, f, ensure_ascii=False, indent=2)
+
+        shutil.rmtree(self.path, ignore_errors=True)
+        os.replace(self.tmp_path, self.path)
+
+    def __enter__(self) -> 'SharedTextWriter':
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback) -> None:
+        if exc_type is None:
+            self.close()
+        else:
+            for f in self.files.values():
+                f.close()
+            shutil.rmtree(self.tmp_path, ignore_errors=True)
+
+class SharedTextDataset:
+    """Read a shared text folder through memory maps, and rebuild the records of each dimension on demand.
+
+    Example:
+        dataset = SharedTextDataset('EmotivITA/EmotivITA_dev.shared')
+        dataset.texts()                     # each distinct text once
+        valence = dataset.view('Valence')   # the records of EmotivITA_Valence_dev.jsonl
+        valence[0]                          # {'text': ..., 'choices': [...], 'label': 1, 'dimension': 'Valence'}
+        dataset.to_dataframe()              # the three dimensions one after the other, like the concatenated JSONL files
+    """
+
+    def __init__(self, path: str):
+        with open(os.path.join(path, 'meta.json'), encoding='utf-8') as f:
+            self.meta = json.load(f)
+        if self.meta.get('format') != SHARED_FORMAT:
+            raise ValueError(f"Unknown shared text format in {path}: {self.meta.get('format')}")
+
+        self.path = path
+        self.n_rows = self.meta['n_rows']
+        self.n_texts = self.meta['n_texts']
+        self.dimensions = self.meta['dimensions']
+        self.choices_table = self.meta['choices_table']
+        self.extra = {key: value for key, value in self.meta.items()
+                      if key not in ('format', 'n_rows', 'n_texts', 'dimensions', 'columns', 'dimension_columns',
+                                     'choices_table')}
+
+        self.text_offsets = self._memmap('text_offsets', np.dtype(self.meta['columns']['text_offsets']))
+        self.text_ids = self._memmap('text_id', np.dtype(self.meta['columns']['text_id']))
+        self.text_buffer = self._memmap('text', np.dtype(np.uint8))
+        self.labels = {}
+        self.choices_codes = {}
+        for dimension in self.dimensions:
+            self.labels[dimension] = self._memmap(f'{dimension}.label', np.dtype(self.meta['dimension_columns']['label']))
+            self.choices_codes[dimension] = self._memmap(f'{dimension}.choices',
+                                                         np.dtype(self.meta['dimension_columns']['choices']))
+
+    def _memmap(self, name: str, dtype: np.dtype) -> np.ndarray:
+        return _memmap(os.path.join(self.path, name + '.bin'), dtype)
+
+    def __len__(self) -> int:
+        return self.n_rows
+
+    def text(self, idx: int) -> str:
+        """The text of row idx."""
+        text_id = self.text_ids[idx]
+        return self.text_buffer[self.text_offsets[text_id]:self.text_offsets[text_id + 1]].tobytes().decode('utf-8')
+
+    def texts(self) -> list[str]:
+        """Decode each distinct text once, in the order of the text ids."""
+        buffer = self.text_buffer.tobytes()
+        offsets = self.text_offsets.tolist()
+        return [buffer[start:end].decode('utf-8') for start, end in zip(offsets[:-1], offsets[1:])]
+
+    def view(self, dimension: str) -> 'DimensionView':
+        """The records of one dimension, as in its JSONL file."""
+        if dimension not in self.labels:
+            raise KeyError(f"Unknown dimension {dimension}, choose one from {self.dimensions}")
+        return DimensionView(self, dimension)
+
+    def to_dataframe(self, dimensions: list[str] | None=None) -> 'pd.DataFrame':
+        """The records of the given dimensions one after the other, as a DataFrame with the columns of the JSONL records.
+
+        The texts are decoded once and shared by the dimensions.
+
+        Args:
+            dimensions (list[str], optional): the dimensions. Defaults to None, i.e., all of them.
+
+        Returns:
+            pd.DataFrame: the same DataFrame as load_data on each JSONL file followed by pd.concat
+        """
+        import pandas as pd
+
+        dimensions = dimensions or self.dimensions
+        texts = np.array(self.texts(), dtype=object)[np.asarray(self.text_ids, dtype=np.intp)]
+        frames = []
+        for dimension in dimensions:
+            frame = pd.DataFrame({
+                'text': texts,
+                'choices': [self.choices_table[code] for code in self.choices_codes[dimension].tolist()],
+                'label': np.asarray(self.labels[dimension], dtype=np.int64),
+                'dimension': dimension,
+            })
+            for key, value in self.extra.items():
+                frame[key] = value
+            frames.append(frame)
+        return pd.concat(frames, ignore_index=True)
+
+class DimensionView:
+    """The records of one dimension of a SharedTextDataset, rebuilt row by row on demand."""
+
+    def __init__(self, dataset: SharedTextDataset, dimension: str):
+        self.dataset = dataset
+        self.dimension = dimension
+        self.labels = dataset.labels[dimension]
+        self.choices_codes = dataset.choices_codes[dimension]
+
+    def __len__(self) -> int:
+        return self.dataset.n_rows
+
+    def __getitem__(self, idx: int) -> dict:
+        """The record at row idx, in the same format as the JSONL line."""
+        if idx < 0:
+            idx += self.dataset.n_rows
+        if not 0 <= idx < self.dataset.n_rows:
+            raise IndexError(f"Row {idx} out of range for {self.dataset.n_rows} rows")
+        return {
+            'text': self.dataset.text(idx),
+            'choices': self.dataset.choices_table[self.choices_codes[idx]],
+            'label': int(self.labels[idx]),
+            'dimension': self.dimension,
+            **self.dataset.extra,
+        }
+
+    def __iter__(self) -> Iterator[dict]:
+        for idx in range(self.dataset.n_rows):
+            yield self[idx]
+
+    def to_dataframe(self) -> 'pd.DataFrame':
+        return self.dataset.to_dataframe([self.dimension])
@@ -0,0 +1,344 @@
+# This part is for finding the repeated and near-identical texts inside a split and across splits (train/test leakage)
+
+import os
+import csv
+import bisect
+from typing import Iterable, Iterator
+
+import numpy as np
+import pandas as pd
+
+from common.hash_table import SortedTable
+from common.records import encode_texts
+from common.shuffle import hash_keys, mix_hash, record_keys
+
+DEDUP_MODES = ['flag', 'drop']
+
+# 64 MinHash values per text, in 16 bands of 4: two texts with a Jaccard similarity s share a band
+# with probability 1 - (1 - s^4)^16, i.e., 99.9% for s = 0.8 and 9% for s = 0.3
+NUM_PERM = 64
+BANDS = 16
+
+def dedup_index_path(output_file_path: str) -> str:
+    """The duplicate index of a conversion, e.g., EmotivITA_{}_dev.jsonl -> EmotivITA_dev.dedup.npz"""
+    return os.path.splitext(output_file_path.replace('_{}', '').replace('{}', ''))[0] + '.dedup.npz'
+
+def dedup_report_path(output_file_path: str) -> str:
+    """The duplicate report of a conversion, e.g., EmotivITA_{}_dev.jsonl -> EmotivITA_dev.duplicates.tsv"""
+    return os.path.splitext(output_file_path.replace('_{}', '').replace('{}', ''))[0] + '.duplicates.tsv'
+
+def normalize_texts(texts: Iterable[str]) -> list[str]:
+    """Normalize the texts before hashing: NFKC, case folding, and every run of punctuation or spaces to a single space."""
+    series = pd.Series(list(texts), dtype=object).astype(str)
+    series = series.str.normalize('NFKC').str.casefold().str.replace(r'[\W_]+', ' ', regex=True).str.strip()
+    return series.tolist()
+
+def shingle_hashes(texts: list[str], shingle_size: int=5) -> tuple[np.ndarray, np.ndarray]:
+    """Hash every character shingle (UTF-8 byte k-gram) of every text, with array operations over all the texts at once.
+
+    Args:
+        texts (list[str]): the normalized texts. A text shorter than a shingle is padded with spaces.
+        shingle_size (int, optional): the number of bytes per shingle. Defaults to 5.
+
+    Returns:
+        tuple[np.ndarray, np.ndarray]: the uint64 hash of each shingle, and the index of the first shingle of each text
+    """
+    encoded = [text.encode('utf-8').ljust(shingle_size) for text in texts]
+    lengths = np.fromiter(map(len, encoded), dtype=np.int64, count=len(encoded))
+    n_shingles = lengths - shingle_size + 1
+    segment_starts = np.cumsum(n_shingles) - n_shingles
+    if not len(encoded):
+        return np.empty(0, dtype=np.uint64), segment_starts
+
+    buffer = np.frombuffer(b''.join(encoded), dtype=np.uint8).astype(np.uint64)
+    n_positions = len(buffer) - shingle_size + 1
+    hashes = np.zeros(n_positions, dtype=np.uint64)
+    with np.errstate(over='ignore'):
+        for j in range(shingle_size):
+            hashes = hashes * np.uint64(0x100000001B3) + buffer[j:j + n_positions]
+
+    # Keep the positions whose shingle does not cross the end of its text
+    text_starts = np.cumsum(lengths) - lengths
+    positions = np.repeat(text_starts - segment_starts, n_shingles) + np.arange(int(n_shingles.sum()))
+    return mix_hash(hashes[positions], 0), segment_starts
+
+def minhash_signatures(texts: list[str], num_perm: int=NUM_PERM, shingle_size: int=5, batch_size: int=4096) -> np.ndarray:
+    """The MinHash signature of each text: for each of num_perm hash functions, the minimum hash of its shingles.
+
+    The texts are hashed by batches of batch_size, so the arrays of shingles stay small whatever the chunk size.
+
+    Returns:
+        np.ndarray: shape (len(texts), num_perm), uint32
+    """
+    signatures = np.empty((len(texts), num_perm), dtype=np.uint32)
+    for start in range(0, len(texts), batch_size):
+        hashes, segment_starts = shingle_hashes(texts[start:start + batch_size], shingle_size)
+        batch = signatures[start:start + batch_size]
+        for perm in range(num_perm):
+            batch[:, perm] = np.minimum.reduceat(mix_hash(hashes, perm + 1) >> np.uint64(32), segment_starts)
+    return signatures
+
+def band_keys(signatures: np.ndarray, bands: int=BANDS) -> np.ndarray:
+    """Hash each band of rows of the signatures to a single key.
+
+    Returns:
+        np.ndarray: shape (len(signatures), bands), uint64
+    """
+    bands_view = signatures.reshape(len(signatures), bands, -1).astype(np.uint64)
+    keys = np.zeros(bands_view.shape[:2], dtype=np.uint64)
+    for row in range(bands_view.shape[2]):
+        keys = mix_hash(keys ^ bands_view[:, :, row], row)
+    return keys
+
+class DuplicateIndex:
+    """Find the exact and near duplicate texts of a conversion in a single streaming pass.
+
+    - exact duplicates: the same text once normalized (see normalize_texts), found in a table of the text hashes;
+    - near duplicates: an estimated Jaccard similarity of the character shingles of at least threshold, found with
+    MinHash signatures and locality-sensitive hashing (LSH). Each band of each signature is looked up in a table
+    that keeps the first row of each bucket, so a row is compared with at most `bands` earlier rows:
+    the cost is linear in the number of rows, never quadratic.
+
+    The tables are SortedTables of uint64 hashes, and each chunk is looked up at once with binary searches,
+    so only the few candidate pairs of the bands reach Python. A row costs about 450 bytes: its signature (256),
+    its exact hash and its `bands` band keys (12 bytes each with their row) and its key, in a UTF-8 buffer per chunk.
+
+    A duplicate of a row of a reference split (e.g., a test text that is also in the dev set) is a leak.
+    In the 'drop' mode, the leaked rows are removed from the chunks; in the 'flag' mode, they are only reported.
+    The duplicates inside the split are always only reported.
+
+    The index of the kept rows can be saved and loaded as the reference of the conversion of another split.
+
+    Example:
+        duplicate_index = DuplicateIndex(references=['EmotivITA/EmotivITA_dev.dedup.npz'], drop=True)
+        data_chunks = duplicate_index.stage(read_data('EmotivITA/save_folder/Test set - Gold labels.csv', 10_000))
+        ...
+        duplicate_index.save('EmotivITA/EmotivITA_test.dedup.npz')
+        duplicate_index.write_report('EmotivITA/EmotivITA_test.duplicates.tsv')
+    """
+
+    def __init__(self,
+                 references: list[str] | None=None,
+                 drop: bool=False,
+                 threshold: float=0.8,
+                 num_perm: int=NUM_PERM,
+                 bands: int=BANDS,
+                 shingle_size: int=5
+                 ):
+        """
+        Args:
+            references (list[str], optional): the saved indexes of the other splits. Defaults to None.
+            drop (bool, optional): whether to drop the rows that duplicate a row of a reference. Defaults to False.
+            threshold (float, optional): the minimum estimated Jaccard similarity of a near duplicate. Defaults to 0.8.
+            num_perm (int, optional): the number of MinHash values per text. Defaults to NUM_PERM.
+            bands (int, optional): the number of LSH bands, must divide num_perm. Defaults to BANDS.
+            shingle_size (int, optional): the number of bytes per shingle. Defaults to 5.
+
+        Raises:
+            ValueError: If bands does not divide num_perm, or if a reference was built with other parameters.
+        """
+        if num_perm % bands:
+            raise ValueError(f"bands ({bands}) must divide num_perm ({num_perm})")
+
+        self.drop = drop
+        self.threshold = threshold
+        self.num_perm = num_perm
+        self.bands = bands
+        self.shingle_size = shingle_size
+
+        # The blocks of rows of the references then of this split, by global row id: one block per reference or chunk
+        self._block_starts = []
+        self._key_blocks = []
+        self._sources = []
+        self.signatures = []
+        self.n_rows = 0
+        self.n_reference_rows = 0
+
+        self.exact_table = SortedTable()
+        # The band keys of all the bands in one table, salted by their band
+        self.band_table = SortedTable()
+        # The reference row and similarity of each near duplicate leak of this split, so its exact copies are leaks too
+        self._leaks = {}
+
+        # The kept rows of this split, to save
+        self._own_start = 0
+        self._kept = []
+        self._own_exact = []
+
+        self.duplicates = []
+        self.counts = {'exact': 0, 'near': 0, 'exact_leak': 0, 'near_leak': 0, 'dropped': 0}
+
+        for path in references or []:
+            self._load_reference(path)
+        self.n_reference_rows = self._own_start = self.n_rows
+
+    def _params(self) -> dict:
+        return {'num_perm': self.num_perm, 'bands': self.bands, 'shingle_size': self.shingle_size}
+
+    def _band_keys(self, signatures: np.ndarray) -> np.ndarray:
+        return mix_hash(band_keys(signatures, self.bands), np.arange(self.bands, dtype=np.uint64))
+
+    def _load_reference(self, path: str) -> None:
+        with np.load(path, allow_pickle=False) as saved:
+            params = {name: int(saved[name]) for name in self._params()}
+            if params != self._params():
+                raise ValueError(f"The index {path} was built with {params}, not {self._params()}")
+            key_buffer, key_offsets = saved['key_buffer'].tobytes(), saved['key_offsets']
+            exact, signatures = saved['exact'], saved['signatures']
+
+        gids = np.arange(self.n_rows, self.n_rows + len(signatures))
+        self._append(key_buffer, key_offsets, os.path.basename(path), signatures)
+        self.exact_table.first_new(exact, gids)
+        self.band_table.first_new(self._band_keys(signatures).ravel(), np.repeat(gids, self.bands))
+
+    def _append(self, key_buffer: bytes, key_offsets: np.ndarray, source: str, signatures: np.ndarray) -> None:
+        self._block_starts.append(self.n_rows)
+        self._key_blocks.append((key_buffer, key_offsets))
+        self._sources.append(source)
+        self.signatures.append(signatures)
+        self.n_rows += len(signatures)
+
+    def _key(self, gid: int) -> tuple[str, str]:
+        """The key and the source of a row."""
+        block = bisect.bisect_right(self._block_starts, gid) - 1
+        key_buffer, key_offsets = self._key_blocks[block]
+        row = gid - self._block_starts[block]
+        return key_buffer[key_offsets[row]:key_offsets[row + 1]].decode('utf-8'), self._sources[block]
+
+    def _gather_signatures(self, gids: np.ndarray) -> np.ndarray:
+        """The signatures of the rows gids, with a loop over the blocks rather than the rows."""
+        result = np.empty((len(gids), self.num_perm), dtype=np.uint32)
+        blocks = np.searchsorted(self._block_starts, gids, side='right') - 1
+        for block in np.unique(blocks).tolist():
+            mask = blocks == block
+            result[mask] = self.signatures[block][gids[mask] - self._block_starts[block]]
+        return result
+
+    def check(self, keys: list[str], texts: list[str]) -> np.ndarray:
+        """Index a chunk of rows and find their duplicates among the reference rows and the earlier rows.
+
+        Args:
+            keys (list[str]): the key of each row, see common.shuffle.record_keys
+            texts (list[str]): the text of each row
+
+        Returns:
+            np.ndarray: whether each row is kept, i.e., False for the leaked rows in the 'drop' mode
+        """
+        normalized = normalize_texts(texts)
+        exact = hash_keys(normalized, seed=0)
+        signatures = minhash_signatures(normalized, self.num_perm, self.shingle_size)
+
+        start = self.n_rows
+        gids = np.arange(start, start + len(keys))
+        self._append(*encode_texts(keys), '', signatures)
+
+        # The first row of each text: an earlier one is an exact duplicate, and only the new texts are banded
+        exact_match = self.exact_table.first_new(exact, gids)
+        new = np.flatnonzero(exact_match == gids)
+        near_match, near_similarity = self._near_matches(gids[new], signatures[new])
+
+        match = np.where(exact_match == gids, -1, exact_match)
+        similarity = np.ones(len(keys))
+        match[new] = near_match
+        similarity[new] = near_similarity
+        is_near = np.zeros(len(keys), dtype=bool)
+        is_near[new] = True
+
+        keep = np.ones(len(keys), dtype=bool)
+        # Only the duplicates reach Python, in the order of the rows, since a near leak makes its exact copies leaks
+        for row in np.flatnonzero(match >= 0).tolist():
+            gid, duplicate_of, row_similarity, kind = start + row, int(match[row]), float(similarity[row]), 'exact'
+            if is_near[row]:
+                kind = 'near'
+            elif duplicate_of in self._leaks:
+                (duplicate_of, row_similarity), kind = self._leaks[duplicate_of], 'near'
+
+            leak = duplicate_of < self.n_reference_rows
+            if leak and kind == 'near':
+                self._leaks[gid] = (duplicate_of, row_similarity)
+            self.counts[kind + '_leak' if leak else kind] += 1
+            match_key, match_source = self._key(duplicate_of)
+            self.duplicates.append((keys[row], kind, match_key, match_source or 'same split', row_similarity))
+            if leak and self.drop:
+                keep[row] = False
+                self.counts['dropped'] += 1
+
+        self._kept.append(keep)
+        self._own_exact.append(exact)
+        return keep
+
+    def _near_matches(self, gids: np.ndarray, signatures: np.ndarray) -> tuple[np.ndarray, np.ndarray]:
+        """The best near duplicate of each row among the first rows of its LSH buckets, -1 if none.
+
+        The rows of the references come first, so that a leak is reported rather than a duplicate inside the split,
+        then the highest similarity, then the earliest row.
+        """
+        match = np.full(len(gids), -1, dtype=np.int64)
+        similarity = np.zeros(len(gids))
+        if not len(gids):
+            return match, similarity
+
+        # The first row of each bucket of each row, itself when it opens the bucket
+        band_gids = np.repeat(gids, self.bands)
+        heads = self.band_table.first_new(self._band_keys(signatures).ravel(), band_gids)
+        candidate_bands = np.flatnonzero(heads != band_gids)
+        if not len(candidate_bands):
+            return match, similarity
+
+        # Each (row, candidate) pair once, as a single int64: the rows of a chunk and the row ids fit in 32 bits
+        pairs = np.unique((candidate_bands // self.bands << 32) | heads[candidate_bands])
+        rows, candidates = pairs >> 32, pairs & 0xFFFFFFFF
+        pair_similarity = np.mean(self._gather_signatures(candidates) == signatures[rows], axis=1)
+        close = pair_similarity >= self.threshold
+        rows, candidates, pair_similarity = rows[close], candidates[close], pair_similarity[close]
+        order = np.lexsort((candidates, -pair_similarity, candidates >= self.n_reference_rows, rows))
+        rows, candidates, pair_similarity = rows[order], candidates[order], pair_similarity[order]
+        best = np.flatnonzero(np.r_[True, rows[1:] != rows[:-1]]) if len(rows) else np.empty(0, dtype=np.int64)
+        match[rows[best]] = candidates[best]
+        similarity[rows[best]] = np.round(pair_similarity[best], 3)
+        return match, similarity
+
+    def stage(self, data_chunks: Iterable[pd.DataFrame], key_column: str='id') -> Iterator[pd.DataFrame]:
+        """A stage of the generator pipeline: index each chunk and pass it on, without its leaked rows in the 'drop' mode."""
+        for data in data_chunks:
+            keep = self.check(record_keys(data, key_column), data['text'].astype(str).tolist())
+            yield data if keep.all() else data[keep]
+
+    def save(self, path: str) -> None:
+        """Save the index of the kept rows of this split, to be used as the reference of another split."""
+        kept = np.concatenate(self._kept) if self._kept else np.empty(0, dtype=bool)
+        own_blocks = [block for block, start in zip(self.signatures, self._block_starts) if start >= self._own_start]
+        # The kept rows of each block are copied once, the signatures are most of the index
+        signatures = np.concatenate([np.empty((0, self.num_perm), dtype=np.uint32)] +
+                                    [block[keep] for block, keep in zip(own_blocks, self._kept)])
+        exact = np.concatenate([np.empty(0, dtype=np.uint64)] +
+                               [block[keep] for block, keep in zip(self._own_exact, self._kept)])
+
+        # The keys of the kept rows, packed in one UTF-8 buffer as in the chunks
+        own_keys = [(buffer, offsets) for (buffer, offsets), start in zip(self._key_blocks, self._block_starts)
+                    if start >= self._own_start]
+        key_lengths = np.concatenate([np.diff(offsets) for _, offsets in own_keys]) if own_keys else np.empty(0, dtype=np.int64)
+        key_bytes = np.frombuffer(b''.join(buffer for buffer, _ in own_keys), dtype=np.uint8)
+        key_offsets = np.zeros(int(kept.sum()) + 1, dtype=np.int64)
+        np.cumsum(key_lengths[kept], out=key_offsets[1:])
+
+        tmp_path = path + '.tmp.npz'
+        np.savez(tmp_path,
+                 key_buffer=key_bytes[np.repeat(kept, key_lengths)],
+                 key_offsets=key_offsets,
+                 exact=exact,
+                 signatures=signatures,
+                 **{name: np.array(value) for name, value in self._params().items()})
+        os.replace(tmp_path, path)
+
+    def write_report(self, path: str) -> None:
+        """Write every duplicate found, one per line: key, kind, duplicate_of, source, similarity."""
+        with open(path, 'w', encoding='utf-8', newline='') as f:
+            writer = csv.writer(f, delimiter='\t')
+            writer.writerow(['key', 'kind', 'duplicate_of', 'source', 'similarity'])
+            writer.writerows(self.duplicates)
+
+    def summary(self) -> str:
+        return (f"{self.counts['exact']} exact and {self.counts['near']} near duplicates in the split, "
+                f"{self.counts['exact_leak']} exact and {self.counts['near_leak']} near duplicates of the references, "
+                f"{self.counts['dropped']} rows dropped")
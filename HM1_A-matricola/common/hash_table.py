@@ -0,0 +1,68 @@
+# This part is for mapping many 64-bit hashes to row ids with numpy arrays instead of a dict
+
+import numpy as np
+
+class SortedTable:
+    """A hash table of uint64 keys to uint32 row ids, kept as a few sorted numpy blocks instead of a dict.
+
+    Each key keeps the first row inserted with it. Each insert adds a sorted block, and the last blocks are merged
+    while the one before is less than twice as large, so there are O(log n) blocks and each key is copied O(log n) times.
+    A lookup is a binary search of all the keys of a chunk in each block. A key costs 12 bytes instead of a dict entry.
+    """
+
+    def __init__(self):
+        self.keys = []
+        self.rows = []
+
+    def __len__(self) -> int:
+        return sum(map(len, self.keys))
+
+    def lookup(self, keys: np.ndarray) -> np.ndarray:
+        """The row of each key, -1 for the missing keys."""
+        found = np.full(len(keys), -1, dtype=np.int64)
+        for block_keys, block_rows in zip(self.keys, self.rows):
+            positions = np.minimum(np.searchsorted(block_keys, keys), len(block_keys) - 1)
+            hit = block_keys[positions] == keys
+            found[hit] = block_rows[positions[hit]]
+        return found
+
+    def insert(self, keys: np.ndarray, rows: np.ndarray) -> None:
+        """Insert keys that are not in the table yet, each one once."""
+        if not len(keys):
+            return
+        order = np.argsort(keys, kind='stable')
+        self.keys.append(keys[order])
+        self.rows.append(rows[order].astype(np.uint32))
+        while len(self.keys) > 1 and len(self.keys[-2]) < 2 * len(self.keys[-1]):
+            # The keys of two blocks are distinct, so the smaller one is inserted into the larger one without sorting again
+            (big_keys, small_keys), (big_rows, small_rows) = self.keys[-2:], self.rows[-2:]
+            if len(big_keys) < len(small_keys):
+                big_keys, small_keys, big_rows, small_rows = small_keys, big_keys, small_rows, big_rows
+            positions = np.searchsorted(big_keys, small_keys) + np.arange(len(small_keys))
+            from_big = np.ones(len(big_keys) + len(small_keys), dtype=bool)
+            from_big[positions] = False
+            merged_keys = np.empty(len(from_big), dtype=np.uint64)
+            merged_keys[positions], merged_keys[from_big] = small_keys, big_keys
+            merged_rows = np.empty(len(from_big), dtype=np.uint32)
+            merged_rows[positions], merged_rows[from_big] = small_rows, big_rows
+            self.keys[-2:] = [merged_keys]
+            self.rows[-2:] = [merged_rows]
+
+    def first_new(self, keys: np.ndarray, rows: np.ndarray) -> np.ndarray:
+        """The row that each key has after inserting the missing ones, in order: the one of the table if the key is in it,
+        else the first row of the key among rows. The missing keys are inserted.
+
+        Args:
+            keys (np.ndarray): the uint64 keys
+            rows (np.ndarray): the row of each key, in increasing order
+
+        Returns:
+            np.ndarray: the int64 row of each key
+        """
+        found = self.lookup(keys)
+        missing = np.flatnonzero(found < 0)
+        if len(missing):
+            unique_keys, first, inverse = np.unique(keys[missing], return_index=True, return_inverse=True)
+            found[missing] = rows[missing][first][inverse]
+            self.insert(unique_keys, rows[missing][first])
+        return found
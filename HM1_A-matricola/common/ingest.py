@@ -0,0 +1,192 @@
+# This part is for reading only the needed columns of the CSV/TSV inputs with compact dtypes, whatever their delimiter and compression
+
+import io
+import bz2
+import csv
+import gzip
+import lzma
+import zipfile
+from contextlib import ExitStack
+from typing import BinaryIO, Iterable, Iterator
+
+import pandas as pd
+
+try:
+    import pyarrow as pa
+    import pyarrow.csv as pa_csv
+except ImportError:
+    pa = pa_csv = None
+
+# The dtype of each known column: the ids and texts as strings (the ids are the keys of the shuffle, whatever they look like),
+# the labels on one byte. V/A/D stay float64, so they are binned against the thresholds exactly as they are written.
+COLUMN_TYPES = {
+    'id': 'str',
+    'text': 'str',
+    'rationales': 'str',
+    'homotransphobic': 'int8',
+    'V': 'float64',
+    'A': 'float64',
+    'D': 'float64',
+}
+
+# The cells read as missing in the numeric columns. The string columns have no missing cell: an empty text is ''.
+NA_VALUES = ['', '#N/A', '#N/A N/A', '#NA', '-1.#IND', '-1.#QNAN', '-NaN', '-nan', '1.#IND', '1.#QNAN', '<NA>', 'N/A', 'NA',
+             'NULL', 'NaN', 'None', 'n/a', 'nan', 'null']
+
+# The first bytes of each compression format
+MAGIC_NUMBERS = {
+    b'\x1f\x8b': 'gzip',
+    b'BZh': 'bz2',
+    b'\xfd7zXZ\x00': 'xz',
+    b'PK\x03\x04': 'zip',
+}
+
+# The delimiters that sniff_delimiter can find
+DELIMITERS = '\t,;|'
+
+# The bytes read to sniff the compression, the delimiter and the header
+SNIFF_SIZE = 1 << 16
+
+def sniff_compression(head: bytes) -> str | None:
+    """The compression of a file from its first bytes: 'gzip', 'bz2', 'xz', 'zip', or None for plain text."""
+    for magic, compression in MAGIC_NUMBERS.items():
+        if head.startswith(magic):
+            return compression
+    return None
+
+def sniff_delimiter(head: str) -> tuple[str, list[str]]:
+    """The delimiter and the column names of a CSV/TSV file, from its first line.
+
+    The header has no quoted field in these datasets, so the delimiter is the candidate that appears the most in it.
+
+    Raises:
+        ValueError: If the header has none of DELIMITERS, i.e., a single column.
+    """
+    header = head.lstrip('\ufeff').split('\n', 1)[0].rstrip('\r')
+    counts = {delimiter: header.count(delimiter) for delimiter in DELIMITERS}
+    delimiter = max(counts, key=counts.get)
+    if counts[delimiter] == 0:
+        raise ValueError(f"Could not find the delimiter of the header {header[:100]!r}, expected one of {list(DELIMITERS)}")
+    return delimiter, next(csv.reader([header], delimiter=delimiter))
+
+class _Prepended(io.RawIOBase):
+    """A stream that gives back the bytes read to sniff it, then the rest of it, without seeking.
+
+    A decompressing stream can say it is seekable while the stream under it is not, e.g., a member of a zip file.
+    """
+
+    def __init__(self, head: bytes, stream: BinaryIO):
+        self.head = memoryview(head)
+        self.stream = stream
+
+    def readable(self) -> bool:
+        return True
+
+    def readinto(self, buffer) -> int:
+        if self.head:
+            n = min(len(buffer), len(self.head))
+            buffer[:n] = self.head[:n]
+            self.head = self.head[n:]
+            return n
+        data = self.stream.read(len(buffer))
+        buffer[:len(data)] = data
+        return len(data)
+
+def _peek(stream: BinaryIO, size: int=SNIFF_SIZE) -> tuple[bytes, BinaryIO]:
+    """The first bytes of a stream, and a stream to read it from the start again, which does not close it."""
+    head = stream.read(size)
+    return head, io.BufferedReader(_Prepended(head, stream), buffer_size=1 << 20)
+
+def open_input(stream: BinaryIO) -> BinaryIO:
+    """The decompressed content of a binary stream (e.g., an open file or a member of a zip file), decompressed on the fly
+    if it starts with the magic number of a compression. A zip file is read from its first member."""
+    head, peeked = _peek(stream, 8)
+    compression = sniff_compression(head)
+    if compression == 'zip':
+        # The members of a zip file are found from its end, so it is read from the file itself
+        stream.seek(0)
+        zf = zipfile.ZipFile(stream)
+        return zf.open(zf.namelist()[0])
+    stream = peeked
+    if compression == 'gzip':
+        return gzip.GzipFile(fileobj=stream)
+    if compression == 'bz2':
+        return bz2.BZ2File(stream)
+    if compression == 'xz':
+        return lzma.LZMAFile(stream)
+    return stream
+
+def read_columns(source: str | BinaryIO,
+                 columns: Iterable[str],
+                 chunksize: int | None=None
+                 ) -> Iterator[pd.DataFrame]:
+    """Read only the given columns of a CSV/TSV file, with the dtypes of COLUMN_TYPES, at once or in chunks.
+
+    The compression and the delimiter are sniffed from the content, not from the file extension. With pyarrow installed,
+    the file is parsed by the multithreaded Arrow CSV reader, else by the C parser of pandas. Both skip the other columns
+    while parsing, and give each column as a contiguous numpy array (or an Arrow string array for the texts).
+
+    Args:
+        source (str | BinaryIO): the path of the file, or an open binary stream
+        columns (Iterable[str]): the columns to read. The ones missing from the file are ignored, e.g., no id column.
+        chunksize (int, optional): the number of rows per chunk. Defaults to None, i.e., a single chunk.
+
+    Raises:
+        ValueError: If the delimiter cannot be found, see sniff_delimiter.
+
+    Yields:
+        pd.DataFrame: the chunks of the data, with the columns in the order of the file
+    """
+    with ExitStack() as stack:
+        raw = stack.enter_context(open(source, 'rb')) if isinstance(source, str) else source
+        decompressed = open_input(raw)
+        if decompressed is not raw:
+            # The decompressing wrappers do not close the stream under them, e.g., the one of the caller
+            stack.callback(decompressed.close)
+        head, stream = _peek(decompressed)
+        stack.callback(stream.close)
+        delimiter, header = sniff_delimiter(head.decode('utf-8', errors='replace'))
+        wanted = set(columns)
+        usecols = [column for column in header if column in wanted]
+        dtypes = {column: COLUMN_TYPES[column] for column in usecols if column in COLUMN_TYPES}
+
+        if pa_csv is not None:
+            yield from _read_arrow(stream, delimiter, usecols, dtypes, chunksize)
+            return
+        # Else an empty text (or one like 'NA') would be read as NaN
+        na_values = {column: NA_VALUES for column in usecols if dtypes.get(column) != 'str'}
+        options = dict(sep=delimiter, usecols=usecols, dtype=dtypes, keep_default_na=False, na_values=na_values, engine='c')
+        if chunksize is None:
+            yield pd.read_csv(stream, **options)
+        else:
+            yield from pd.read_csv(stream, chunksize=chunksize, **options)
+
+def _read_arrow(stream: BinaryIO, delimiter: str, usecols: list[str], dtypes: dict[str, str], chunksize: int | None) -> Iterator[pd.DataFrame]:
+    arrow_types = {'str': pa.string(), 'int8': pa.int8(), 'float64': pa.float64()}
+    read_options = pa_csv.ReadOptions(use_threads=True, block_size=1 << 24)
+    # The texts of the tweets can have new lines between quotes
+    parse_options = pa_csv.ParseOptions(delimiter=delimiter, newlines_in_values=True)
+    # The same missing values as the pandas path
+    convert_options = pa_csv.ConvertOptions(include_columns=usecols,
+                                            column_types={column: arrow_types[dtype] for column, dtype in dtypes.items()},
+                                            null_values=NA_VALUES, strings_can_be_null=False)
+    if chunksize is None:
+        table = pa_csv.read_csv(stream, read_options=read_options, parse_options=parse_options, convert_options=convert_options)
+        yield table.to_pandas()
+        return
+
+    # The Arrow batches follow the blocks of bytes, so they are sliced again into chunks of chunksize rows
+    reader = pa_csv.open_csv(stream, read_options=read_options, parse_options=parse_options, convert_options=convert_options)
+    pending, n_pending = [], 0
+    for batch in reader:
+        pending.append(batch)
+        n_pending += batch.num_rows
+        if n_pending < chunksize:
+            continue
+        table = pa.Table.from_batches(pending)
+        n_full = n_pending // chunksize * chunksize
+        for start in range(0, n_full, chunksize):
+            yield table.slice(start, chunksize).to_pandas()
+        pending, n_pending = table.slice(n_full).to_batches(), n_pending - n_full
+    if n_pending:
+        yield pa.Table.from_batches(pending, schema=reader.schema).to_pandas()
@@ -0,0 +1,148 @@
+# This part is for random access to the lines of the JSONL files through a byte-offset sidecar index
+
+import os
+import json
+import mmap
+from typing import Callable, Iterator
+
+import numpy as np
+
+# The index of data.jsonl is data.jsonl.idx: n_lines + 1 little-endian uint64 offsets.
+# Line i is data.jsonl[offsets[i]:offsets[i + 1]], with its new line.
+INDEX_SUFFIX = '.idx'
+INDEX_DTYPE = np.dtype('<u8')
+
+def index_path(jsonl_file_path: str) -> str:
+    return jsonl_file_path + INDEX_SUFFIX
+
+def line_end_offsets(buffer: bytes, base: int=0) -> np.ndarray:
+    """The offsets just after each new line of the buffer, shifted by base (the offset of the buffer in its file)."""
+    return np.flatnonzero(np.frombuffer(buffer, dtype=np.uint8) == ord('\n')).astype(INDEX_DTYPE) + (base + 1)
+
+def build_index(jsonl_file_path: str, block_size: int=1 << 24) -> np.ndarray:
+    """Scan a JSONL file once and write its index, e.g., for a file written by another tool.
+
+    Args:
+        jsonl_file_path (str): the JSONL file
+        block_size (int, optional): the number of bytes read at once. Defaults to 16 MiB.
+
+    Returns:
+        np.ndarray: the offsets
+    """
+    offsets = [np.zeros(1, dtype=INDEX_DTYPE)]
+    position = 0
+    with open(jsonl_file_path, 'rb') as f:
+        while block := f.read(block_size):
+            offsets.append(line_end_offsets(block, position))
+            position += len(block)
+    if position and offsets[-1][-1:].tolist() != [position]:
+        # The last line has no new line
+        offsets.append(np.array([position], dtype=INDEX_DTYPE))
+
+    offsets = np.concatenate(offsets)
+    offsets.tofile(index_path(jsonl_file_path))
+    return offsets
+
+class IndexedJsonl:
+    """Random access, sharding and shuffled iteration over a JSONL file, without reading the whole file.
+
+    The file and its index are memory-mapped: getting a row reads only its line.
+    The object can be pickled to the workers of a data loader, each one maps the files again on first use.
+
+    Example:
+        dataset = IndexedJsonl('EmotivITA/EmotivITA_Valence_dev.jsonl')
+        dataset[42]                                          # the 43rd record, as a dict
+        for record in dataset.shard(worker_id, num_workers): # a contiguous slice of the rows for this worker
+            ...
+        for record in dataset.shuffled(seed=epoch):          # all the rows in a random order
+            ...
+    """
+
+    def __init__(self, jsonl_file_path: str, loads: Callable[[bytes], dict]=json.loads):
+        """
+        Args:
+            jsonl_file_path (str): the JSONL file. Its index is built if it is missing or out of date.
+            loads (Callable[[bytes], dict], optional): the JSON decoder of a line, e.g., orjson.loads. Defaults to json.loads.
+        """
+        self.jsonl_file_path = jsonl_file_path
+        self.loads = loads
+        self._data = None
+        self._offsets = None
+
+        file_size = os.path.getsize(jsonl_file_path)
+        path = index_path(jsonl_file_path)
+        if not os.path.exists(path) or os.path.getsize(path) < INDEX_DTYPE.itemsize or self._last_offset(path) != file_size:
+            build_index(jsonl_file_path)
+        self.n_rows = os.path.getsize(path) // INDEX_DTYPE.itemsize - 1
+
+    @staticmethod
+    def _last_offset(path: str) -> int:
+        with open(path, 'rb') as f:
+            f.seek(-INDEX_DTYPE.itemsize, os.SEEK_END)
+            return int(np.frombuffer(f.read(), dtype=INDEX_DTYPE)[0])
+
+    def _open(self) -> None:
+        self._offsets = np.memmap(index_path(self.jsonl_file_path), dtype=INDEX_DTYPE, mode='r')
+        with open(self.jsonl_file_path, 'rb') as f:
+            self._data = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) if self.n_rows else b''
+
+    def __getstate__(self) -> dict:
+        # The memory maps are not picklable, each process maps the files again
+        return {**self.__dict__, '_data': None, '_offsets': None}
+
+    def __len__(self) -> int:
+        return self.n_rows
+
+    def line(self, idx: int) -> bytes:
+        """The raw bytes of line idx, without its new line."""
+        if self._data is None:
+            self._open()
+        if idx < 0:
+            idx += self.n_rows
+        if not 0 <= idx < self.n_rows:
+            raise IndexError(f"Row {idx} out of range for {self.n_rows} rows")
+        return self._data[int(self._offsets[idx]):int(self._offsets[idx + 1])].rstrip(b'\n')
+
+    def lines(self, indices: np.ndarray) -> list[bytes]:
+        """The raw bytes of the given lines, with their new lines, e.g., to copy them to another file."""
+        if self._data is None:
+            self._open()
+        indices = np.asarray(indices, dtype=np.int64)
+        starts, ends = self._offsets[indices].tolist(), self._offsets[indices + 1].tolist()
+        return [self._data[start:end] for start, end in zip(starts, ends)]
+
+    def close(self) -> None:
+        """Unmap the files, e.g., before replacing them. They are mapped again on the next access."""
+        if isinstance(self._data, mmap.mmap):
+            self._data.close()
+        self._data = self._offsets = None
+
+    def __getitem__(self, idx: int) -> dict:
+        return self.loads(self.line(idx))
+
+    def __iter__(self) -> Iterator[dict]:
+        return self.rows(range(self.n_rows))
+
+    def rows(self, indices) -> Iterator[dict]:
+        """The records of the given rows, in the given order."""
+        for idx in indices:
+            yield self[idx]
+
+    def shard_range(self, worker_id: int, num_workers: int) -> range:
+        """The contiguous rows of a worker: the rows are split in num_workers slices whose sizes differ by at most one."""
+        if not 0 <= worker_id < num_workers:
+            raise ValueError(f"worker_id must be in [0, {num_workers}), got {worker_id}")
+        return range(worker_id * self.n_rows // num_workers, (worker_id + 1) * self.n_rows // num_workers)
+
+    def shard(self, worker_id: int, num_workers: int) -> Iterator[dict]:
+        """The records of the contiguous shard of a worker, in order."""
+        return self.rows(self.shard_range(worker_id, num_workers))
+
+    def shuffled(self, seed: int, worker_id: int=0, num_workers: int=1) -> Iterator[dict]:
+        """The records in a random order given by the seed.
+
+        With several workers, all of them draw the same permutation and each one reads every num_workers-th row of it,
+        so together they read every row exactly once.
+        """
+        permutation = np.random.default_rng(seed).permutation(self.n_rows)
+        return self.rows(permutation[worker_id::num_workers].tolist())
@@ -0,0 +1,262 @@
+# This part is for tokenizing and lemmatizing each distinct text once, and keeping the result on the disk
+
+import os
+import json
+import sqlite3
+import hashlib
+import argparse
+from itertools import chain, islice
+from typing import Iterable, Iterator
+
+# The spaCy pipeline of the HM1_B notebook
+MODEL = 'it_core_news_sm'
+
+# The components that the tokens and the lemmas do not need
+DISABLE = ('parser', 'ner')
+
+# The default cache, next to the conversion scripts whatever the working directory
+LEMMA_CACHE_PATH = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), '.lemma_cache.sqlite')
+
+# The version of the stored analysis, to change when analyze_doc changes
+ANALYSIS_FORMAT = 'tokens-lemmas-v1'
+
+def text_digest(text: str) -> bytes:
+    """The content address of a text: a 128-bit BLAKE2b of its UTF-8 bytes."""
+    return hashlib.blake2b(text.encode('utf-8'), digest_size=16).digest()
+
+def pipeline_version(model: str=MODEL, disable: Iterable[str]=DISABLE) -> str:
+    """The version of everything that changes the analysis of a text, without loading the pipeline.
+
+    E.g., 'it_core_news_sm-3.7.0/spacy-3.7.4/-parser,ner/tokens-lemmas-v1'
+
+    Raises:
+        ValueError: If spaCy is not installed.
+    """
+    try:
+        import spacy
+    except ImportError as e:
+        raise ValueError("The lemmatization requires spaCy (pip install spacy && python -m spacy download it_core_news_sm)") from e
+    model_version = spacy.util.get_package_version(model) or 'unknown'
+    return f"{model}-{model_version}/spacy-{spacy.__version__}/-{','.join(sorted(disable))}/{ANALYSIS_FORMAT}"
+
+def analyze_doc(doc) -> dict:
+    """The stored analysis of a spaCy Doc: the text, lemma, stop word and punctuation flags of each token."""
+    return {
+        'tokens': [token.text for token in doc],
+        'lemmas': [token.lemma_ for token in doc],
+        'is_stop': [token.is_stop for token in doc],
+        'is_punct': [token.is_punct for token in doc],
+    }
+
+def select_tokens(analysis: dict, lemmatization: bool=True, remove_stopwords: bool=True, remove_punctuation: bool=True) -> list[str]:
+    """The lower-cased tokens (or lemmas) of an analysis, without the ones that spaCy flags as stop words or punctuation.
+
+    It is not the preprocess_data of the HM1_B notebook, which lemmatizes the text again once its punctuation and
+    stop words are removed (e.g., 'Mi piace, e tu?' -> ['mi', 'piacere', 'e', 'tu', '?']), so the lemmas can differ.
+
+    Example:
+        select_tokens(analysis)     # 'Mi piace, e tu?' -> ['piacere']
+    """
+    return [
+        (lemma if lemmatization else token).lower()
+        for token, lemma, is_stop, is_punct in zip(analysis['tokens'], analysis['lemmas'], analysis['is_stop'], analysis['is_punct'])
+        if not (remove_stopwords and is_stop) and not (remove_punctuation and is_punct) and not token.isspace()
+    ]
+
+class LemmaCache:
+    """The analyses of the texts, stored in an SQLite file by (text digest, pipeline version).
+
+    The key is the content of the text, not its row or file, so a text is analyzed once whatever the number of
+    files, dimensions or runs it appears in. A new model, spaCy version or analysis format gets new keys,
+    so an old analysis is never returned for a new pipeline.
+
+    Example:
+        with LemmaCache('.lemma_cache.sqlite', pipeline_version()) as cache:
+            found = cache.get_many(texts)     # {text: analysis} of the cached texts
+            cache.put_many(new_analyses)
+    """
+
+    def __init__(self, path: str=LEMMA_CACHE_PATH, pipeline: str | None=None):
+        """
+        Args:
+            path (str, optional): the SQLite file. Defaults to LEMMA_CACHE_PATH.
+            pipeline (str, optional): the pipeline version, see pipeline_version. Defaults to None, i.e., the default one.
+        """
+        self.path = path
+        self.pipeline = pipeline or pipeline_version()
+        self.connection = sqlite3.connect(path)
+        self.connection.execute(
+            'CREATE TABLE IF NOT EXISTS analyses ('
+            'text_digest BLOB NOT NULL, pipeline TEXT NOT NULL, analysis TEXT NOT NULL, '
+            'PRIMARY KEY (text_digest, pipeline)) WITHOUT ROWID'
+        )
+        self.connection.commit()
+
+    def get_many(self, texts: Iterable[str], batch_size: int=500) -> dict[str, dict]:
+        """The cached analysis of each text that has one.
+
+        Args:
+            texts (Iterable[str]): the texts
+            batch_size (int, optional): the number of texts per query. Defaults to 500.
+
+        Returns:
+            dict[str, dict]: the analysis of each cached text
+        """
+        found = {}
+        texts = iter(dict.fromkeys(texts))
+        while batch := list(islice(texts, batch_size)):
+            by_digest = {text_digest(text): text for text in batch}
+            rows = self.connection.execute(
+                f"SELECT text_digest, analysis FROM analyses WHERE pipeline = ? AND text_digest IN ({','.join('?' * len(by_digest))})",
+                [self.pipeline, *by_digest],
+            )
+            for digest, analysis in rows:
+                found[by_digest[digest]] = json.loads(analysis)
+        return found
+
+    def put_many(self, analyses: Iterable[tuple[str, dict]]) -> None:
+        """Store the analysis of each text, in a single transaction."""
+        with self.connection:
+            self.connection.executemany(
+                'INSERT OR REPLACE INTO analyses VALUES (?, ?, ?)',
+                ((text_digest(text), self.pipeline, json.dumps(analysis, ensure_ascii=False)) for text, analysis in analyses),
+            )
+
+    def close(self) -> None:
+        self.connection.close()
+
+    def __enter__(self) -> 'LemmaCache':
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback) -> None:
+        self.close()
+
+def fill_cache(texts: Iterable[str],
+               cache_path: str=LEMMA_CACHE_PATH,
+               model: str=MODEL,
+               n_process: int=-1,
+               batch_size: int=256,
+               nlp=None,
+               lookup_size: int=10_000
+               ) -> None:
+    """Analyze the texts that are not in the cache yet, in a single streaming pass, and store their analyses.
+
+    The texts are looked up by batches of lookup_size, and only the missing ones go through a single nlp.pipe
+    with n_process processes. Their analyses are stored by batches of 1000 texts, so an interrupted run keeps what
+    it has done. Nothing is kept per row, so the memory stays flat whatever the number of texts.
+    When every text is cached, spaCy is not even loaded.
+
+    Args:
+        texts (Iterable[str]): the texts, e.g., read chunk by chunk from the input of a conversion
+        cache_path (str, optional): the SQLite file of the cache. Defaults to LEMMA_CACHE_PATH.
+        model (str, optional): the spaCy pipeline. Defaults to MODEL.
+        n_process (int, optional): the number of processes of nlp.pipe, -1 for all the CPUs. Defaults to -1.
+        batch_size (int, optional): the number of texts per batch of nlp.pipe. Defaults to 256.
+        nlp (spacy.Language, optional): an already loaded pipeline. Defaults to None, i.e., load model when needed.
+        lookup_size (int, optional): the number of texts looked up in the cache at once. Defaults to 10_000.
+
+    Raises:
+        ValueError: If spaCy is not installed.
+    """
+    texts = iter(texts)
+    n_cached, n_missing = 0, 0
+    # The texts given to nlp.pipe and not stored yet, which reads ahead of the stored batches
+    pending = set()
+
+    with LemmaCache(cache_path, pipeline_version(model)) as cache:
+        def missing_texts():
+            nonlocal n_cached, n_missing
+            while batch := list(islice(texts, lookup_size)):
+                distinct = [text for text in dict.fromkeys(batch) if text not in pending]
+                found = cache.get_many(distinct)
+                n_cached += len(found)
+                for text in distinct:
+                    if text not in found:
+                        n_missing += 1
+                        pending.add(text)
+                        yield text
+
+        missing = missing_texts()
+        first = next(missing, None)
+        if first is not None:
+            if nlp is None:
+                import spacy
+                nlp = spacy.load(model, disable=list(DISABLE))
+            docs = nlp.pipe(((text, text) for text in chain([first], missing)), as_tuples=True,
+                            n_process=n_process, batch_size=batch_size)
+            while batch := list(islice(docs, 1000)):
+                cache.put_many((text, analyze_doc(doc)) for doc, text in batch)
+                pending.difference_update(text for _, text in batch)
+
+    print(f"Lemma cache: {n_cached} texts found in the cache, {n_missing} distinct texts analyzed")
+
+def lemmatize_texts(texts: Iterable[str],
+                    cache_path: str=LEMMA_CACHE_PATH,
+                    model: str=MODEL,
+                    n_process: int=-1,
+                    batch_size: int=256,
+                    nlp=None
+                    ) -> list[dict]:
+    """Get the analysis of each text, running spaCy only on the distinct texts that are not in the cache yet.
+
+    It keeps every text and returns one analysis per text, e.g., for a training run. To only fill the cache
+    (e.g., after a conversion), fill_cache streams the texts instead.
+
+    Args:
+        texts (Iterable[str]): the texts, e.g., the text column of a dataframe
+        cache_path (str, optional): the SQLite file of the cache. Defaults to LEMMA_CACHE_PATH.
+        model (str, optional): the spaCy pipeline. Defaults to MODEL.
+        n_process (int, optional): the number of processes of nlp.pipe, -1 for all the CPUs. Defaults to -1.
+        batch_size (int, optional): the number of texts per batch of nlp.pipe. Defaults to 256.
+        nlp (spacy.Language, optional): an already loaded pipeline. Defaults to None, i.e., load model when needed.
+
+    Raises:
+        ValueError: If spaCy is not installed.
+
+    Returns:
+        list[dict]: the analysis of each text, see analyze_doc
+
+    Example:
+        analyses = lemmatize_texts(df['text'])
+        df['tokens'] = [' '.join(select_tokens(analysis)) for analysis in analyses]
+    """
+    texts = list(texts)
+    fill_cache(texts, cache_path, model, n_process, batch_size, nlp)
+    with LemmaCache(cache_path, pipeline_version(model)) as cache:
+        found = cache.get_many(texts)
+    return [found[text] for text in texts]
+
+def read_texts(record_file_paths: Iterable[str]) -> Iterator[str]:
+    """Lazily read the texts of the converted JSONL files, one file after the other."""
+    for path in record_file_paths:
+        with open(path, encoding='utf-8') as f:
+            for line in f:
+                if line.strip():
+                    yield json.loads(line)['text']
+
+if __name__ == '__main__':
+
+    parser = argparse.ArgumentParser(description='Tokenize and lemmatize the texts of the converted files once, into the lemma cache')
+    parser.add_argument(
+        "--records",
+        type=str,
+        nargs='+',
+        required=True,
+        help="The converted JSONL files (e.g., --records EmotivITA/EmotivITA_*_dev.jsonl)"
+    )
+    parser.add_argument(
+        "--cache",
+        type=str,
+        default=LEMMA_CACHE_PATH,
+        help="The SQLite file of the cache"
+    )
+    parser.add_argument(
+        "--n_process",
+        type=int,
+        default=-1,
+        help="The number of spaCy processes, -1 for all the CPUs"
+    )
+    args = parser.parse_args()
+
+    fill_cache(read_texts(args.records), cache_path=args.cache, n_process=args.n_process)
+    print('Lemma cache written to:', os.path.abspath(args.cache))
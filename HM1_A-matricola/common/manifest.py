@@ -0,0 +1,266 @@
+# This part is for skipping or reducing the regeneration of the JSONL files when their inputs did not change
+
+import os
+import json
+import hashlib
+from collections import deque
+from typing import Callable, Iterable, Iterator
+
+import numpy as np
+import pandas as pd
+
+from common.jsonl_index import IndexedJsonl
+from common.serialization import JsonlSerializer
+from common.shuffle import hash_keys
+
+MANIFEST_NAME = 'conversion_manifest.json'
+
+def file_digest(file_path: str) -> str:
+    """The SHA-256 of the content of a file, read by blocks of 1 MiB."""
+    digest = hashlib.sha256()
+    with open(file_path, 'rb') as f:
+        while block := f.read(1 << 20):
+            digest.update(block)
+    return digest.hexdigest()
+
+def file_stat(file_path: str) -> dict:
+    stat = os.stat(file_path)
+    return {'size': stat.st_size, 'mtime_ns': stat.st_mtime_ns}
+
+def row_digests(data: pd.DataFrame, columns: list[str]) -> np.ndarray:
+    """A 64-bit digest of the content of each row, over the given columns.
+
+    Args:
+        data (pd.DataFrame): the data
+        columns (list[str]): the columns that the output of a row depends on. The missing ones are ignored, 
+    and the missing values (e.g., an empty rationale) are empty strings.
+
+    Returns:
+        np.ndarray: the uint64 digest of each row
+    """
+    values = [data[column].fillna('').astype(str).tolist() for column in columns if column in data.columns]
+    return hash_keys(('\x1f'.join(row) for row in zip(*values)), seed=0)
+
+class ConversionManifest:
+    """The hashes of the inputs and the parameters of each conversion, saved next to its outputs.
+
+    A conversion is up to date when its parameters did not change, its outputs were not modified since it wrote them,
+    and its inputs have the same content. The content is hashed only when the size or the modification time of an input
+    changed, so an up to date check costs a few stat calls.
+
+    The manifest also keeps the digest of each input row (see row_digests), aligned with the lines of the outputs.
+    When only some rows changed, RowCache reuses the lines of the unchanged rows and converts the others only.
+
+    Example:
+        manifest = ConversionManifest('HODI_2023/HODI_2023_train_subtaskA.jsonl')
+        if not manifest.is_up_to_date([input_file_path], params):
+            ...
+            manifest.record([input_file_path], params, digests)
+    """
+
+    def __init__(self, *output_file_paths: str):
+        """
+        Args:
+            output_file_paths (str): the outputs of the conversion. The manifest is saved in the folder of the first one.
+        """
+        self.output_file_paths = list(output_file_paths)
+        self.name = os.path.basename(self.output_file_paths[0])
+        self.manifest_path = os.path.join(os.path.dirname(os.path.abspath(self.output_file_paths[0])), MANIFEST_NAME)
+        self.rows_path = self.manifest_path[:-len('.json')] + f'.{self.name}.rows.npy'
+
+        try:
+            with open(self.manifest_path, encoding='utf-8') as f:
+                self.manifest = json.load(f)
+        except (FileNotFoundError, json.JSONDecodeError):
+            self.manifest = {}
+        self.entry = self.manifest.get(self.name)
+
+    def _outputs_unmodified(self, params: dict) -> bool:
+        if self.entry is None or self.entry['params'] != params:
+            return False
+        for path in self.output_file_paths:
+            if not os.path.exists(path) or file_stat(path) != self.entry['outputs'].get(path):
+                return False
+        return True
+
+    def is_up_to_date(self, input_file_paths: list[str], params: dict) -> bool:
+        """Whether the outputs were written by a conversion of the same inputs with the same parameters.
+
+        Args:
+            input_file_paths (list[str]): the inputs of the conversion
+            params (dict): every parameter that changes the outputs. Must be JSON-serializable.
+
+        Returns:
+            bool: True if the conversion can be skipped
+        """
+        if not self._outputs_unmodified(params) or set(input_file_paths) != set(self.entry['inputs']):
+            return False
+
+        stats_changed = False
+        for path in input_file_paths:
+            recorded = self.entry['inputs'][path]
+            stat = file_stat(path)
+            if stat != {'size': recorded['size'], 'mtime_ns': recorded['mtime_ns']}:
+                # Touched or copied, but the content may be the same
+                if stat['size'] != recorded['size'] or file_digest(path) != recorded['sha256']:
+                    return False
+                recorded.update(stat)
+                stats_changed = True
+
+        if stats_changed:
+            self._save()
+        return True
+
+    def row_cache(self, params: dict) -> 'RowCache':
+        """The lines of the previous outputs by row digest, if they were written with the same parameters.
+
+        The previous outputs are not read: their lines are looked up by offset in their .idx files
+        (see common.jsonl_index), only for the rows that are reused.
+
+        Args:
+            params (dict): every parameter that changes the outputs
+
+        Returns:
+            RowCache: the cache, empty if there is nothing to reuse
+        """
+        if not self._outputs_unmodified(params) or not os.path.exists(self.rows_path):
+            return RowCache()
+
+        digests = np.load(self.rows_path)
+        lines = [IndexedJsonl(path) for path in self.output_file_paths]
+        if any(len(output_lines) != len(digests) for output_lines in lines):
+            return RowCache()
+        return RowCache(digests, lines)
+
+    def record(self, input_file_paths: list[str], params: dict, digests: np.ndarray) -> None:
+        """Save the hashes of the inputs, the parameters and the row digests of a finished conversion.
+
+        Args:
+            input_file_paths (list[str]): the inputs of the conversion
+            params (dict): every parameter that changes the outputs. Must be JSON-serializable.
+            digests (np.ndarray): the digest of each row, aligned with the lines of the outputs
+        """
+        np.save(self.rows_path, digests)
+        self.entry = {
+            'params': params,
+            'inputs': {path: {**file_stat(path), 'sha256': file_digest(path)} for path in input_file_paths},
+            'outputs': {path: file_stat(path) for path in self.output_file_paths},
+        }
+        self._save()
+
+    def _save(self) -> None:
+        # Re-read the manifest, other conversions may have recorded their entries in the meantime
+        try:
+            with open(self.manifest_path, encoding='utf-8') as f:
+                self.manifest = json.load(f)
+        except (FileNotFoundError, json.JSONDecodeError):
+            self.manifest = {}
+        self.manifest[self.name] = self.entry
+
+        # One temporary file per process, since the conversions of a TaskGraph may save at the same time
+        tmp_path = f'{self.manifest_path}.{os.getpid()}.tmp'
+        with open(tmp_path, 'w', encoding='utf-8') as f:
+            json.dump(self.manifest, f, indent=2)
+        os.replace(tmp_path, self.manifest_path)
+
+class RowCache:
+    """Reuse the encoded lines of the rows that did not change since the previous conversion.
+
+    It wraps the conversion as two stages of the generator pipeline:
+        - filter: computes the digest of each row of each chunk and drops the rows that have a line in the cache;
+        - merge: encodes the entries of the remaining rows and puts the cached lines back in the order of the rows.
+
+    The conversion of a row depends only on the row and the parameters (see common.shuffle),
+    so the output is the same as the one of a full conversion.
+
+    Example:
+        row_cache = manifest.row_cache(params)
+        entries_chunks = convert(row_cache.filter(data_chunks, columns))
+        for lines in row_cache.merge(entries_chunks, serializer):
+            ...
+    """
+
+    def __init__(self, digests: np.ndarray | None=None, lines: list[IndexedJsonl] | None=None):
+        """
+        Args:
+            digests (np.ndarray, optional): the row digests of the previous conversion. Defaults to None, i.e., empty.
+            lines (list[IndexedJsonl], optional): for each output, the lines of the previous conversion. Defaults to None.
+        """
+        self.lines = lines
+        self.digests = []
+        self.n_reused = 0
+        self._plans = deque()
+
+        if digests is not None and len(digests):
+            # Sorted digests to look up the rows of a chunk with a binary search
+            self._order = np.argsort(digests, kind='stable')
+            self._sorted = digests[self._order]
+        else:
+            self._sorted = None
+
+    def filter(self,
+               data_chunks: Iterable[pd.DataFrame],
+               columns: list[str],
+               on_reused: Callable[[pd.DataFrame], None] | None=None
+               ) -> Iterator[pd.DataFrame]:
+        """Yield the rows of each chunk that must be converted, i.e., the ones without a cached line.
+
+        Args:
+            data_chunks (Iterable[pd.DataFrame]): the chunks of the data
+            columns (list[str]): the columns that the output of a row depends on, see row_digests
+            on_reused (Callable[[pd.DataFrame], None], optional): called with the rows of each chunk that have a cached line,
+        e.g., to count their labels as the converted ones. Defaults to None.
+
+        Yields:
+            pd.DataFrame: the rows to convert of each chunk
+        """
+        for data in data_chunks:
+            digests = row_digests(data, columns)
+            self.digests.append(digests)
+
+            if self._sorted is None:
+                self._plans.append(None)
+                yield data
+                continue
+
+            positions = np.minimum(np.searchsorted(self._sorted, digests), len(self._sorted) - 1)
+            hit = self._sorted[positions] == digests
+            self._plans.append((hit, self._order[positions[hit]]))
+            self.n_reused += int(hit.sum())
+            if on_reused is not None and hit.any():
+                on_reused(data[hit])
+            yield data[~hit]
+
+    def merge(self, entries_chunks: Iterable[list[list[dict]]], serializer: JsonlSerializer) -> Iterator[list[bytes]]:
+        """Encode the entries of each chunk and put back the cached lines of the filtered rows.
+
+        Args:
+            entries_chunks (Iterable[list[list[dict]]]): for each chunk given by filter, one list of jsonl entries per output
+            serializer (JsonlSerializer): the JSON encoder
+
+        Yields:
+            list[bytes]: for each chunk, the encoded lines of each output
+        """
+        for jsonl_entries in entries_chunks:
+            plan = self._plans.popleft()
+            encoded = [serializer.encode(entries) for entries in jsonl_entries]
+            if plan is None:
+                yield encoded
+                continue
+
+            hit, old_rows = plan
+            merged = []
+            for output_idx, buffer in enumerate(encoded):
+                lines = np.empty(len(hit), dtype=object)
+                lines[hit] = self.lines[output_idx].lines(old_rows)
+                lines[~hit] = buffer.splitlines(keepends=True)
+                merged.append(b''.join(lines))
+            yield merged
+
+        # The previous outputs are replaced once all the chunks are written
+        for output_lines in self.lines or []:
+            output_lines.close()
+
+    def all_digests(self) -> np.ndarray:
+        """The digests of all the rows seen by filter, in order."""
+        return np.concatenate(self.digests) if self.digests else np.empty(0, dtype=np.uint64)
@@ -0,0 +1,179 @@
+# This part is for measuring the stages of a conversion (time, rows, throughput, labels) and for profiling a run
+
+import os
+import json
+import time
+import pstats
+import cProfile
+from contextlib import contextmanager, nullcontext
+from typing import Callable, Iterable, Iterator
+
+def metrics_path(output_file_path: str) -> str:
+    """The metrics report of a conversion, e.g., EmotivITA_{}_dev.jsonl -> EmotivITA_dev.metrics.json"""
+    return os.path.splitext(output_file_path.replace('_{}', '').replace('{}', ''))[0] + '.metrics.json'
+
+def profile_path(output_file_path: str) -> str:
+    """The cProfile stats of a conversion, e.g., EmotivITA_{}_dev.jsonl -> EmotivITA_dev.prof"""
+    return os.path.splitext(output_file_path.replace('_{}', '').replace('{}', ''))[0] + '.prof'
+
+# Returned by Metrics.stage when the metrics are disabled, so that a disabled stage costs a method call
+_DISABLED_STAGE = nullcontext()
+
+class Metrics:
+    """The wall time, rows and calls of each stage of a conversion, and the histograms of its labels.
+
+    The stages are timed exclusively: when a stage pulls a chunk from the previous stage of the generator pipeline
+    (e.g., serialize pulls from bin, which pulls from read), the time spent in the inner stage is not counted
+    in the outer one. The sum of the stages is then the time of the pipeline, without double counting.
+
+    When disabled, stage returns a shared no-op context, timed returns its iterable unchanged and the
+    histograms are not updated, so the instrumented code runs at the same speed as without the metrics.
+
+    Example:
+        metrics = Metrics()
+        data_chunks = metrics.timed(read_data(input_file_path, chunksize), 'read', rows=len)
+        for data in data_chunks:
+            with metrics.stage('bin', len(data)):
+                cat_idx = bin_values(...)
+        metrics.write('EmotivITA/EmotivITA_dev.metrics.json')
+    """
+
+    def __init__(self, enabled: bool=True, **meta):
+        """
+        Args:
+            enabled (bool, optional): whether to record anything. Defaults to True.
+            meta: the fields written as they are at the top of the report, e.g., converter='emotivITA'
+        """
+        self.enabled = enabled
+        self.meta = meta
+        self.stages = {}
+        self.histograms = {}
+        self.outputs = {}
+        self._stack = []
+        self._start = time.perf_counter()
+
+    def _enter(self, name: str) -> None:
+        now = time.perf_counter()
+        if self._stack:
+            # Pause the outer stage
+            outer = self._stack[-1]
+            self.stages[outer[0]]['seconds'] += now - outer[1]
+        self.stages.setdefault(name, {'seconds': 0.0, 'rows': 0, 'calls': 0})
+        self._stack.append([name, now])
+
+    def _exit(self, rows: int) -> None:
+        now = time.perf_counter()
+        name, start = self._stack.pop()
+        stage = self.stages[name]
+        stage['seconds'] += now - start
+        stage['rows'] += rows
+        stage['calls'] += 1
+        if self._stack:
+            # Resume the outer stage
+            self._stack[-1][1] = now
+
+    @contextmanager
+    def _stage(self, name: str, rows: int):
+        self._enter(name)
+        try:
+            yield
+        finally:
+            self._exit(rows)
+
+    def stage(self, name: str, rows: int=0):
+        """A context that adds its time and rows to the stage name."""
+        if not self.enabled:
+            return _DISABLED_STAGE
+        return self._stage(name, rows)
+
+    def timed(self, iterable: Iterable, name: str, rows: Callable | None=None) -> Iterable:
+        """Time the production of each item of a (lazy) iterable as the stage name.
+
+        Args:
+            iterable (Iterable): e.g., the chunks of read_data
+            name (str): the name of the stage
+            rows (Callable, optional): the number of rows of an item, e.g., len. Defaults to None, i.e., no rows.
+
+        Returns:
+            Iterable: the same items
+        """
+        if not self.enabled:
+            return iterable
+        return self._timed(iter(iterable), name, rows)
+
+    def _timed(self, iterator: Iterator, name: str, rows: Callable | None) -> Iterator:
+        while True:
+            self._enter(name)
+            try:
+                item = next(iterator)
+            except StopIteration:
+                # The last call only finds the end, it is not an item
+                self._exit(0)
+                self.stages[name]['calls'] -= 1
+                return
+            except BaseException:
+                self._exit(0)
+                raise
+            self._exit(rows(item) if rows is not None else 0)
+            yield item
+
+    def add_rows(self, name: str, rows: int) -> None:
+        """Add rows to a stage, e.g., the rows written, known only once the write stage ended."""
+        if self.enabled and name in self.stages:
+            self.stages[name]['rows'] += int(rows)
+
+    def add_histogram(self, name: str, counts: dict) -> None:
+        """Add counts to the histogram name, e.g., metrics.add_histogram('Valence', {'Bassa': 10, 'Alta': 3})."""
+        if not self.enabled:
+            return
+        histogram = self.histograms.setdefault(name, {})
+        for key, count in counts.items():
+            histogram[str(key)] = histogram.get(str(key), 0) + int(count)
+
+    def add_output(self, path: str) -> None:
+        if self.enabled and os.path.exists(path):
+            self.outputs[path] = os.path.getsize(path)
+
+    def report(self) -> dict:
+        """The metrics as a JSON-serializable dict, with the rows/s of each stage."""
+        stages = {
+            name: {**stage, 'seconds': round(stage['seconds'], 6),
+                   'rows_per_s': round(stage['rows'] / stage['seconds']) if stage['rows'] and stage['seconds'] > 0 else None}
+            for name, stage in self.stages.items()
+        }
+        return {
+            **self.meta,
+            'wall_seconds': round(time.perf_counter() - self._start, 6),
+            'stages': stages,
+            'histograms': self.histograms,
+            'outputs': self.outputs,
+        }
+
+    def write(self, path: str) -> None:
+        with open(path, 'w', encoding='utf-8') as f:
+            json.dump(self.report(), f, indent=2, ensure_ascii=False)
+        print('Metrics written to:', path)
+
+@contextmanager
+def profiled(path: str | None, top: int=20):
+    """Profile the block with cProfile, save the stats to path and print the slowest functions. A no-op if path is None.
+
+    The stats can be read again with pstats, or viewed with snakeviz/gprof2dot. A sampling profiler,
+    e.g., py-spy record -o profile.svg -- python EmotivITA/scripts.py, needs no option since it attaches from outside.
+
+    Example:
+        with profiled('EmotivITA/EmotivITA_dev.prof'):
+            emotivITA(...)
+    """
+    if path is None:
+        yield
+        return
+    profiler = cProfile.Profile()
+    profiler.enable()
+    try:
+        yield
+    finally:
+        profiler.disable()
+        profiler.dump_stats(path)
+        pstats.Stats(profiler).sort_stats('cumulative').print_stats(top)
+        print('Profile written to:', path)
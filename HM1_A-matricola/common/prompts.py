@@ -0,0 +1,197 @@
+# This part is for rendering the prompt templates (prompt.jsonl) with the converted records (the JSONL datasets)
+
+import re
+import json
+import argparse
+from itertools import islice
+from typing import Iterable, Iterator
+
+# {{text}}, {{ dimension }}, ...
+PLACEHOLDER = re.compile(r'\{\{\s*(\w+)\s*\}\}')
+
+_encode = json.JSONEncoder(ensure_ascii=False).encode
+
+class PromptTemplate:
+    """A prompt template, parsed once into literal parts and placeholders.
+
+    A template is one line of a prompt file, i.e., a JSON object whose text may contain {{name}} placeholders:
+        - inside a JSON string, e.g., "FRASE: {{ text }}", the value is inserted as escaped text. A list is joined with ', '.
+        - outside of a JSON string, e.g., "choices": {{choices}}, the value is inserted as JSON, e.g., ["Vero", "Falso"].
+    This is why the HODI templates, which are not valid JSON as written, render to valid JSON.
+
+    The rendered line is the template with its placeholders filled, plus the prompt_id and every field of the record
+    that the template does not already have, e.g., the label, so that each line is a complete evaluation sample.
+
+    Example:
+        template = PromptTemplate('{"prompt": "FRASE: {{ text }}"}')
+        template.render({'text': 'Ciao', 'label': 0}, prompt_id=0)
+        # '{"prompt": "FRASE: Ciao", "prompt_id": 0, "text": "Ciao", "label": 0}'
+    """
+
+    def __init__(self, line: str):
+        """
+        Args:
+            line (str): the template, a JSON object with placeholders
+
+        Raises:
+            ValueError: If the line is not a JSON object once its placeholders are filled.
+        """
+        line = line.strip()
+        if not (line.startswith('{') and line.endswith('}')):
+            raise ValueError(f"A prompt template must be a JSON object, got: {line[:80]}")
+
+        # The parts are alternating literals and (name, in_string) placeholders, starting and ending with a literal.
+        # The closing brace is left out, so that the extra fields can be appended.
+        body = line[:-1].rstrip()
+        self.literals = []
+        self.placeholders = []
+        position = 0
+        in_string = False
+        for match in PLACEHOLDER.finditer(body):
+            literal = body[position:match.start()]
+            in_string = _ends_in_string(literal, in_string)
+            self.literals.append(literal)
+            self.placeholders.append((match.group(1), in_string))
+            position = match.end()
+        self.literals.append(body[position:])
+
+        # Check the template and get its keys by filling the placeholders with dummy values
+        try:
+            keys = json.loads(self._fill(['' if in_string else 'null' for _, in_string in self.placeholders]) + '}').keys()
+        except json.JSONDecodeError as e:
+            raise ValueError(f"Invalid prompt template: {line[:80]}") from e
+        self.keys = set(keys) | {'prompt_id'}
+
+    def _fill(self, values: list[str]) -> str:
+        parts = [self.literals[0]]
+        for value, literal in zip(values, self.literals[1:]):
+            parts.append(value)
+            parts.append(literal)
+        return ''.join(parts)
+
+    def render(self, record: dict, prompt_id: int) -> str:
+        """Render the template with a record.
+
+        Args:
+            record (dict): a converted record, e.g., {'text': ..., 'choices': [...], 'label': 0}
+            prompt_id (int): the index of the template in its prompt file
+
+        Raises:
+            KeyError: If the record has no value for a placeholder.
+
+        Returns:
+            str: the rendered JSON object, on a single line
+        """
+        values = []
+        for name, in_string in self.placeholders:
+            value = record[name]
+            if in_string:
+                if isinstance(value, (list, tuple)):
+                    value = ', '.join(map(str, value))
+                values.append(_encode(str(value))[1:-1])
+            else:
+                values.append(_encode(value))
+
+        extra = [f', "prompt_id": {prompt_id}']
+        extra += [f', {_encode(key)}: {_encode(value)}' for key, value in record.items() if key not in self.keys]
+        return self._fill(values) + ''.join(extra) + '}'
+
+def _ends_in_string(literal: str, in_string: bool) -> bool:
+    """Whether the end of the JSON text literal is inside a string, given whether its start is."""
+    escaped = False
+    for char in literal:
+        if escaped:
+            escaped = False
+        elif char == '\\' and in_string:
+            escaped = True
+        elif char == '"':
+            in_string = not in_string
+    return in_string
+
+def load_prompt_templates(prompt_file_path: str) -> list[PromptTemplate]:
+    """Parse every template of a prompt file, one per non-empty line."""
+    with open(prompt_file_path, encoding='utf-8') as f:
+        return [PromptTemplate(line) for line in f if line.strip()]
+
+def read_records(record_file_paths: Iterable[str]) -> Iterator[dict]:
+    """Lazily read the records of the converted JSONL files, one file after the other."""
+    for path in record_file_paths:
+        with open(path, encoding='utf-8') as f:
+            for line in f:
+                if line.strip():
+                    yield json.loads(line)
+
+def expand(templates: list[PromptTemplate], records: Iterable[dict]) -> Iterator[str]:
+    """Lazily render every (prompt, record) pair, all the prompts of a record before the next record.
+
+    Args:
+        templates (list[PromptTemplate]): the compiled templates
+        records (Iterable[dict]): the converted records. Can be a generator, it is consumed once.
+
+    Yields:
+        str: one rendered line per pair
+    """
+    for record in records:
+        for prompt_id, template in enumerate(templates):
+            yield template.render(record, prompt_id)
+
+def render_evaluation_set(prompt_file_path: str,
+                          record_file_paths: list[str],
+                          output_file_path: str,
+                          batch_size: int=10_000
+                          ) -> int:
+    """Write the evaluation set of every (prompt, record) pair in a single pass over the records.
+
+    The memory stays flat: the lines are rendered lazily and written by batches.
+
+    Args:
+        prompt_file_path (str): the prompt file, e.g., 'EmotivITA/prompt.jsonl'
+        record_file_paths (list[str]): the converted JSONL files, e.g., the three EmotivITA dimensions
+        output_file_path (str): the JSONL file to write
+        batch_size (int, optional): the number of lines per write. Defaults to 10_000.
+
+    Returns:
+        int: the number of lines written
+
+    Example:
+        render_evaluation_set('HODI_2023/prompts_subtaskA.jsonl',
+                              ['HODI_2023/HODI_2023_train_subtaskA.jsonl'],
+                              'HODI_2023/HODI_2023_train_subtaskA_prompts.jsonl')
+    """
+    templates = load_prompt_templates(prompt_file_path)
+    lines = expand(templates, read_records(record_file_paths))
+
+    n_lines = 0
+    with open(output_file_path, 'w', encoding='utf-8') as f:
+        while batch := list(islice(lines, batch_size)):
+            f.write('\n'.join(batch) + '\n')
+            n_lines += len(batch)
+
+    print(f"{n_lines} prompts ({len(templates)} templates) written to: {output_file_path}")
+    return n_lines
+
+if __name__ == '__main__':
+
+    parser = argparse.ArgumentParser(description='Render every prompt template with every converted record')
+    parser.add_argument(
+        "--prompts",
+        type=str,
+        required=True,
+        help="The prompt file (e.g., --prompts EmotivITA/prompt.jsonl)"
+    )
+    parser.add_argument(
+        "--records",
+        type=str,
+        nargs='+',
+        required=True,
+        help="The converted JSONL files (e.g., --records EmotivITA/EmotivITA_Valence_dev.jsonl EmotivITA/EmotivITA_Arousal_dev.jsonl)"
+    )
+    parser.add_argument(
+        "--output",
+        type=str,
+        required=True,
+        help="The evaluation set to write"
+    )
+    args = parser.parse_args()
+
+    render_evaluation_set(args.prompts, args.records, args.output)
@@ -0,0 +1,216 @@
+# This part is for parsing the rationales of HODI subtask B and aligning them to the characters or the tokens of the texts
+
+from typing import Iterable
+
+import numpy as np
+
+# The label of the tokens that cover no character, e.g., the special tokens of a transformer, ignored by the loss
+IGNORE_LABEL = -100
+
+# The tokenizers that need no library: one token per character, or one per run of non-space characters
+TOKENIZERS = ['char', 'whitespace']
+
+# The code points of the characters for which str.isspace is True, which split the tokens of the whitespace tokenizer
+_WHITESPACE = np.array([*range(0x09, 0x0e), *range(0x1c, 0x21), 0x85, 0xa0, 0x1680, *range(0x2000, 0x200b),
+                        0x2028, 0x2029, 0x202f, 0x205f, 0x3000], dtype=np.uint32)
+
+def parse_rationales(values: Iterable[str | float]) -> tuple[np.ndarray, np.ndarray]:
+    """Parse the rationales column, a list of character indices per row (e.g., '[0, 1, 2]'), empty for no rationale.
+
+    All the rows are parsed at once by numpy: the lists are joined without their brackets, then read as one array.
+
+    Args:
+        values (Iterable[str | float]): the rationales of each row, NaN or '' for no rationale
+
+    Raises:
+        ValueError: If a value is not a list of integers.
+
+    Returns:
+        tuple[np.ndarray, np.ndarray]: the int32 character indices of all the rows, and the n_rows + 1 int64 offsets
+    of the indices of each row, i.e., the indices of row i are indices[offsets[i]:offsets[i + 1]]
+    """
+    bodies = []
+    for value in values:
+        value = value.strip() if isinstance(value, str) else ''
+        if value and not (value[0] == '[' and value[-1] == ']'):
+            raise ValueError(f"Expected a list of character indices, e.g., '[0, 1, 2]', got {value!r}")
+        bodies.append(value[1:-1].strip())
+
+    counts = np.array([body.count(',') + 1 if body else 0 for body in bodies], dtype=np.int64)
+    offsets = np.zeros(len(bodies) + 1, dtype=np.int64)
+    np.cumsum(counts, out=offsets[1:])
+    joined = ','.join(body for body in bodies if body)
+    indices = np.fromstring(joined, dtype=np.int64, sep=',') if joined else np.empty(0, dtype=np.int64)
+    if len(indices) != offsets[-1]:
+        raise ValueError(f"Expected {offsets[-1]} integer character indices, got {len(indices)}")
+    return indices.astype(np.int32), offsets
+
+def index_spans(indices: np.ndarray, offsets: np.ndarray) -> tuple[np.ndarray, np.ndarray, np.ndarray]:
+    """Compress the character indices of each row into [start, end) spans of consecutive characters.
+
+    Example:
+        index_spans(np.array([0, 1, 2, 7, 8]), np.array([0, 5]))   # starts [0, 7], ends [3, 9], span offsets [0, 2]
+
+    Returns:
+        tuple[np.ndarray, np.ndarray, np.ndarray]: the int32 starts and ends of the spans, and the n_rows + 1 offsets
+    of the spans of each row
+    """
+    row_starts = np.zeros(len(indices), dtype=bool)
+    row_starts[offsets[:-1][offsets[:-1] < offsets[1:]]] = True
+    # A span starts at the first index of a row, or after a gap
+    is_start = row_starts.copy()
+    is_start[1:] |= np.diff(indices) != 1
+    is_end = np.roll(is_start, -1)
+    if len(is_end):
+        is_end[-1] = True
+
+    rows = np.repeat(np.arange(len(offsets) - 1), np.diff(offsets))
+    span_counts = np.bincount(rows[is_start], minlength=len(offsets) - 1)
+    span_offsets = np.zeros(len(offsets), dtype=np.int64)
+    np.cumsum(span_counts, out=span_offsets[1:])
+    return indices[is_start].astype(np.int32), (indices[is_end] + 1).astype(np.int32), span_offsets
+
+def whitespace_offsets(texts: list[str]) -> tuple[np.ndarray, np.ndarray, np.ndarray]:
+    """The [start, end) character offsets of the runs of non-space characters of each text, found on the code points
+    of all the texts at once.
+
+    Returns:
+        tuple[np.ndarray, np.ndarray, np.ndarray]: the int32 starts and ends of the tokens, relative to their text,
+    and the n_texts + 1 offsets of the tokens of each text
+    """
+    char_offsets = np.zeros(len(texts) + 1, dtype=np.int64)
+    np.cumsum(np.fromiter(map(len, texts), dtype=np.int64, count=len(texts)), out=char_offsets[1:])
+    code_points = np.frombuffer(''.join(texts).encode('utf-32-le'), dtype=np.uint32)
+
+    is_char = ~np.isin(code_points, _WHITESPACE)
+    # The texts are separated as if by a space
+    boundary = np.zeros(len(code_points) + 1, dtype=bool)
+    boundary[char_offsets] = True
+    prev_char = np.concatenate([[False], is_char[:-1]]) & ~boundary[:-1]
+    next_char = np.concatenate([is_char[1:], [False]]) & ~boundary[1:]
+    starts = np.flatnonzero(is_char & ~prev_char)
+    ends = np.flatnonzero(is_char & ~next_char) + 1
+
+    rows = np.searchsorted(char_offsets, starts, side='right') - 1
+    token_offsets = np.zeros(len(texts) + 1, dtype=np.int64)
+    np.cumsum(np.bincount(rows, minlength=len(texts)), out=token_offsets[1:])
+    return (starts - char_offsets[rows]).astype(np.int32), (ends - char_offsets[rows]).astype(np.int32), token_offsets
+
+def tokenizer_offsets(texts: list[str], tokenizer) -> tuple[np.ndarray, np.ndarray, np.ndarray]:
+    """The character offsets of the tokens of a Hugging Face fast tokenizer, from the offset mappings it computes
+    for the whole batch in Rust.
+
+    Args:
+        texts (list[str]): the texts
+        tokenizer: a fast tokenizer, or its name to load it with transformers.AutoTokenizer
+
+    Raises:
+        ValueError: If transformers is not installed.
+
+    Returns:
+        tuple[np.ndarray, np.ndarray, np.ndarray]: the starts and ends of the tokens (both 0 for the special tokens)
+    and the n_texts + 1 offsets of the tokens of each text
+    """
+    if isinstance(tokenizer, str):
+        tokenizer = load_tokenizer(tokenizer)
+    mappings = tokenizer(texts, return_offsets_mapping=True, add_special_tokens=True)['offset_mapping']
+    token_offsets = np.zeros(len(texts) + 1, dtype=np.int64)
+    np.cumsum(np.fromiter(map(len, mappings), dtype=np.int64, count=len(texts)), out=token_offsets[1:])
+    pairs = np.array([pair for mapping in mappings for pair in mapping], dtype=np.int32).reshape(-1, 2)
+    return pairs[:, 0].copy(), pairs[:, 1].copy(), token_offsets
+
+def load_tokenizer(name: str):
+    """The fast tokenizer name (e.g., 'dbmdz/bert-base-italian-cased'), loaded with transformers.
+
+    Raises:
+        ValueError: If transformers is not installed, or if the tokenizer has no fast version, i.e., no offset mapping.
+    """
+    try:
+        from transformers import AutoTokenizer
+    except ImportError as e:
+        raise ValueError(f"The tokenizer {name!r} requires transformers (pip install transformers), "
+                         f"or use one from {TOKENIZERS}") from e
+    tokenizer = AutoTokenizer.from_pretrained(name, use_fast=True)
+    if not tokenizer.is_fast:
+        raise ValueError(f"The tokenizer {name!r} has no fast version, so it gives no offset mapping")
+    return tokenizer
+
+class RationaleBatch:
+    """The rationales of a batch of texts, as compact arrays.
+
+    - the spans: the int32 [start, end) character offsets of the rationale spans of all the texts, with the offsets
+    of the spans of each text, so a text costs 8 bytes per span instead of a Python int per character;
+    - the character mask: one int8 per character of all the texts, 1 in a rationale, and its prefix sums, which give
+    the number of rationale characters in any range of a text with two lookups.
+
+    token_labels aligns the rationales to the tokens of any tokenizer from their character offsets, with array operations
+    for the whole batch instead of a loop over the tokens.
+
+    Example:
+        batch = RationaleBatch(data['text'].tolist(), *parse_rationales(data['rationales']))
+        starts, ends, token_offsets = whitespace_offsets(batch.texts)
+        labels = batch.token_labels(starts, ends, token_offsets)  # 1 for the tokens that overlap a rationale
+    """
+
+    def __init__(self, texts: list[str], indices: np.ndarray, offsets: np.ndarray):
+        """
+        Args:
+            texts (list[str]): the texts
+            indices (np.ndarray): the rationale character indices of all the texts, see parse_rationales
+            offsets (np.ndarray): the n_texts + 1 offsets of the indices of each text
+
+        Raises:
+            ValueError: If an index is out of its text.
+        """
+        if len(offsets) != len(texts) + 1:
+            raise ValueError(f"Expected the offsets of {len(texts)} texts, got {len(offsets) - 1}")
+        self.texts = texts
+        self.char_offsets = np.zeros(len(texts) + 1, dtype=np.int64)
+        np.cumsum(np.fromiter(map(len, texts), dtype=np.int64, count=len(texts)), out=self.char_offsets[1:])
+
+        rows = np.repeat(np.arange(len(texts)), np.diff(offsets))
+        lengths = np.diff(self.char_offsets)
+        out_of_text = (indices < 0) | (indices >= lengths[rows])
+        if out_of_text.any():
+            row = int(rows[np.argmax(out_of_text)])
+            raise ValueError(f"The rationale index {int(indices[np.argmax(out_of_text)])} is out of the text {row} "
+                             f"of {int(lengths[row])} characters")
+
+        self.span_starts, self.span_ends, self.span_offsets = index_spans(indices, offsets)
+        self.char_mask = np.zeros(self.char_offsets[-1], dtype=np.int8)
+        self.char_mask[self.char_offsets[rows] + indices] = 1
+        self._prefix = np.zeros(len(self.char_mask) + 1, dtype=np.int64)
+        np.cumsum(self.char_mask, out=self._prefix[1:])
+
+    def __len__(self) -> int:
+        return len(self.texts)
+
+    def n_spans(self) -> np.ndarray:
+        return np.diff(self.span_offsets)
+
+    def char_labels(self) -> list[np.ndarray]:
+        """The 0/1 label of each character of each text."""
+        return np.split(self.char_mask, self.char_offsets[1:-1])
+
+    def token_labels(self, starts: np.ndarray, ends: np.ndarray, token_offsets: np.ndarray) -> np.ndarray:
+        """The label of each token: 1 if it overlaps a rationale, 0 if not, IGNORE_LABEL if it covers no character.
+
+        Args:
+            starts (np.ndarray): the start character of each token of all the texts, relative to its text
+            ends (np.ndarray): the end character (excluded) of each token
+            token_offsets (np.ndarray): the n_texts + 1 offsets of the tokens of each text
+
+        Returns:
+            np.ndarray: the int8 label of each token of all the texts, split by token_offsets
+        """
+        bases = np.repeat(self.char_offsets[:-1], np.diff(token_offsets))
+        # The rationale characters in [start, end) of each token, from the prefix sums of its text
+        overlap = self._prefix[bases + ends] - self._prefix[bases + starts]
+        labels = (overlap > 0).astype(np.int8)
+        labels[ends <= starts] = IGNORE_LABEL
+        return labels
+
+    def spans(self, idx: int) -> list[list[int]]:
+        """The [start, end) spans of the text idx."""
+        start, end = self.span_offsets[idx], self.span_offsets[idx + 1]
+        return np.stack([self.span_starts[start:end], self.span_ends[start:end]], axis=1).tolist()
@@ -0,0 +1,128 @@
+# This part is for holding the converted records as a few arrays instead of one dict per record
+
+from typing import Iterable, Iterator
+
+import numpy as np
+
+def encode_texts(texts: Iterable[str]) -> tuple[bytes, np.ndarray]:
+    """Encode the texts to one UTF-8 buffer and the offsets of each text in it.
+
+    Returns:
+        tuple[bytes, np.ndarray]: the buffer, and the n_texts + 1 int64 offsets. Text i is buffer[offsets[i]:offsets[i + 1]].
+    """
+    encoded = [text.encode('utf-8') for text in texts]
+    offsets = np.zeros(len(encoded) + 1, dtype=np.int64)
+    np.cumsum(np.fromiter(map(len, encoded), dtype=np.int64, count=len(encoded)), out=offsets[1:])
+    return b''.join(encoded), offsets
+
+class RecordBatch:
+    """A batch of records {'text', 'choices', 'label', **extra}, stored as arrays.
+
+    - the texts: one UTF-8 buffer with an int64 offset per record. Several batches can share it, e.g., the three
+    EmotivITA dimensions of the same rows;
+    - the labels: an int8 array;
+    - the choices: a uint8 index per record into choices_table, the few possible orderings of the choices
+    (see common.shuffle.ordered_choices), so a record costs a few bytes on top of its text;
+    - the extra fields, e.g., {'dimension': 'Valence'}: shared by all the records of the batch.
+
+    JsonlSerializer.encode writes a batch from its arrays, without building the dicts. Indexing and iterating give the
+    dicts, for the code that needs them.
+
+    Example:
+        text_buffer, text_offsets = encode_texts(data['text'])
+        batch = RecordBatch(text_buffer, text_offsets, labels, codes, ordered_choices(CHOICES))
+        batch[0]    # {'text': ..., 'choices': ['Falso', 'Vero'], 'label': 1}
+    """
+
+    def __init__(self,
+                 text_buffer: bytes,
+                 text_offsets: np.ndarray,
+                 labels: np.ndarray,
+                 choices_codes: np.ndarray,
+                 choices_table: list[list[str]],
+                 **extra
+                 ):
+        """
+        Args:
+            text_buffer (bytes): the UTF-8 texts back to back, see encode_texts
+            text_offsets (np.ndarray): the n_records + 1 offsets of the texts in text_buffer
+            labels (np.ndarray): the index of the true choice of each record
+            choices_codes (np.ndarray): the row of choices_table of each record
+            choices_table (list[list[str]]): every possible list of choices
+            extra: the fields shared by all the records, after text, choices and label
+
+        Raises:
+            ValueError: If the arrays do not have one value per record, or if choices_table has more than 256 rows.
+        """
+        if len(choices_table) > 256:
+            raise ValueError(f"The choices of a record are a uint8 index, {len(choices_table)} orderings do not fit")
+        if not len(labels) == len(choices_codes) == len(text_offsets) - 1:
+            raise ValueError(f"Expected one label and one choices code per text, got {len(labels)} and "
+                             f"{len(choices_codes)} for {len(text_offsets) - 1} texts")
+
+        self.text_buffer = text_buffer
+        self.text_offsets = np.asarray(text_offsets, dtype=np.int64)
+        self.labels = np.asarray(labels, dtype=np.int8)
+        self.choices_codes = np.asarray(choices_codes, dtype=np.uint8)
+        self.choices_table = choices_table
+        self.extra = extra
+
+    def __len__(self) -> int:
+        return len(self.labels)
+
+    def text_bytes(self) -> list[bytes]:
+        """The UTF-8 bytes of each text, sliced from the buffer."""
+        buffer = self.text_buffer
+        offsets = self.text_offsets.tolist()
+        return [buffer[start:end] for start, end in zip(offsets[:-1], offsets[1:])]
+
+    def texts(self) -> list[str]:
+        return [text.decode('utf-8') for text in self.text_bytes()]
+
+    def take(self, indices: np.ndarray) -> 'RecordBatch':
+        """A new batch with the records at indices, in that order, and their texts packed in a new buffer."""
+        indices = np.asarray(indices, dtype=np.intp)
+        texts = self.text_bytes()
+        text_offsets = np.zeros(len(indices) + 1, dtype=np.int64)
+        np.cumsum(np.diff(self.text_offsets)[indices], out=text_offsets[1:])
+        return RecordBatch(b''.join([texts[idx] for idx in indices.tolist()]), text_offsets, self.labels[indices],
+                           self.choices_codes[indices], self.choices_table, **self.extra)
+
+    def __getitem__(self, idx: int) -> dict:
+        if idx < 0:
+            idx += len(self)
+        if not 0 <= idx < len(self):
+            raise IndexError(f"Record {idx} out of range for {len(self)} records")
+        start, end = int(self.text_offsets[idx]), int(self.text_offsets[idx + 1])
+        return {
+            'text': self.text_buffer[start:end].decode('utf-8'),
+            'choices': self.choices_table[self.choices_codes[idx]],
+            'label': int(self.labels[idx]),
+            **self.extra,
+        }
+
+    def __iter__(self) -> Iterator[dict]:
+        for text, code, label in zip(self.texts(), self.choices_codes.tolist(), self.labels.tolist()):
+            yield {'text': text, 'choices': self.choices_table[code], 'label': label, **self.extra}
+
+def record_columns(jsonl_entries: 'RecordBatch | list[dict]',
+                   choices_codes: dict[tuple[str, ...], int]
+                   ) -> tuple[list[bytes], np.ndarray, np.ndarray]:
+    """The text bytes, labels and choices codes of a RecordBatch or of a list of jsonl entries.
+
+    Args:
+        jsonl_entries (RecordBatch | list[dict]): the records
+        choices_codes (dict[tuple[str, ...], int]): the code of each list of choices in the table of the caller
+
+    Returns:
+        tuple[list[bytes], np.ndarray, np.ndarray]: the UTF-8 texts, the int8 labels and the uint8 choices codes
+    """
+    if isinstance(jsonl_entries, RecordBatch):
+        # The code of each row of the table of the batch in the table of the caller, the same when the tables are equal
+        recode = np.array([choices_codes[tuple(choices)] for choices in jsonl_entries.choices_table], dtype=np.uint8)
+        return jsonl_entries.text_bytes(), jsonl_entries.labels, recode[jsonl_entries.choices_codes]
+
+    texts = [entry['text'].encode('utf-8') for entry in jsonl_entries]
+    labels = np.array([entry['label'] for entry in jsonl_entries], dtype=np.int8)
+    codes = np.array([choices_codes[tuple(entry['choices'])] for entry in jsonl_entries], dtype=np.uint8)
+    return texts, labels, codes
@@ -0,0 +1,198 @@
+# This part is for serializing the jsonl entries with the fastest JSON encoder available
+
+import os
+import json
+from itertools import islice
+from typing import BinaryIO, Callable, Iterable
+
+import numpy as np
+
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+try:
+    import msgspec
+except ImportError:
+    msgspec = None
+
+from common.jsonl_index import INDEX_DTYPE, index_path, line_end_offsets
+from common.records import RecordBatch
+
+BACKENDS = ['auto', 'orjson', 'msgspec', 'json']
+
+class JsonlSerializer:
+    """Encode jsonl entries in batches and write them with one large write per batch.
+    
+    The backends:
+        - msgspec and orjson: fast encoders written in C/Rust. They write compact JSON, i.e., {"text":"...","label":0}.
+        - json: the standard library, with the same layout as json.dumps, i.e., {"text": "...", "label": 0}.
+    
+    All of them write UTF-8 and keep the non-ASCII characters as they are (like ensure_ascii=False), 
+    so the files read back to the same entries whatever the backend.
+    
+    The entries are either a list of dicts or a RecordBatch (see common.records), which is written from its arrays 
+    with the same bytes as the list of its dicts.
+    
+    Example:
+        serializer = JsonlSerializer('auto')
+        with open('HODI_2023/HODI_2023_train_subtaskA.jsonl', 'wb') as f:
+            serializer.write(f, jsonl_entries)
+    """
+    
+    def __init__(self, backend: str='auto', batch_size: int=10_000):
+        """
+        Args:
+            backend (str, optional): one from BACKENDS. 'auto' picks msgspec, then orjson, then json, 
+        whichever is installed first. Defaults to 'auto'.
+            batch_size (int, optional): the number of entries encoded into a single buffer. Defaults to 10_000.
+
+        Raises:
+            ValueError: If the backend is unknown or not installed.
+        """
+        if backend == 'auto':
+            backend = 'msgspec' if msgspec is not None else 'orjson' if orjson is not None else 'json'
+        
+        if backend == 'orjson':
+            if orjson is None:
+                raise ValueError("The orjson backend requires orjson (pip install orjson)")
+            self._encode_batch = _orjson_encode_batch
+            self._encode_value = orjson.dumps
+        elif backend == 'msgspec':
+            if msgspec is None:
+                raise ValueError("The msgspec backend requires msgspec (pip install msgspec)")
+            encoder = msgspec.json.Encoder()
+            self._encode_batch = encoder.encode_lines
+            self._encode_value = encoder.encode
+        elif backend == 'json':
+            encode = json.JSONEncoder(ensure_ascii=False).encode
+            self._encode_batch = _json_encode_batch(encode)
+            self._encode_value = lambda value: encode(value).encode('utf-8')
+        else:
+            raise ValueError(f"Invalid JSON backend: {backend}. Choose one from {BACKENDS}.")
+        
+        self.backend = backend
+        self.batch_size = batch_size
+        # The separators between the items and after the keys, as written by the backend
+        self._separators = (b', ', b': ') if backend == 'json' else (b',', b':')
+        
+    def encode(self, jsonl_entries: RecordBatch | list[dict]) -> bytes:
+        """Encode the jsonl entries to a single UTF-8 buffer, one JSON object per line.
+
+        Args:
+            jsonl_entries (RecordBatch | list[dict]): the jsonl entries
+
+        Returns:
+            bytes: the encoded lines, each one ending with a new line
+        """
+        if isinstance(jsonl_entries, RecordBatch):
+            return self._encode_record_batch(jsonl_entries)
+        return self._encode_batch(jsonl_entries)
+    
+    def _encode_record_batch(self, batch: RecordBatch) -> bytes:
+        # Each line is: a head up to the opening quote of the text, the text, and a tail from the closing quote
+        # that depends only on the choices code and the label. The head and the few distinct tails are encoded once,
+        # so the same bytes as the ones of the dicts are written with a single join, without building the dicts.
+        if not len(batch):
+            return b''
+        item, key = self._separators
+        encode = self._encode_value
+        head = b'{' + encode('text') + key + b'"'
+        choices_parts = [b'"' + item + encode('choices') + key + encode(choices) + item + encode('label') + key 
+                         for choices in batch.choices_table]
+        end = b''.join(item + encode(name) + key + encode(value) for name, value in batch.extra.items()) + b'}\n'
+        
+        # A text is copied as it is from the buffer, unless it has a quote, a backslash or a control character
+        texts = batch.text_bytes()
+        raw = np.frombuffer(batch.text_buffer, dtype=np.uint8)
+        special = np.flatnonzero((raw == ord('"')) | (raw == ord('\\')) | (raw < 0x20))
+        for idx in np.unique(np.searchsorted(batch.text_offsets, special, side='right') - 1).tolist():
+            texts[idx] = encode(texts[idx].decode('utf-8'))[1:-1]
+        
+        # The distinct tails, by (choices code, label)
+        pairs, tail_ids = np.unique(batch.choices_codes.astype(np.int64) * 256 + batch.labels.astype(np.int64) + 128, 
+                                    return_inverse=True)
+        tails = [choices_parts[pair // 256] + b'%d' % (pair % 256 - 128) + end for pair in pairs.tolist()]
+        
+        parts = [head] * (3 * len(texts))
+        parts[1::3] = texts
+        parts[2::3] = [tails[tail_id] for tail_id in tail_ids.ravel().tolist()]
+        return b''.join(parts)
+    
+    def write(self, f: BinaryIO, jsonl_entries: RecordBatch | Iterable[dict]) -> int:
+        """Encode the jsonl entries batch by batch and write each batch to the file.
+
+        Args:
+            f (BinaryIO): the file opened in binary mode
+            jsonl_entries (RecordBatch | Iterable[dict]): the jsonl entries. Can be a generator.
+
+        Returns:
+            int: the number of bytes written
+        """
+        if isinstance(jsonl_entries, RecordBatch):
+            return f.write(self._encode_record_batch(jsonl_entries))
+        
+        n_bytes = 0
+        entries = iter(jsonl_entries)
+        while batch := list(islice(entries, self.batch_size)):
+            n_bytes += f.write(self._encode_batch(batch))
+        return n_bytes
+
+def _orjson_encode_batch(jsonl_entries: list[dict]) -> bytes:
+    if not jsonl_entries:
+        return b''
+    return b'\n'.join(map(orjson.dumps, jsonl_entries)) + b'\n'
+
+def _json_encode_batch(encode: Callable[[dict], str]) -> Callable[[list[dict]], bytes]:
+    # A single encoder is reused, while json.dumps(..., ensure_ascii=False) builds a new one at every call.
+    def encode_batch(jsonl_entries: list[dict]) -> bytes:
+        return ''.join([encode(entry) + '\n' for entry in jsonl_entries]).encode('utf-8')
+    return encode_batch
+
+def write_encoded_chunks(output_file_paths: list[str], 
+                         encoded_chunks: Iterable[list[bytes]], 
+                         index: bool=True
+                         ) -> list[int]:
+    """Write chunks of encoded lines to several files as the chunks are produced.
+    
+    Each file is written to a temporary path and moved in place at the end, 
+    so an interrupted run never leaves a truncated file behind.
+    
+    With index, the byte offset of each line is written next to each file (see common.jsonl_index), 
+    from the buffers that are already in memory, so the files can be read by row without a scan.
+
+    Args:
+        output_file_paths (list[str]): valid paths to the output files
+        encoded_chunks (Iterable[list[bytes]]): for each chunk, the encoded lines of each output file
+        index (bool, optional): whether to write the .idx file of each output. Defaults to True.
+
+    Returns:
+        list[int]: the number of bytes written to each file
+    """
+    final_paths = list(output_file_paths)
+    if index:
+        final_paths += [index_path(path) for path in output_file_paths]
+    tmp_paths = [path + '.tmp' for path in final_paths]
+    n_bytes = [0] * len(output_file_paths)
+    
+    files = [open(path, 'wb') for path in tmp_paths]
+    index_files = files[len(output_file_paths):]
+    for f in index_files:
+        f.write(np.zeros(1, dtype=INDEX_DTYPE).tobytes())
+    try:
+        for encoded in encoded_chunks:
+            for idx, (f, buffer) in enumerate(zip(files, encoded)):
+                if index_files:
+                    index_files[idx].write(line_end_offsets(buffer, n_bytes[idx]).tobytes())
+                n_bytes[idx] += f.write(buffer)
+    except BaseException:
+        for f, path in zip(files, tmp_paths):
+            f.close()
+            os.remove(path)
+        raise
+    
+    for f, tmp_path, path in zip(files, tmp_paths, final_paths):
+        f.close()
+        os.replace(tmp_path, path)
+    return n_bytes
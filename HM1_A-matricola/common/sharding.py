@@ -0,0 +1,136 @@
+# This part is for writing stratified shards or train/val/test splits of the converted records, in the conversion pass
+
+import os
+from fractions import Fraction
+from typing import Iterable, Iterator
+
+import numpy as np
+
+from common.records import RecordBatch
+from common.shuffle import SEED, hash_keys, mix_hash, permutation_table
+
+def split_names(split: int | list[float]) -> list[str]:
+    """The names of the splits: shard-00-of-04, ... for a number of shards, train/val(/test) for a list of fractions."""
+    if isinstance(split, int):
+        return [f'shard-{shard:02d}-of-{split:02d}' for shard in range(split)]
+    if len(split) not in (2, 3):
+        raise ValueError(f"Expected the fractions of train/val or train/val/test, got {split}")
+    return ['train', 'val', 'test'][:len(split)]
+
+def split_file_path(output_file_path: str, name: str) -> str:
+    """The file of a split, e.g., EmotivITA_Valence_dev.jsonl -> EmotivITA_Valence_dev.train.jsonl"""
+    stem, extension = os.path.splitext(output_file_path)
+    return f'{stem}.{name}{extension}'
+
+def split_slots(split: int | list[float], max_block: int=1000) -> np.ndarray:
+    """The split of each slot of a block: one slot per shard, or as many slots per split as its fraction of the block.
+
+    Example:
+        split_slots(3)                  # [0, 1, 2]
+        split_slots([0.8, 0.1, 0.1])    # 16 zeros, 2 ones and 2 twos: blocks of 20 rows
+    """
+    if isinstance(split, int):
+        if split < 1:
+            raise ValueError(f"Expected at least one shard, got {split}")
+        return np.arange(split)
+
+    fractions = [Fraction(fraction).limit_denominator(max_block) for fraction in split]
+    if any(fraction <= 0 for fraction in fractions) or sum(fractions) != 1:
+        raise ValueError(f"The fractions of the splits must be positive and sum to 1, got {split}")
+    block_size = np.lcm.reduce([fraction.denominator for fraction in fractions])
+    return np.repeat(np.arange(len(fractions)), [int(fraction * block_size) for fraction in fractions])
+
+def semantic_labels(batch: RecordBatch) -> np.ndarray:
+    """The index of the true choice of each record in the original choices, i.e., before the shuffle of the choices."""
+    return permutation_table(len(batch.choices_table[0]))[batch.choices_codes, batch.labels].astype(np.int64)
+
+class StratifiedSplitter:
+    """Assign each row to a shard or a split, in a single streaming pass, with the same label balance in each of them.
+
+    The rows of each stratum (e.g., each category, or each combination of the V/A/D categories) are dealt in blocks:
+    the i-th row of a stratum goes to the slot i % block_size of the block i // block_size, and the slots of a block
+    are ordered by a hash of (seed, stratum, block). Each complete block gives each split exactly its fraction
+    of the rows, so a split differs from its target by less than a block per stratum, e.g., by one row with shards.
+
+    Only a counter per stratum is kept, so the memory stays flat, and the assignment of a row depends on the seed and
+    on its rank among the rows of its stratum, not on the chunks.
+
+    Example:
+        splitter = StratifiedSplitter([0.8, 0.1, 0.1])
+        splits = splitter.assign(data['homotransphobic'].to_numpy())     # 0 (train), 1 (val) or 2 (test) for each row
+    """
+
+    def __init__(self, split: int | list[float], seed: int=SEED):
+        """
+        Args:
+            split (int | list[float]): the number of shards, or the fractions of train/val(/test)
+            seed (int, optional): the seed of the order of the slots. Defaults to SEED.
+        """
+        self.names = split_names(split)
+        self.slots = split_slots(split)
+        self.seed = seed
+        self.counts = {}
+        self.totals = np.zeros(len(self.names), dtype=np.int64)
+        self._stratum_hashes = {}
+
+    def assign(self, strata: np.ndarray) -> np.ndarray:
+        """The split of each row of a chunk. The chunks must be given in the order of the rows.
+
+        Args:
+            strata (np.ndarray): the integer stratum of each row, e.g., its label
+
+        Returns:
+            np.ndarray: the index of the split of each row, in self.names
+        """
+        strata = np.asarray(strata, dtype=np.int64)
+        splits = np.empty(len(strata), dtype=np.intp)
+        block_size = len(self.slots)
+        for stratum in np.unique(strata).tolist():
+            rows = np.flatnonzero(strata == stratum)
+            ranks = self.counts.get(stratum, 0) + np.arange(len(rows))
+            self.counts[stratum] = int(ranks[-1]) + 1
+            blocks, positions = np.divmod(ranks, block_size)
+
+            if stratum not in self._stratum_hashes:
+                self._stratum_hashes[stratum] = hash_keys([f'stratum-{stratum}'], self.seed)[0]
+            unique_blocks, block_idx = np.unique(blocks, return_inverse=True)
+            # One random order of the slots per block
+            block_hashes = mix_hash(np.uint64(self._stratum_hashes[stratum]), unique_blocks.astype(np.uint64))
+            orders = np.argsort(mix_hash(block_hashes[:, None], np.arange(block_size, dtype=np.uint64)), axis=1)
+            splits[rows] = self.slots[orders[block_idx, positions]]
+        self.totals += np.bincount(splits, minlength=len(self.names))
+        return splits
+
+    def split(self, entries_chunks: Iterable[list[RecordBatch]]) -> Iterator[list[RecordBatch]]:
+        """Split each chunk of batches, stratified by the combination of the semantic labels of its batches.
+
+        Args:
+            entries_chunks (Iterable[list[RecordBatch]]): for each chunk, one batch per output file, of the same rows
+        (e.g., the three EmotivITA dimensions)
+
+        Yields:
+            list[RecordBatch]: for each chunk, the batch of each (output file, split), the splits of an output
+        next to each other, i.e., output o and split s at o * len(self.names) + s
+        """
+        for batches in entries_chunks:
+            # A single stratum per combination of the labels, e.g., (Bassa, Alta, Media) for V/A/D
+            strata = np.zeros(len(batches[0]), dtype=np.int64)
+            for batch in batches:
+                strata = strata * len(batch.choices_table[0]) + semantic_labels(batch)
+            splits = self.assign(strata)
+
+            rows = [np.flatnonzero(splits == split) for split in range(len(self.names))]
+            # The batches of the same rows share their texts, so take each split of the texts once
+            shared = [batches[0].take(split_rows) for split_rows in rows]
+            split_batches = []
+            for batch in batches:
+                for split_rows, taken in zip(rows, shared):
+                    if batch.text_buffer is not batches[0].text_buffer:
+                        taken = batch.take(split_rows)
+                    split_batches.append(RecordBatch(taken.text_buffer, taken.text_offsets, batch.labels[split_rows],
+                                                     batch.choices_codes[split_rows], batch.choices_table, **batch.extra))
+            yield split_batches
+
+    def summary(self) -> dict[str, int]:
+        """The number of rows assigned to each split so far."""
+        return dict(zip(self.names, self.totals.tolist()))
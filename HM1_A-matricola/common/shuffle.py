@@ -0,0 +1,155 @@
+# This part is for shuffling the choices reproducibly, independently of how the data is partitioned
+
+import hashlib
+import itertools
+from functools import lru_cache
+from typing import Iterable
+
+import numpy as np
+import pandas as pd
+
+# The default seed of the shuffle
+SEED = 49
+
+def record_keys(data: pd.DataFrame, key_column: str='id') -> list[str]:
+    """Get a stable key for each record: the key_column if the data has one, else the text itself.
+
+    Args:
+        data (pd.DataFrame): the data, with at least the text column
+        key_column (str, optional): the column with a unique id per record. Defaults to 'id'.
+
+    Returns:
+        list[str]: the key of each record
+    """
+    if key_column in data.columns:
+        return data[key_column].astype(str).tolist()
+    return data['text'].astype(str).tolist()
+
+def hash_keys(keys: Iterable[str | bytes], seed: int=SEED) -> np.ndarray:
+    """Hash each key to 64 bits with a BLAKE2b keyed by the seed. 
+    
+    Unlike hash(), the result does not depend on the process (PYTHONHASHSEED), so it is the same in every run, chunk and worker.
+
+    Args:
+        keys (Iterable[str | bytes]): the keys of the records, as strings or as their UTF-8 bytes
+        seed (int, optional): the global seed. Defaults to SEED.
+
+    Returns:
+        np.ndarray: the uint64 hash of each key
+    """
+    seed_bytes = seed.to_bytes(8, 'little', signed=True)
+    digests = b''.join(
+        hashlib.blake2b(key if isinstance(key, bytes) else key.encode('utf-8'), digest_size=8, key=seed_bytes).digest()
+        for key in keys
+    )
+    return np.frombuffer(digests, dtype='<u8').astype(np.uint64)
+
+def mix_hash(key_hashes: np.ndarray, salt: np.ndarray | int) -> np.ndarray:
+    """Derive independent hashes from the same key hashes, one per salt (e.g., one per dimension).
+    
+    It is the splitmix64 finalizer applied to key_hash + salt * golden ratio.
+
+    Args:
+        key_hashes (np.ndarray): the uint64 hashes of the keys
+        salt (np.ndarray | int): broadcastable against key_hashes
+
+    Returns:
+        np.ndarray: the mixed uint64 hashes, broadcast shape of key_hashes and salt
+    """
+    with np.errstate(over='ignore'):
+        z = key_hashes.astype(np.uint64) + np.asarray(salt, dtype=np.uint64) * np.uint64(0x9E3779B97F4A7C15)
+        z = (z ^ (z >> np.uint64(30))) * np.uint64(0xBF58476D1CE4E5B9)
+        z = (z ^ (z >> np.uint64(27))) * np.uint64(0x94D049BB133111EB)
+        return z ^ (z >> np.uint64(31))
+
+@lru_cache(maxsize=None)
+def permutation_table(n_choices: int) -> np.ndarray:
+    """All the orderings of n_choices choices, in lexicographic order.
+
+    Args:
+        n_choices (int): the number of choices
+
+    Returns:
+        np.ndarray: shape (n_choices!, n_choices). Row p, column j holds the original index of the choice put at position j 
+    by the ordering p.
+    """
+    table = np.array(list(itertools.permutations(range(n_choices))), dtype=np.uint8)
+    table.flags.writeable = False
+    return table
+
+@lru_cache(maxsize=None)
+def _position_table(n_choices: int) -> np.ndarray:
+    # Inverse of permutation_table: row p, column i holds the position of the original choice i in the ordering p
+    return np.argsort(permutation_table(n_choices), axis=1).astype(np.uint8)
+
+def shuffle_labels_batch(n_choices: int, 
+                         label_indices: np.ndarray, 
+                         key_hashes: np.ndarray,
+                         salt: np.ndarray | int=0
+                         ) -> tuple[np.ndarray, np.ndarray] :
+    """Shuffle the choices of many records at once. 
+    The ordering of a record depends only on its key hash and the salt.
+
+    Args:
+        n_choices (int): the number of choices to shuffle
+        label_indices (np.ndarray): the index of the true choice, any shape
+        key_hashes (np.ndarray): the uint64 hash of each record (see hash_keys), broadcastable against label_indices
+        salt (np.ndarray | int, optional): to get different orderings for the same record, e.g., one per dimension. 
+    Broadcastable against label_indices. Defaults to 0.
+
+    Returns:
+        codes (np.ndarray): the row of each ordering in permutation_table(n_choices)
+        label_indices (np.ndarray): the position of the original choice in each ordering
+    """
+    n_perms = len(permutation_table(n_choices))
+    codes = np.broadcast_to(mix_hash(key_hashes, salt) % np.uint64(n_perms), np.shape(label_indices)).astype(np.intp)
+    return codes, _position_table(n_choices)[codes, label_indices].astype(np.int64)
+
+def ordered_choices(choices: list[str]) -> list[list[str]]:
+    """The choices reordered by each row of permutation_table, i.e., the only lists that a shuffle can produce.
+
+    Args:
+        choices (list[str]): the choices in their original order
+
+    Returns:
+        list[list[str]]: the choices in each ordering, indexed by the codes of shuffle_labels_batch
+    """
+    return [[choices[i] for i in perm] for perm in permutation_table(len(choices)).tolist()]
+
+@lru_cache(maxsize=64)
+def _cached_ordered_choices(choices: tuple[str, ...]) -> list[list[str]]:
+    return ordered_choices(list(choices))
+
+def shuffle_labels_func(choices: list[str], 
+                        label_index: int, 
+                        key: str,
+                        seed: int=SEED,
+                        salt: int=0,
+                        verbose: bool=False
+                        ) -> tuple[list[str], int] :
+    """Shuffle the choices so that the model learns not just the ordering of the labels, 
+    but the actual semantic meaning of them. 
+    Note that there is a paper on this that models sometimes memorize the ordering of the labels, 
+    and that if the ordering is changed, there may be some (drastic) drop in accuracy.
+    
+    The ordering depends only on the seed, the key of the record and the salt, so it is the same as 
+    the one given by shuffle_labels_batch, whatever the chunk or the process that handles the record.
+
+    Args:
+        choices (list(str)): the string of choices to shuffle. Not modified.
+        label_index (int): the index of the choice that is true among the choices
+        key (str): the stable key of the record, see record_keys
+        seed (int, optional): the global seed. Defaults to SEED.
+        salt (int, optional): to get different orderings for the same record, e.g., one per dimension. Defaults to 0.
+        verbose (bool, optional): whether to print or not. Defaults to False.
+
+    Returns:
+        choices (list(str)): the shuffled choices. Shared between the calls, do not modify it.
+        label_index (int): the shuffle index of the original choice in the shuffled choices
+    """
+    codes, label_indices = shuffle_labels_batch(len(choices), np.array([label_index]), hash_keys([key], seed), salt)
+    
+    shuffled_choices = _cached_ordered_choices(tuple(choices))[codes[0]]
+    if verbose: print(f"Before shuffle {choices=}, {label_index=}. After shuffle {shuffled_choices=}, label_index={label_indices[0]}")
+    
+    return shuffled_choices, int(label_indices[0])
@@ -0,0 +1,209 @@
+# This part is for running the steps of the data preparation as a dependency graph, the independent ones in parallel
+
+import os
+import json
+import traceback
+from concurrent.futures import FIRST_COMPLETED, ProcessPoolExecutor, wait
+from typing import Callable, Iterable
+
+from common.manifest import file_stat
+
+STATE_NAME = '.task_state.json'
+
+class Task:
+    """A step of the graph: a picklable function called with keyword arguments, in a worker process.
+
+    The task is up to date, and skipped, when its outputs exist and neither its arguments nor the size and modification
+    time of its inputs and outputs changed since it last succeeded (see TaskGraph). A task without inputs,
+    e.g., a download, is up to date as soon as its outputs exist, unless it is forced.
+
+    Example:
+        Task('convert_hodi_a', hodi_a, {'input_file_path': ..., 'output_file_path': ...},
+             inputs=[tsv_path], outputs=[jsonl_path], deps=['unzip_hodi'])
+    """
+
+    def __init__(self,
+                 name: str,
+                 func: Callable,
+                 kwargs: dict | None=None,
+                 inputs: Iterable[str]=(),
+                 outputs: Iterable[str]=(),
+                 deps: Iterable[str]=()
+                 ):
+        """
+        Args:
+            name (str): the unique name of the task
+            func (Callable): a module-level function, so that it can be sent to another process
+            kwargs (dict, optional): the keyword arguments of func. Must be JSON-serializable. Defaults to None.
+            inputs (Iterable[str], optional): the files that func reads. Defaults to ().
+            outputs (Iterable[str], optional): the files that func writes. Defaults to ().
+            deps (Iterable[str], optional): the tasks to run before this one. Defaults to ().
+        """
+        self.name = name
+        self.func = func
+        self.kwargs = kwargs or {}
+        self.inputs = list(inputs)
+        self.outputs = list(outputs)
+        self.deps = list(deps)
+
+    def fingerprint(self) -> dict:
+        """The arguments of the task and the stat of its files, as saved in the state file."""
+        return {
+            'kwargs': json.loads(json.dumps(self.kwargs, sort_keys=True, default=str)),
+            'inputs': {path: file_stat(path) for path in self.inputs},
+            'outputs': {path: file_stat(path) for path in self.outputs},
+        }
+
+    def is_up_to_date(self, state: dict) -> bool:
+        if not self.outputs or not all(os.path.exists(path) for path in self.outputs + self.inputs):
+            return False
+        return not self.inputs or state.get(self.name) == self.fingerprint()
+
+def run_task(func: Callable, kwargs: dict) -> None:
+    """Call func in a worker process. The traceback is printed there, since it is lost when the error is pickled."""
+    try:
+        func(**kwargs)
+    except Exception:
+        traceback.print_exc()
+        raise
+
+class TaskGraph:
+    """A set of tasks run in the order of their dependencies, on a pool of processes.
+
+    A task is submitted as soon as all its dependencies succeeded, so the independent tasks
+    (e.g., the HODI and the EmotivITA branches) run at the same time. When a task fails, the tasks that depend on it
+    are not run, and the other branches go on.
+
+    The stat of the files of each task that succeeded is saved in a state file, e.g., HM1_A-matricola/.task_state.json,
+    so the next run skips the tasks that are up to date.
+
+    Example:
+        graph = TaskGraph([download, unzip, convert], state_path='.task_state.json')
+        statuses = graph.run(max_workers=4)     # {'download': 'skipped', 'unzip': 'done', 'convert': 'done'}
+    """
+
+    def __init__(self, tasks: Iterable[Task], state_path: str=STATE_NAME):
+        """
+        Raises:
+            ValueError: If two tasks have the same name, if a dependency is unknown, or if the dependencies have a cycle.
+        """
+        self.tasks = {}
+        for task in tasks:
+            if task.name in self.tasks:
+                raise ValueError(f"Two tasks are named {task.name!r}")
+            self.tasks[task.name] = task
+        for task in self.tasks.values():
+            unknown = [dep for dep in task.deps if dep not in self.tasks]
+            if unknown:
+                raise ValueError(f"The task {task.name!r} depends on unknown tasks {unknown}")
+        self.order = self._topological_order()
+
+        self.state_path = state_path
+        try:
+            with open(state_path, encoding='utf-8') as f:
+                self.state = json.load(f)
+        except (FileNotFoundError, json.JSONDecodeError):
+            self.state = {}
+
+    def _topological_order(self) -> list[str]:
+        n_deps = {name: len(task.deps) for name, task in self.tasks.items()}
+        ready = [name for name, n in n_deps.items() if n == 0]
+        order = []
+        while ready:
+            name = ready.pop(0)
+            order.append(name)
+            for dependent in self.dependents(name):
+                n_deps[dependent] -= 1
+                if n_deps[dependent] == 0:
+                    ready.append(dependent)
+        if len(order) != len(self.tasks):
+            raise ValueError(f"The dependencies have a cycle among {sorted(set(self.tasks) - set(order))}")
+        return order
+
+    def dependents(self, name: str) -> list[str]:
+        return [task.name for task in self.tasks.values() if name in task.deps]
+
+    def select(self, targets: Iterable[str]) -> 'TaskGraph':
+        """The sub-graph of the targets and of everything they depend on."""
+        selected, stack = set(), list(targets)
+        while stack:
+            name = stack.pop()
+            if name not in self.tasks:
+                raise ValueError(f"Unknown task {name!r}, expected one of {self.order}")
+            if name not in selected:
+                selected.add(name)
+                stack.extend(self.tasks[name].deps)
+        return TaskGraph([self.tasks[name] for name in self.order if name in selected], self.state_path)
+
+    def run(self, max_workers: int | None=None, force: Iterable[str]=(), dry_run: bool=False) -> dict[str, str]:
+        """Run every task that is not up to date, each one once all its dependencies are done.
+
+        Args:
+            max_workers (int, optional): the number of processes. Defaults to None, i.e., the number of CPUs.
+            force (Iterable[str], optional): the tasks to run even if they are up to date. Defaults to ().
+            dry_run (bool, optional): only print what would run, assuming that every task succeeds. Defaults to False.
+
+        Returns:
+            dict[str, str]: the status of each task: 'skipped' (up to date), 'done', 'failed' or 'cancelled'
+        (a dependency failed), or 'would run' with dry_run
+        """
+        force = set(force)
+        statuses = {}
+        n_deps = {name: len(task.deps) for name, task in self.tasks.items()}
+        ready = [name for name in self.order if n_deps[name] == 0]
+        running = {}
+
+        def finish(name, status):
+            statuses[name] = status
+            print(f"[{status}] {name}", flush=True)
+            for dependent in self.dependents(name):
+                if status in ('failed', 'cancelled'):
+                    if dependent not in statuses:
+                        finish(dependent, 'cancelled')
+                    continue
+                n_deps[dependent] -= 1
+                if n_deps[dependent] == 0:
+                    ready.append(dependent)
+
+        with ProcessPoolExecutor(max_workers=max_workers) as executor:
+            while ready or running:
+                while ready:
+                    task = self.tasks[ready.pop(0)]
+                    if task.name in statuses:
+                        continue
+                    # A task whose dependencies ran again sees their new outputs as changed inputs
+                    upstream_runs = any(statuses[dep] == 'would run' for dep in task.deps)
+                    if task.name not in force and not upstream_runs and task.is_up_to_date(self.state):
+                        finish(task.name, 'skipped')
+                    elif dry_run:
+                        finish(task.name, 'would run')
+                    else:
+                        print(f"[started] {task.name}", flush=True)
+                        running[executor.submit(run_task, task.func, task.kwargs)] = task
+
+                if not running:
+                    continue
+                done, _ = wait(running, return_when=FIRST_COMPLETED)
+                for future in done:
+                    task = running.pop(future)
+                    if future.exception() is not None:
+                        self.state.pop(task.name, None)
+                        self._save()
+                        finish(task.name, 'failed')
+                        continue
+                    missing = [path for path in task.outputs if not os.path.exists(path)]
+                    if missing:
+                        print(f"The task {task.name!r} did not write {missing}")
+                        finish(task.name, 'failed')
+                        continue
+                    self.state[task.name] = task.fingerprint()
+                    self._save()
+                    finish(task.name, 'done')
+
+        return statuses
+
+    def _save(self) -> None:
+        tmp_path = self.state_path + '.tmp'
+        with open(tmp_path, 'w', encoding='utf-8') as f:
+            json.dump(self.state, f, indent=2)
+        os.replace(tmp_path, self.state_path)
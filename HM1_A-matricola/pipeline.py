@@ -0,0 +1,144 @@
+# This part is for preparing every dataset with a single command: download, unzip, convert and render the prompts
+
+import os
+import argparse
+
+from common.prompts import render_evaluation_set
+from common.serialization import BACKENDS
+from common.shuffle import SEED
+from common.tasks import STATE_NAME, Task, TaskGraph
+from EmotivITA.download_data import download_csv_files
+from EmotivITA.scripts import DIMENSIONS, EMOTIVITA_DIR, REPO_URL, SAVE_FOLDER, emotivITA, split_paths
+from HODI_2023.download_data import download_file, unzip_file
+from HODI_2023.scripts import (EXTRACT_DIR, HODI_DIR, OUTPUT_FILE_PATH, OUTPUT_FILE_PATH_B, ZIP_PASSWORD, ZIP_SAVE_PATH, ZIP_URL, 
+                               hodi_a, hodi_b)
+
+ROOT = os.path.dirname(os.path.abspath(__file__))
+
+def build_tasks(shuffle_labels: bool=False, seed: int=SEED, chunksize: int | None=None, json_backend: str='auto') -> list[Task]:
+    """The tasks of the data preparation, with their files and dependencies.
+
+        download_hodi -> unzip_hodi -> convert_hodi_a -> render_hodi_a
+                                    -> convert_hodi_b
+        download_emotivita -> convert_emotivita_dev -> render_emotivita_dev
+                           -> convert_emotivita_test -> render_emotivita_test
+
+    Args:
+        shuffle_labels (bool, optional): shuffle the choices of the converted records. Defaults to False.
+        seed (int, optional): the global seed of the shuffle. Defaults to SEED.
+        chunksize (int, optional): the number of rows per chunk of the conversions. Defaults to None, i.e., a single chunk.
+        json_backend (str, optional): the JSON encoder of the written files. Defaults to 'auto'.
+
+    Returns:
+        list[Task]: the tasks
+    """
+    conversion_kwargs = {'shuffle_labels': shuffle_labels, 'seed': seed, 'chunksize': chunksize, 'json_backend': json_backend}
+    hodi_tsv_paths = [os.path.join(EXTRACT_DIR, f'HODI_2023_train_subtask{subtask}.tsv') for subtask in 'AB']
+    hodi_prompts_path = os.path.join(HODI_DIR, 'prompts_subtaskA.jsonl')
+    emotivita_prompts_path = os.path.join(EMOTIVITA_DIR, 'prompt.jsonl')
+
+    tasks = [
+        Task('download_hodi', download_file, {'url': ZIP_URL, 'save_path': ZIP_SAVE_PATH},
+             outputs=[ZIP_SAVE_PATH]),
+        Task('unzip_hodi', unzip_file, {'zip_path': ZIP_SAVE_PATH, 'extract_dir': EXTRACT_DIR, 'password': ZIP_PASSWORD},
+             inputs=[ZIP_SAVE_PATH], outputs=hodi_tsv_paths, deps=['download_hodi']),
+        Task('convert_hodi_a', hodi_a, {'input_file_path': hodi_tsv_paths[0], 'output_file_path': OUTPUT_FILE_PATH, **conversion_kwargs},
+             inputs=hodi_tsv_paths[:1], outputs=[OUTPUT_FILE_PATH], deps=['unzip_hodi']),
+        Task('render_hodi_a', render_evaluation_set,
+             {'prompt_file_path': hodi_prompts_path, 'record_file_paths': [OUTPUT_FILE_PATH],
+              'output_file_path': os.path.join(HODI_DIR, 'HODI_2023_train_subtaskA_prompts.jsonl')},
+             inputs=[hodi_prompts_path, OUTPUT_FILE_PATH], outputs=[os.path.join(HODI_DIR, 'HODI_2023_train_subtaskA_prompts.jsonl')],
+             deps=['convert_hodi_a']),
+        Task('convert_hodi_b', hodi_b,
+             {'input_file_path': hodi_tsv_paths[1], 'output_file_path': OUTPUT_FILE_PATH_B, 'chunksize': chunksize, 'json_backend': json_backend},
+             inputs=hodi_tsv_paths[1:], outputs=[OUTPUT_FILE_PATH_B], deps=['unzip_hodi']),
+    ]
+
+    tasks.append(Task('download_emotivita', download_csv_files, {'api_url': REPO_URL, 'save_folder': SAVE_FOLDER},
+                      outputs=[split_paths(split)[0] for split in ('dev', 'test')]))
+    for split in ('dev', 'test'):
+        input_file_path, output_file_path = split_paths(split)
+        record_file_paths = [output_file_path.format(dimension) for dimension in DIMENSIONS]
+        evaluation_file_path = os.path.join(EMOTIVITA_DIR, f'EmotivITA_prompts_{split}.jsonl')
+        tasks += [
+            Task(f'convert_emotivita_{split}', emotivITA,
+                 {'input_file_path': input_file_path, 'output_file_path': output_file_path,
+                  'float_to_cat_list': ['Bassa', 'Media', 'Alta'], **conversion_kwargs},
+                 inputs=[input_file_path], outputs=record_file_paths, deps=['download_emotivita']),
+            Task(f'render_emotivita_{split}', render_evaluation_set,
+                 {'prompt_file_path': emotivita_prompts_path, 'record_file_paths': record_file_paths,
+                  'output_file_path': evaluation_file_path},
+                 inputs=[emotivita_prompts_path, *record_file_paths], outputs=[evaluation_file_path],
+                 deps=[f'convert_emotivita_{split}']),
+        ]
+    return tasks
+
+if __name__ == '__main__':
+
+    parser = argparse.ArgumentParser(description='Download, unzip, convert and render the HODI and EmotivITA datasets, the independent steps in parallel')
+    parser.add_argument(
+        "targets",
+        type=str,
+        nargs='*',
+        help="The tasks to run, with the tasks they depend on (e.g., render_hodi_a). Defaults to all of them."
+    )
+    parser.add_argument(
+        "--max_workers",
+        type=int,
+        default=None,
+        help="The number of processes. Defaults to the number of CPUs."
+    )
+    parser.add_argument(
+        "--download",
+        action='store_true',
+        default=False,
+        help="Download the datasets again, even if they are already on the disk."
+    )
+    parser.add_argument(
+        "--force",
+        action='store_true',
+        default=False,
+        help="Run every task, even the ones that are up to date."
+    )
+    parser.add_argument(
+        "--dry_run",
+        action='store_true',
+        default=False,
+        help="Only print the tasks that would run."
+    )
+    parser.add_argument(
+        "--shuffle_labels",
+        action='store_true',
+        default=False,
+        help="Whether to shuffle the labels. This way the model will not just memorize the ordering."
+    )
+    parser.add_argument(
+        "--seed",
+        type=int,
+        default=SEED,
+        help="The global seed of the shuffle."
+    )
+    parser.add_argument(
+        "--chunksize",
+        type=int,
+        default=None,
+        help="The number of rows per chunk of the conversions."
+    )
+    parser.add_argument(
+        "--json_backend",
+        type=str,
+        default='auto',
+        choices=BACKENDS,
+        help="The JSON encoder of the written files."
+    )
+    args = parser.parse_args()
+
+    graph = TaskGraph(build_tasks(args.shuffle_labels, args.seed, args.chunksize, args.json_backend),
+                      state_path=os.path.join(ROOT, STATE_NAME))
+    if args.targets:
+        graph = graph.select(args.targets)
+
+    force = list(graph.tasks) if args.force else [name for name in graph.tasks if args.download and name.startswith('download_')]
+    statuses = graph.run(max_workers=args.max_workers, force=force, dry_run=args.dry_run)
+    if any(status in ('failed', 'cancelled') for status in statuses.values()):
+        raise SystemExit(1)
@@ -0,0 +1,93 @@
+# This part is for checking the binning of the V/A/D scores against the scalar mapping, and the quantile thresholds
+
+import os
+import sys
+
+import numpy as np
+import pytest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from common.binning import QuantileSketch, as_threshold_table, bin_values, uniform_thresholds
+from EmotivITA.scripts import MAP_OPTION_THRESHOLDS, map_float_to_cat_idx, resolve_thresholds
+
+@pytest.mark.parametrize('map_option', [0, 1])
+def test_bin_values_matches_the_scalar_mapping(map_option):
+    # The scores of the dataset have two decimals, plus the thresholds themselves and the ends of the scale
+    rng = np.random.default_rng(3)
+    values = np.round(rng.uniform(0, 5, (2000, 3)), 2)
+    values[:6, 0] = [0.0, 1.25, 2.5, 3.2, 3.75, 3.8]
+    values[:2, 1] = [5.0, 3.1999999]
+
+    cat_idx = bin_values(values, MAP_OPTION_THRESHOLDS[map_option])
+    expected = np.vectorize(map_float_to_cat_idx)(values, map_option)
+    np.testing.assert_array_equal(cat_idx, expected)
+
+def test_one_list_of_thresholds_per_column():
+    values = np.array([[1.0, 1.0, 1.0], [2.0, 2.0, 2.0], [4.5, 4.5, 4.5]])
+    cat_idx = bin_values(values, [[1.5, 3.0], [0.5, 1.5], [2.0, 4.6]])
+    assert cat_idx.tolist() == [[0, 1, 0], [1, 2, 1], [2, 2, 1]]
+
+    with pytest.raises(ValueError, match='strictly increasing'):
+        as_threshold_table([3.8, 3.2], 3)
+    with pytest.raises(ValueError, match='one list of thresholds per column'):
+        bin_values(values, [[1.5, 3.0], [0.5, 1.5]])
+
+def test_uniform_thresholds():
+    assert uniform_thresholds(4) == MAP_OPTION_THRESHOLDS[1]
+    assert uniform_thresholds(2) == [2.5]
+    np.testing.assert_allclose(uniform_thresholds(5, 1.0, 6.0), [2.0, 3.0, 4.0, 5.0])
+
+def test_balanced_thresholds_with_ties():
+    # Most scores sit on a few values, like the 3.0 of the annotators, so the categories are balanced up to the ties
+    rng = np.random.default_rng(11)
+    values = np.concatenate([rng.choice([2.0, 2.6, 3.0, 3.0, 3.0, 3.4, 4.2], 30000), np.round(rng.uniform(0, 5, 30000), 2)])
+    sketch = QuantileSketch().update(values)
+    thresholds = sketch.balanced_thresholds(3)[0]
+
+    counts = np.bincount(bin_values(values, thresholds), minlength=3)
+    assert thresholds == sorted(thresholds)
+    # A category can only be off by the ties at its thresholds
+    ties = max(np.sum(values == value) for value in np.unique(values))
+    assert np.all(np.abs(counts - len(values) / 3) <= ties)
+
+    with pytest.raises(ValueError, match='Not enough distinct values'):
+        QuantileSketch().update(np.repeat([2.0, 3.0], 100)).balanced_thresholds(4)
+    with pytest.raises(ValueError, match='empty sketch'):
+        QuantileSketch().balanced_thresholds(3)
+
+def test_merged_sketches_equal_one_pass():
+    rng = np.random.default_rng(5)
+    values = np.round(rng.normal(3.0, 0.8, (9000, 3)).clip(0, 5), 2)
+    values[::17, 1] = np.nan
+
+    merged = QuantileSketch(n_columns=3)
+    for chunk in np.array_split(values, 7):
+        merged.merge(QuantileSketch(n_columns=3).update(chunk))
+    whole = QuantileSketch(n_columns=3).update(values)
+    np.testing.assert_array_equal(merged.counts, whole.counts)
+    assert merged.balanced_thresholds(4) == whole.balanced_thresholds(4)
+
+    # The quantiles are exact up to the width of a bin
+    width = 5 / whole.n_bins
+    expected = np.nanquantile(values, [0.25, 0.5, 0.75], axis=0).T
+    assert np.all(np.abs(whole.quantiles([0.25, 0.5, 0.75]) - expected) <= width)
+
+def test_resolve_thresholds(tmp_path):
+    rng = np.random.default_rng(2)
+    values = np.round(rng.uniform(1, 5, (1000, 3)), 2)
+    with open(tmp_path / 'dev.csv', 'w', encoding='utf-8') as f:
+        f.write('id,text,V,A,D\n')
+        f.writelines(f'{row},testo {row},{v},{a},{d}\n' for row, (v, a, d) in enumerate(values.tolist()))
+    input_file_path = str(tmp_path / 'dev.csv')
+
+    assert resolve_thresholds(input_file_path, 3).tolist() == [MAP_OPTION_THRESHOLDS[0]] * 3
+    assert resolve_thresholds(input_file_path, 4, thresholds='uniform').tolist() == [MAP_OPTION_THRESHOLDS[1]] * 3
+    # The balanced thresholds do not depend on the chunks of the pass
+    balanced = resolve_thresholds(input_file_path, 3, thresholds='balanced')
+    assert resolve_thresholds(input_file_path, 3, thresholds='balanced', chunksize=130).tolist() == balanced.tolist()
+    assert balanced.tolist() == QuantileSketch(n_columns=3).update(values).balanced_thresholds(3)
+
+    with pytest.raises(ValueError, match='Invalid thresholds'):
+        resolve_thresholds(input_file_path, 3, thresholds='quantile')
+    with pytest.raises(ValueError):
+        resolve_thresholds(input_file_path, 3, thresholds=[1.0, 2.0, 3.0])
@@ -0,0 +1,97 @@
+# This part is for checking that the columnar and shared text folders give back the records they were written from
+
+import json
+import os
+import sys
+
+import numpy as np
+import pandas as pd
+import pytest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from benchmarks.synthetic_corpus import generate_chunk
+from common import columnar
+from common.columnar import ColumnarDataset, SharedTextDataset, SharedTextWriter, columnar_path
+from EmotivITA.scripts import DIMENSIONS, emotivITA
+from HODI_2023.scripts import hodi_a
+
+CHOICES = [['Bassa', 'Media', 'Alta'], ['Alta', 'Bassa', 'Media']]
+
+def read_jsonl(path):
+    with open(path, encoding='utf-8') as f:
+        return [json.loads(line) for line in f]
+
+def entries_of(texts, dimension, seed):
+    rng = np.random.default_rng(seed)
+    return [{'text': text, 'choices': CHOICES[code], 'label': int(label), 'dimension': dimension}
+            for text, code, label in zip(texts, rng.integers(0, 2, len(texts)), rng.integers(0, 3, len(texts)))]
+
+def test_shared_texts_with_the_same_digest(tmp_path, monkeypatch):
+    # A digest of 2 bits, so most of the distinct texts collide, in a chunk and with the texts of the earlier chunks
+    monkeypatch.setattr(columnar, 'hash_keys', lambda texts, seed: np.array([len(text) % 4 for text in texts], dtype=np.uint64))
+    chunks = [['a', 'b', 'a', 'cc', 'e'], ['b', 'f', 'dd', 'a', 'f'], ['cc', 'dd', 'g', 'e', 'abcd']]
+
+    path = str(tmp_path / 'dev.shared')
+    expected = {'Valence': [], 'Arousal': []}
+    with SharedTextWriter(path, list(expected), CHOICES) as writer:
+        for seed, texts in enumerate(chunks):
+            jsonl_entries = [entries_of(texts, dimension, seed * 2 + i) for i, dimension in enumerate(expected)]
+            writer.write(jsonl_entries)
+            for dimension, entries in zip(expected, jsonl_entries):
+                expected[dimension].extend(entries)
+
+    dataset = SharedTextDataset(path)
+    # Each distinct text is stored once, the ones with the digest of another text after the new digests of their chunk
+    assert dataset.texts() == ['a', 'cc', 'b', 'e', 'dd', 'f', 'abcd', 'g']
+    for dimension, entries in expected.items():
+        assert list(dataset.view(dimension)) == entries
+
+def test_columnar_folders_give_back_the_jsonl_records(tmp_path, capsys):
+    data = generate_chunk('hodi', 0, 1500, 17)
+    data.loc[:2, 'text'] = ['', 'riga\nnuova', 'è così 😂']
+    data.to_csv(tmp_path / 'train.tsv', sep='\t', index=False)
+    hodi_a(str(tmp_path / 'train.tsv'), str(tmp_path / 'train.jsonl'), shuffle_labels=True, chunksize=400, columnar=True)
+
+    records = read_jsonl(tmp_path / 'train.jsonl')
+    dataset = ColumnarDataset(columnar_path(str(tmp_path / 'train.jsonl')))
+    assert len(dataset) == len(records) == 1500
+    assert list(dataset) == records
+    assert dataset[-1] == records[-1] and dataset.text(1) == 'riga\nnuova'
+    with pytest.raises(IndexError):
+        dataset[1500]
+    pd.testing.assert_frame_equal(dataset.to_dataframe(), pd.DataFrame(records), check_like=True)
+
+    # One folder per dimension, with the dimension of its records in meta.json
+    data = generate_chunk('emotivita', 0, 900, 17)
+    data.to_csv(tmp_path / 'dev.csv', index=False)
+    emotivITA(str(tmp_path / 'dev.csv'), str(tmp_path / 'E_{}.jsonl'), ['Bassa', 'Media', 'Alta'], shuffle_labels=True,
+              chunksize=250, columnar=True)
+    for dimension in DIMENSIONS:
+        dataset = ColumnarDataset(columnar_path(str(tmp_path / f'E_{dimension}.jsonl')))
+        assert dataset.extra == {'dimension': dimension}
+        assert list(dataset) == read_jsonl(tmp_path / f'E_{dimension}.jsonl')
+
+def test_shared_text_views_give_back_the_jsonl_records(tmp_path, capsys):
+    # Repeated texts inside a chunk and across the chunks
+    data = generate_chunk('emotivita', 0, 1200, 29)
+    data.loc[::40, 'text'] = 'sempre lo stesso testo'
+    data.loc[1100:, 'text'] = data['text'].iloc[:100].to_numpy()
+    data.to_csv(tmp_path / 'dev.csv', index=False)
+    categories = ['Bassa', 'Media', 'Alta']
+    emotivITA(str(tmp_path / 'dev.csv'), str(tmp_path / 'E_{}.jsonl'), categories, shuffle_labels=True, chunksize=300)
+    emotivITA(str(tmp_path / 'dev.csv'), str(tmp_path / 'E_{}.jsonl'), categories, shuffle_labels=True, chunksize=300,
+              shared_text=True)
+
+    dataset = SharedTextDataset(str(tmp_path / 'E.shared'))
+    assert len(dataset) == 1200
+    assert dataset.texts() == list(dict.fromkeys(data['text']))
+    records = {dimension: read_jsonl(tmp_path / f'E_{dimension}.jsonl') for dimension in DIMENSIONS}
+    for dimension in DIMENSIONS:
+        view = dataset.view(dimension)
+        assert list(view) == records[dimension]
+        assert view[-1] == records[dimension][-1]
+    with pytest.raises(KeyError):
+        dataset.view('Valenza')
+
+    concatenated = pd.concat([pd.DataFrame(records[dimension]) for dimension in DIMENSIONS], ignore_index=True)
+    pd.testing.assert_frame_equal(dataset.to_dataframe(), concatenated, check_like=True)
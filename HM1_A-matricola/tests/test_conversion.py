@@ -0,0 +1,148 @@
+# This part is for checking that the fast paths of the conversions write the same bytes as the simple ones
+
+import json
+import os
+import re
+import sys
+
+import numpy as np
+import pandas as pd
+import pytest
+
+# Make the shared helpers in HM1_A-matricola/common importable when the tests are run from anywhere
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from benchmarks.synthetic_corpus import generate_chunk
+from common.serialization import BACKENDS, JsonlSerializer
+from common.sharding import split_file_path, split_names
+from EmotivITA.scripts import DIMENSIONS, MAP_OPTION_THRESHOLDS, emotivITA, emotivITA_chunks
+from HODI_2023.scripts import hodi_a, hodi_a_chunks
+
+CATEGORIES = ['Bassa', 'Media', 'Alta']
+
+# The texts that a JSON encoder must escape, or keep as they are
+SPECIAL_TEXTS = ['"citato" e \\ barra', 'riga\nnuova\ttab', 'controllo \x01\x1f', 'è così 😂 🏳️‍🌈', '  ', '']
+
+def write_corpus(path, schema, n_rows, seed=49):
+    data = generate_chunk(schema, 0, n_rows, seed)
+    data.to_csv(path, sep='\t' if schema == 'hodi' else ',', index=False)
+    return data
+
+def read_outputs(paths):
+    contents = {}
+    for path in paths:
+        with open(path, 'rb') as f:
+            contents[os.path.basename(path)] = f.read()
+    return contents
+
+def reused_rows(output):
+    return int(re.search(r'(\d+) unchanged rows reused', output).group(1))
+
+@pytest.mark.parametrize('backend', [backend for backend in BACKENDS if backend != 'auto'])
+def test_record_batch_bytes_equal_dicts(backend):
+    pytest.importorskip(backend)
+    serializer = JsonlSerializer(backend)
+
+    data = generate_chunk('hodi', 0, 500, 49)
+    data.loc[:len(SPECIAL_TEXTS) - 1, 'text'] = SPECIAL_TEXTS
+    for batch in next(hodi_a_chunks([data], shuffle_labels=True)):
+        assert serializer.encode(batch) == serializer.encode(list(batch))
+
+    data = generate_chunk('emotivita', 0, 500, 49)
+    data.loc[:len(SPECIAL_TEXTS) - 1, 'text'] = SPECIAL_TEXTS
+    batches = next(emotivITA_chunks([data], CATEGORIES, True, False, np.array([MAP_OPTION_THRESHOLDS[0]] * 3), 49, 'id',
+                                    dict.fromkeys(CATEGORIES, 0)))
+    for batch in batches:
+        assert serializer.encode(batch) == serializer.encode(list(batch))
+
+def test_incremental_rebuild_equals_full(tmp_path, capsys):
+    data = write_corpus(tmp_path / 'dev.csv', 'emotivita', 3000)
+    cached, full = tmp_path / 'cached', tmp_path / 'full'
+    cached.mkdir(), full.mkdir()
+    emotivITA(str(tmp_path / 'dev.csv'), str(cached / 'E_{}.jsonl'), CATEGORIES, shuffle_labels=True, chunksize=700)
+
+    # Change some scores and texts, drop some rows and add new ones
+    data.loc[::7, 'V'] = 1.0
+    data.loc[::11, 'text'] = 'testo cambiato'
+    data = pd.concat([data.drop(index=range(100, 200)), generate_chunk('emotivita', 3000, 150, 7)], ignore_index=True)
+    data.to_csv(tmp_path / 'dev.csv', index=False)
+    capsys.readouterr()
+
+    emotivITA(str(tmp_path / 'dev.csv'), str(cached / 'E_{}.jsonl'), CATEGORIES, shuffle_labels=True, chunksize=700)
+    assert reused_rows(capsys.readouterr().out) > 0
+    emotivITA(str(tmp_path / 'dev.csv'), str(full / 'E_{}.jsonl'), CATEGORIES, shuffle_labels=True, chunksize=700,
+              use_cache=False)
+
+    for dimension in DIMENSIONS:
+        names = [f'E_{dimension}.jsonl', f'E_{dimension}.jsonl.idx']
+        assert read_outputs([cached / name for name in names]) == read_outputs([full / name for name in names])
+
+def test_incremental_rebuild_with_balanced_thresholds(tmp_path, capsys):
+    data = write_corpus(tmp_path / 'dev.csv', 'emotivita', 3000)
+    cached, full = tmp_path / 'cached', tmp_path / 'full'
+    cached.mkdir(), full.mkdir()
+    emotivITA(str(tmp_path / 'dev.csv'), str(cached / 'E_{}.jsonl'), CATEGORIES, shuffle_labels=True, chunksize=700,
+              thresholds='balanced')
+
+    # Shift the valence of half the rows, which moves the balanced thresholds of the Valence
+    data.loc[::2, 'V'] = (data.loc[::2, 'V'] + 1.0).clip(upper=5.0)
+    data.to_csv(tmp_path / 'dev.csv', index=False)
+    capsys.readouterr()
+
+    emotivITA(str(tmp_path / 'dev.csv'), str(cached / 'E_{}.jsonl'), CATEGORIES, shuffle_labels=True, chunksize=700,
+              thresholds='balanced')
+    emotivITA(str(tmp_path / 'dev.csv'), str(full / 'E_{}.jsonl'), CATEGORIES, shuffle_labels=True, chunksize=700,
+              thresholds='balanced', use_cache=False)
+
+    for dimension in DIMENSIONS:
+        assert read_outputs([cached / f'E_{dimension}.jsonl']) == read_outputs([full / f'E_{dimension}.jsonl'])
+
+def test_incremental_rebuild_equals_full_hodi(tmp_path, capsys):
+    data = write_corpus(tmp_path / 'train.tsv', 'hodi', 3000)
+    hodi_a(str(tmp_path / 'train.tsv'), str(tmp_path / 'cached.jsonl'), shuffle_labels=True, chunksize=700)
+
+    data.loc[::5, 'homotransphobic'] = 1 - data.loc[::5, 'homotransphobic']
+    data.drop(index=range(0, 50)).to_csv(tmp_path / 'train.tsv', sep='\t', index=False)
+    capsys.readouterr()
+
+    hodi_a(str(tmp_path / 'train.tsv'), str(tmp_path / 'cached.jsonl'), shuffle_labels=True, chunksize=700)
+    assert reused_rows(capsys.readouterr().out) > 0
+    hodi_a(str(tmp_path / 'train.tsv'), str(tmp_path / 'full.jsonl'), shuffle_labels=True, chunksize=700, use_cache=False)
+
+    assert read_outputs([tmp_path / 'cached.jsonl'])['cached.jsonl'] == read_outputs([tmp_path / 'full.jsonl'])['full.jsonl']
+
+def test_empty_texts_are_kept(tmp_path, capsys):
+    # An empty text, and texts that a CSV reader could take for a missing value
+    texts = ['', 'NA', 'null', 'nan']
+
+    data = generate_chunk('emotivita', 0, 40, 49)
+    data.loc[:len(texts) - 1, 'text'] = texts
+    data.to_csv(tmp_path / 'dev.csv', index=False)
+    emotivITA(str(tmp_path / 'dev.csv'), str(tmp_path / 'E_{}.jsonl'), CATEGORIES, shuffle_labels=True)
+    with open(tmp_path / 'E_Valence.jsonl', 'rb') as f:
+        assert [json.loads(line)['text'] for line in f] == data['text'].tolist()
+
+    data = generate_chunk('hodi', 0, 40, 49)
+    data.loc[:len(texts) - 1, 'text'] = texts
+    data.to_csv(tmp_path / 'train.tsv', sep='\t', index=False)
+    hodi_a(str(tmp_path / 'train.tsv'), str(tmp_path / 'train.jsonl'), shuffle_labels=True)
+    with open(tmp_path / 'train.jsonl', 'rb') as f:
+        assert [json.loads(line)['text'] for line in f] == data['text'].tolist()
+
+@pytest.mark.parametrize('split', [4, [0.8, 0.1, 0.1]])
+def test_splits_do_not_depend_on_chunksize(tmp_path, split):
+    write_corpus(tmp_path / 'dev.csv', 'emotivita', 3000)
+
+    outputs = []
+    for chunksize in [None, 250, 1300]:
+        output_dir = tmp_path / f'chunks-{chunksize}'
+        output_dir.mkdir()
+        emotivITA(str(tmp_path / 'dev.csv'), str(output_dir / 'E_{}.jsonl'), CATEGORIES, shuffle_labels=True,
+                  chunksize=chunksize, split=split)
+        paths = [split_file_path(str(output_dir / f'E_{dimension}.jsonl'), name)
+                 for dimension in DIMENSIONS for name in split_names(split)]
+        outputs.append(read_outputs(paths))
+
+    assert outputs[0] == outputs[1] == outputs[2]
+    # Each row is in exactly one split
+    n_lines = sum(content.count(b'\n') for name, content in outputs[0].items() if name.startswith('E_Valence'))
+    assert n_lines == 3000
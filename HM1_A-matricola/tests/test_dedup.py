@@ -0,0 +1,100 @@
+# This part is for checking the exact and near duplicates found by the MinHash/LSH index, inside a split and across splits
+
+import os
+import sys
+
+import numpy as np
+import pandas as pd
+import pytest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from common.dedup import DuplicateIndex, minhash_signatures, normalize_texts
+
+WORDS = ('casa amore sole mare notte giorno strada vento fuoco terra cielo luce ombra tempo mondo cuore voce pane '
+         'fiume bosco').split()
+
+def tweets(n_rows, seed, n_words=25):
+    rng = np.random.default_rng(seed)
+    return [' '.join(rng.choice(WORDS, n_words)) + f' #{seed}_{row}' for row in range(n_rows)]
+
+def jaccard(a, b, shingle_size=5):
+    shingles = [{text[i:i + shingle_size] for i in range(len(text) - shingle_size + 1)} for text in normalize_texts([a, b])]
+    return len(shingles[0] & shingles[1]) / len(shingles[0] | shingles[1])
+
+def run(index, ids, texts, chunksize):
+    data = pd.DataFrame({'id': ids, 'text': texts})
+    chunks = [data.iloc[start:start + chunksize] for start in range(0, len(data), chunksize)]
+    return pd.concat(list(index.stage(chunks)))
+
+def test_exact_and_near_duplicates_in_a_split():
+    texts = tweets(300, 1)
+    # Row 300 is row 3 up to case, punctuation and spaces, row 301 is row 10 with the last word changed
+    texts.append('  ' + texts[3].upper().replace(' ', ' , ') + '!!')
+    texts.append(texts[10].rsplit(' ', 2)[0] + ' cambiata ' + texts[10].rsplit(' ', 1)[1])
+    ids = [f'id{row}' for row in range(len(texts))]
+
+    index = DuplicateIndex()
+    kept = run(index, ids, texts, chunksize=64)
+    assert len(kept) == len(texts)
+    found = {(key, kind, duplicate_of) for key, kind, duplicate_of, source, _ in index.duplicates}
+    assert found == {('id300', 'exact', 'id3'), ('id301', 'near', 'id10')}
+    assert index.counts == {'exact': 1, 'near': 1, 'exact_leak': 0, 'near_leak': 0, 'dropped': 0}
+
+def test_near_duplicates_follow_the_jaccard_similarity():
+    # Pairs of texts with more and more words replaced, so their similarity goes from about 1 to about 0
+    rng = np.random.default_rng(7)
+    originals = tweets(60, 2, n_words=40)
+    copies = []
+    for row, text in enumerate(originals):
+        words = text.split()
+        for position in rng.choice(len(words) - 1, row % 15, replace=False):
+            words[position] = 'parola'
+        copies.append(' '.join(words[:-1]) + ' #copia')
+    index = DuplicateIndex()
+    run(index, [f'o{row}' for row in range(60)] + [f'c{row}' for row in range(60)], originals + copies, chunksize=50)
+
+    found = {key for key, kind, duplicate_of, _, _ in index.duplicates if key == 'c' + duplicate_of[1:]}
+    similarities = {f'c{row}': jaccard(originals[row], copies[row]) for row in range(60)}
+    # LSH finds the pairs well above the threshold and never reports the ones well below it
+    assert {key for key, similarity in similarities.items() if similarity >= 0.9} <= found
+    assert not {key for key, similarity in similarities.items() if similarity < 0.5} & found
+
+def test_leaks_against_a_saved_reference(tmp_path):
+    dev_texts = tweets(400, 3)
+    dev = DuplicateIndex()
+    run(dev, [f'dev{row}' for row in range(400)], dev_texts, chunksize=150)
+    dev.save(str(tmp_path / 'dev.dedup.npz'))
+
+    test_texts = tweets(200, 4)
+    test_texts[5] = dev_texts[17]
+    test_texts[9] = dev_texts[40] + ' ok'
+    # An exact copy, in the split, of a near leak is a near leak of the same reference row
+    test_texts[150] = test_texts[9]
+    test_ids = [f'test{row}' for row in range(200)]
+
+    reports = []
+    for chunksize in [200, 33]:
+        test = DuplicateIndex(references=[str(tmp_path / 'dev.dedup.npz')], drop=True)
+        kept = run(test, test_ids, test_texts, chunksize)
+        assert kept['id'].tolist() == [key for row, key in enumerate(test_ids) if row not in (5, 9, 150)]
+        assert test.counts == {'exact': 0, 'near': 0, 'exact_leak': 1, 'near_leak': 2, 'dropped': 3}
+        reports.append(test.duplicates)
+
+    assert [(key, kind, duplicate_of, source) for key, kind, duplicate_of, source, _ in reports[0]] == [
+        ('test5', 'exact', 'dev17', 'dev.dedup.npz'),
+        ('test9', 'near', 'dev40', 'dev.dedup.npz'),
+        ('test150', 'near', 'dev40', 'dev.dedup.npz'),
+    ]
+    # The chunks do not change the report
+    assert reports[0] == reports[1]
+
+def test_reference_with_other_parameters(tmp_path):
+    index = DuplicateIndex(num_perm=32, bands=8)
+    run(index, ['a', 'b'], tweets(2, 5), chunksize=2)
+    index.save(str(tmp_path / 'dev.dedup.npz'))
+    with pytest.raises(ValueError, match='was built with'):
+        DuplicateIndex(references=[str(tmp_path / 'dev.dedup.npz')])
+
+def test_signatures_do_not_depend_on_the_batches():
+    texts = normalize_texts(tweets(100, 6) + ['', 'ab', 'è così'])
+    np.testing.assert_array_equal(minhash_signatures(texts, batch_size=7), minhash_signatures(texts))
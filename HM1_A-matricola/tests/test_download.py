@@ -0,0 +1,191 @@
+# This part is for checking the downloads of both datasets against a local HTTP server: cached, resumed, or failed
+
+import json
+import os
+import re
+import sys
+import threading
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import pytest
+import requests
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from EmotivITA.download_data import download_csv_files
+from HODI_2023.download_data import DownloadCache, download_file
+
+class FileServer(ThreadingHTTPServer):
+    """Serves a single file with an ETag, like the raw files of GitHub, and logs the requests it gets."""
+
+    def __init__(self):
+        super().__init__(('127.0.0.1', 0), FileHandler)
+        self.content = bytes(range(256)) * 400
+        self.etag = '"v1"'
+        self.ignore_range = False
+        self.requests = []
+
+    @property
+    def url(self):
+        return f'http://127.0.0.1:{self.server_address[1]}/HODI_2023_train.zip'
+
+class FileHandler(BaseHTTPRequestHandler):
+
+    def do_HEAD(self):
+        self.respond(send_body=False)
+
+    def do_GET(self):
+        self.respond(send_body=True)
+
+    def respond(self, send_body):
+        server = self.server
+        server.requests.append((self.command, self.headers.get('Range'), self.headers.get('If-Range'),
+                                self.headers.get('If-None-Match')))
+        if self.headers.get('If-None-Match') == server.etag:
+            self.send_response(304)
+            self.send_header('ETag', server.etag)
+            self.end_headers()
+            return
+
+        body, status = server.content, 200
+        match = re.fullmatch(r'bytes=(\d+)-', self.headers.get('Range') or '')
+        # The range is served only if the file did not change since the partial download
+        if match and not server.ignore_range and self.headers.get('If-Range') == server.etag:
+            start = int(match.group(1))
+            if start >= len(body):
+                self.send_response(416)
+                self.send_header('Content-Length', '0')
+                self.end_headers()
+                return
+            body, status = body[start:], 206
+
+        self.send_response(status)
+        self.send_header('ETag', server.etag)
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        if send_body:
+            self.wfile.write(body)
+
+    def log_message(self, *args):
+        pass
+
+@pytest.fixture
+def server():
+    server = FileServer()
+    thread = threading.Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+    yield server
+    server.shutdown()
+    server.server_close()
+
+def read(path):
+    with open(path, 'rb') as f:
+        return f.read()
+
+def interrupt(server, save_path, n_bytes):
+    """Leave a partial download of the first bytes of the file, as a broken transfer of the current version does."""
+    with open(save_path + '.part', 'wb') as f:
+        f.write(server.content[:n_bytes])
+    DownloadCache(server.url, save_path).update({'ETag': server.etag}, sha256=None)
+
+def test_full_download_then_not_modified(server, tmp_path):
+    save_path = str(tmp_path / 'HODI_2023_train.zip')
+
+    assert download_file(server.url, save_path)
+    assert read(save_path) == server.content
+    assert server.requests == [('GET', None, None, None)]
+    assert not os.path.exists(save_path + '.part')
+
+    # The second time, a conditional HEAD answered with 304 is the only request
+    server.requests.clear()
+    assert download_file(server.url, save_path)
+    assert server.requests == [('HEAD', None, None, '"v1"')]
+    assert read(save_path) == server.content
+
+def test_changed_remote_file_is_downloaded_again(server, tmp_path):
+    save_path = str(tmp_path / 'HODI_2023_train.zip')
+    assert download_file(server.url, save_path)
+
+    server.content, server.etag = b'new version' * 1000, '"v2"'
+    server.requests.clear()
+    assert download_file(server.url, save_path)
+    assert [request[0] for request in server.requests] == ['HEAD', 'GET']
+    assert read(save_path) == server.content
+
+def test_resume_with_range(server, tmp_path):
+    save_path = str(tmp_path / 'HODI_2023_train.zip')
+    interrupt(server, save_path, 40000)
+
+    assert download_file(server.url, save_path)
+    assert server.requests == [('GET', 'bytes=40000-', '"v1"', None)]
+    assert read(save_path) == server.content
+
+def test_resume_of_a_complete_partial_file(server, tmp_path):
+    save_path = str(tmp_path / 'HODI_2023_train.zip')
+    interrupt(server, save_path, len(server.content))
+
+    # 416: the partial file only has to be moved in place
+    assert download_file(server.url, save_path)
+    assert read(save_path) == server.content
+
+@pytest.mark.parametrize('change', ['ignore_range', 'new_version'])
+def test_restart_when_the_range_is_not_served(server, tmp_path, change):
+    save_path = str(tmp_path / 'HODI_2023_train.zip')
+    interrupt(server, save_path, 40000)
+    if change == 'ignore_range':
+        server.ignore_range = True
+    else:
+        # If-Range does not match the new ETag, so the whole new file is sent
+        server.content, server.etag = b'new version' * 1000, '"v2"'
+
+    assert download_file(server.url, save_path)
+    assert read(save_path) == server.content
+    assert DownloadCache(server.url, save_path).entry['etag'] == server.etag
+
+def test_checksum_mismatch(server, tmp_path):
+    save_path = str(tmp_path / 'HODI_2023_train.zip')
+    assert not download_file(server.url, save_path, expected_sha256='0' * 64)
+    assert not os.path.exists(save_path) and not os.path.exists(save_path + '.part')
+
+class ContentsHandler(BaseHTTPRequestHandler):
+    """Serves a directory tree like the contents API of GitHub, with the paths in server.missing answered with 404."""
+
+    def do_GET(self):
+        base = f'http://127.0.0.1:{self.server.server_address[1]}'
+        pages = {
+            '/contents/': [{'type': 'file', 'name': 'README.md', 'download_url': base + '/raw/README.md'},
+                           {'type': 'dir', 'name': 'data', 'url': base + '/contents/data'}],
+            '/contents/data': [{'type': 'file', 'name': f'{split}.csv', 'download_url': f'{base}/raw/{split}.csv'}
+                               for split in ('dev', 'test')],
+        }
+        if self.path in self.server.missing or not (self.path in pages or self.path.startswith('/raw/')):
+            self.send_response(404)
+            self.send_header('Content-Length', '0')
+            self.end_headers()
+            return
+        body = json.dumps(pages[self.path]).encode() if self.path in pages else f'id,text\n{self.path}\n'.encode()
+        self.send_response(200)
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, *args):
+        pass
+
+@pytest.mark.parametrize('missing', [[], ['/raw/test.csv'], ['/contents/data']])
+def test_download_csv_files_fails_on_a_partial_crawl(tmp_path, missing):
+    server = ThreadingHTTPServer(('127.0.0.1', 0), ContentsHandler)
+    server.missing = missing
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    try:
+        api_url = f'http://127.0.0.1:{server.server_address[1]}/contents/'
+        if not missing:
+            downloaded = download_csv_files(api_url, str(tmp_path), max_workers=2)
+            assert sorted(os.path.basename(path) for path in downloaded) == ['dev.csv', 'test.csv']
+            return
+        with pytest.raises(requests.HTTPError, match=missing[0]):
+            download_csv_files(api_url, str(tmp_path), max_workers=2)
+        # The other files are still downloaded
+        assert os.path.exists(tmp_path / 'dev.csv') == (missing[0] != '/contents/data')
+    finally:
+        server.shutdown()
+        server.server_close()
@@ -0,0 +1,80 @@
+# This part is for checking that read_columns gives the same columns whatever the delimiter, the compression and the engine
+
+import bz2
+import gzip
+import io
+import lzma
+import os
+import sys
+import zipfile
+
+import pandas as pd
+import pytest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from benchmarks.synthetic_corpus import generate_chunk
+from common import ingest
+from common.ingest import read_columns
+
+COLUMNS = ['id', 'text', 'V', 'A', 'D']
+
+def zip_bytes(content):
+    buffer = io.BytesIO()
+    with zipfile.ZipFile(buffer, 'w', compression=zipfile.ZIP_DEFLATED) as zf:
+        zf.writestr('Development set.csv', content)
+    return buffer.getvalue()
+
+COMPRESSIONS = {
+    'plain': lambda content: content,
+    'gzip': gzip.compress,
+    'bz2': bz2.compress,
+    'xz': lzma.compress,
+    'zip': zip_bytes,
+}
+
+@pytest.fixture(params=['pandas', 'pyarrow'])
+def engine(request, monkeypatch):
+    if request.param == 'pandas':
+        monkeypatch.setattr(ingest, 'pa_csv', None)
+    else:
+        pytest.importorskip('pyarrow')
+    return request.param
+
+def read_all(content, chunksize=None):
+    chunks = list(read_columns(io.BytesIO(content), COLUMNS, chunksize))
+    return pd.concat(chunks, ignore_index=True)
+
+def assert_same_columns(read, data):
+    assert list(read.columns) == COLUMNS
+    assert read['id'].tolist() == data['id'].astype(str).tolist()
+    assert read['text'].tolist() == data['text'].tolist()
+    for column in ['V', 'A', 'D']:
+        assert read[column].dtype == 'float64'
+        assert read[column].tolist() == data[column].tolist()
+
+@pytest.mark.parametrize('delimiter', ['\t', ',', ';', '|'])
+def test_sniffed_delimiter(engine, delimiter):
+    data = generate_chunk('emotivita', 0, 300, 11)
+    content = data.to_csv(sep=delimiter, index=False).encode('utf-8')
+    assert_same_columns(read_all(content), data)
+
+@pytest.mark.parametrize('compression', list(COMPRESSIONS))
+def test_compressed_input(engine, compression):
+    data = generate_chunk('emotivita', 0, 1000, 23)
+    content = COMPRESSIONS[compression](data.to_csv(index=False).encode('utf-8'))
+    # The chunks do not depend on the compression either
+    read = list(read_columns(io.BytesIO(content), COLUMNS, chunksize=300))
+    assert [len(chunk) for chunk in read] == [300, 300, 300, 100]
+    assert_same_columns(pd.concat(read, ignore_index=True), data)
+
+def test_missing_values(engine):
+    # Only the numeric cells can be missing, the texts that look like a missing value are kept as they are
+    content = b'id,text,V,A,D\nNA,,NA,,3.5\n2,NA,1.5,null,\n3,"",2.0,2.0,nan\n'
+    read = read_all(content)
+    assert read['id'].tolist() == ['NA', '2', '3']
+    assert read['text'].tolist() == ['', 'NA', '']
+    assert read[['V', 'A', 'D']].isna().values.tolist() == [[True, True, False], [False, True, True], [False, False, True]]
+
+def test_unknown_delimiter():
+    with pytest.raises(ValueError, match='delimiter'):
+        next(read_columns(io.BytesIO(b'id text V\n1 ciao 2.5\n'), COLUMNS))
@@ -0,0 +1,88 @@
+# This part is for checking the random access, the shards and the shuffled order of IndexedJsonl
+
+import json
+import os
+import pickle
+import sys
+
+import numpy as np
+import pytest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from benchmarks.synthetic_corpus import generate_chunk
+from common.jsonl_index import INDEX_DTYPE, IndexedJsonl, build_index, index_path
+from HODI_2023.scripts import hodi_a
+
+def write_records(path, n_rows):
+    # Lines of very different lengths, with escaped new lines and non-ASCII characters
+    records = [{'text': 'è\n' * (row % 13) + f'riga {row}', 'label': row % 3} for row in range(n_rows)]
+    with open(path, 'w', encoding='utf-8') as f:
+        f.writelines(json.dumps(record, ensure_ascii=False) + '\n' for record in records)
+    return records
+
+def test_random_access(tmp_path):
+    records = write_records(tmp_path / 'data.jsonl', 1000)
+    dataset = IndexedJsonl(str(tmp_path / 'data.jsonl'))
+
+    assert len(dataset) == 1000
+    for idx in [0, 1, 517, 999, -1, -1000]:
+        assert dataset[idx] == records[idx]
+    with pytest.raises(IndexError):
+        dataset[1000]
+    assert list(dataset) == records
+    assert b''.join(dataset.lines(np.array([3, 2]))) == b''.join(
+        json.dumps(records[idx], ensure_ascii=False).encode('utf-8') + b'\n' for idx in [3, 2])
+
+    # A copy in another process maps the files again
+    assert pickle.loads(pickle.dumps(dataset))[517] == records[517]
+
+@pytest.mark.parametrize('num_workers', [1, 3, 7, 1000, 1001])
+def test_shards_and_shuffles_cover_every_row_once(tmp_path, num_workers):
+    n_rows = 1000
+    write_records(tmp_path / 'data.jsonl', n_rows)
+    dataset = IndexedJsonl(str(tmp_path / 'data.jsonl'))
+
+    ranges = [dataset.shard_range(worker_id, num_workers) for worker_id in range(num_workers)]
+    assert [row for shard in ranges for row in shard] == list(range(n_rows))
+    sizes = [len(shard) for shard in ranges]
+    assert max(sizes) - min(sizes) <= 1
+    assert [record['text'] for record in dataset.shard(num_workers - 1, num_workers)] == [
+        dataset[row]['text'] for row in ranges[-1]]
+
+    epochs = []
+    for seed in [0, 0, 1]:
+        rows = [record['text'] for worker_id in range(num_workers) for record in dataset.shuffled(seed, worker_id, num_workers)]
+        assert sorted(rows) == sorted(record['text'] for record in dataset)
+        epochs.append(rows)
+    assert epochs[0] == epochs[1]
+    assert epochs[0] != epochs[2]
+
+    with pytest.raises(ValueError):
+        dataset.shard_range(num_workers, num_workers)
+
+def test_stale_or_missing_index_is_rebuilt(tmp_path):
+    path = str(tmp_path / 'data.jsonl')
+    write_records(path, 50)
+    assert len(IndexedJsonl(path)) == 50
+
+    # Lines appended by another tool, the last one without its new line
+    with open(path, 'a', encoding='utf-8') as f:
+        f.write('{"text": "nuova", "label": 1}\n{"text": "ultima", "label": 2}')
+    dataset = IndexedJsonl(path)
+    assert len(dataset) == 52
+    assert dataset[-1] == {'text': 'ultima', 'label': 2}
+
+    os.remove(index_path(path))
+    assert IndexedJsonl(path)[50] == {'text': 'nuova', 'label': 1}
+
+def test_converter_index_equals_a_scan(tmp_path):
+    data = generate_chunk('hodi', 0, 2000, 31)
+    data.to_csv(tmp_path / 'train.tsv', sep='\t', index=False)
+    output_file_path = str(tmp_path / 'train.jsonl')
+    hodi_a(str(tmp_path / 'train.tsv'), output_file_path, shuffle_labels=True, chunksize=300)
+
+    written = np.fromfile(index_path(output_file_path), dtype=INDEX_DTYPE)
+    np.testing.assert_array_equal(written, build_index(output_file_path))
+    dataset = IndexedJsonl(output_file_path)
+    assert len(dataset) == 2000
+    assert [dataset[row]['text'] for row in [0, 1999, 1234]] == data['text'].iloc[[0, 1999, 1234]].tolist()
@@ -0,0 +1,80 @@
+# This part is for checking that every rendered prompt is a valid JSON object with the exact text of its record
+
+import json
+import os
+import sys
+
+import pytest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from common.prompts import PromptTemplate, load_prompt_templates, render_evaluation_set
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+EMOTIVITA_PROMPTS = os.path.join(ROOT, 'EmotivITA', 'prompt.jsonl')
+HODI_PROMPTS = os.path.join(ROOT, 'HODI_2023', 'prompts_subtaskA.jsonl')
+
+# Tweets with the characters that break a template filled by string replacement
+HOSTILE_TEXTS = [
+    'ha detto "basta" e se n\'è andato',
+    'C:\\percorso\\file \\n non è una nuova riga',
+    'prima riga\nseconda riga\r\n\tcon tab',
+    'controllo \x00\x08\x1f e \u2028 \u2029',
+    '{{ text }} e {{choices}} nel tweet',
+    '🏳️‍🌈 è così', '}', '',
+]
+
+@pytest.mark.parametrize('prompt_file_path', [EMOTIVITA_PROMPTS, HODI_PROMPTS])
+def test_shipped_prompts_render_to_json(prompt_file_path):
+    templates = load_prompt_templates(prompt_file_path)
+    assert len(templates) == 5
+
+    for text in HOSTILE_TEXTS:
+        record = {'text': text, 'choices': ['Bassa', 'Media "alta"', 'Alta'], 'label': 2, 'dimension': 'Valenza'}
+        for prompt_id, template in enumerate(templates):
+            line = template.render(record, prompt_id)
+            assert '\n' not in line
+            rendered = json.loads(line)
+            assert rendered['prompt_id'] == prompt_id
+            assert rendered['label'] == 2
+            if prompt_file_path == HODI_PROMPTS:
+                # "text": "{{text}}" and "choices": {{choices}}
+                assert rendered['text'] == text
+                assert rendered['choices'] == record['choices']
+            else:
+                assert f'FRASE: {text} \n\n OPZIONI: Bassa, Media "alta", Alta' in rendered['prompt']
+                assert rendered['text'] == text and rendered['dimension'] == 'Valenza'
+
+def test_placeholders_in_and_out_of_strings():
+    # A placeholder after an escaped quote is still in the string, and the ones outside are JSON values
+    template = PromptTemplate('{"prompt": "di \\"{{ text }}\\" scegli {{choices}}", "choices": {{ choices }}, "n": {{n}} }')
+    rendered = json.loads(template.render({'text': 'a "b"', 'choices': ['Vero', 'Falso'], 'n': 3, 'label': 0}, 1))
+    assert rendered == {'prompt': 'di "a "b"" scegli Vero, Falso', 'choices': ['Vero', 'Falso'], 'n': 3, 'prompt_id': 1,
+                        'text': 'a "b"', 'label': 0}
+
+def test_invalid_templates_and_records():
+    with pytest.raises(ValueError, match='JSON object'):
+        PromptTemplate('["{{text}}"]')
+    with pytest.raises(ValueError, match='Invalid prompt template'):
+        PromptTemplate('{"prompt": "{{text}}", "choices": {{choices}} {{label}}}')
+    with pytest.raises(KeyError):
+        PromptTemplate('{"prompt": "{{ dimension }}"}').render({'text': 'ciao'}, 0)
+
+def test_render_evaluation_set(tmp_path):
+    record_file_paths = []
+    for part in range(2):
+        path = tmp_path / f'records_{part}.jsonl'
+        with open(path, 'w', encoding='utf-8') as f:
+            for text in HOSTILE_TEXTS:
+                f.write(json.dumps({'text': text, 'choices': ['Vero', 'Falso'], 'label': part}, ensure_ascii=False) + '\n')
+        record_file_paths.append(str(path))
+
+    output_file_path = str(tmp_path / 'prompts.jsonl')
+    n_lines = render_evaluation_set(HODI_PROMPTS, record_file_paths, output_file_path, batch_size=3)
+    assert n_lines == 5 * 2 * len(HOSTILE_TEXTS)
+
+    with open(output_file_path, encoding='utf-8') as f:
+        lines = [json.loads(line) for line in f]
+    assert len(lines) == n_lines
+    # All the prompts of a record before the next record
+    assert [(line['text'], line['label'], line['prompt_id']) for line in lines] == [
+        (text, part, prompt_id) for part in range(2) for text in HOSTILE_TEXTS for prompt_id in range(5)]
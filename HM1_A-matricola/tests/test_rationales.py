@@ -0,0 +1,115 @@
+# This part is for checking that the labels of the subtask B tokens line up with the rationale characters of their text
+
+import json
+import os
+import sys
+
+import numpy as np
+import pandas as pd
+import pytest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from common.rationales import IGNORE_LABEL, RationaleBatch, index_spans, parse_rationales, whitespace_offsets
+from HODI_2023.scripts import hodi_b, hodi_b_chunks
+
+# Pieces of tweets with the characters that shift the offsets: accents, emoji out of the BMP, joiners, and spaces
+# that are not ASCII
+PIECES = ['frocio', 'è', 'così', '😂', '🏳️‍🌈', '#gay', '@utente', 'città', ' ', '  ', '\t', '\n', ' ', '　',
+          ' ', '\x1c', '.', ',']
+
+def random_rows(n_rows, seed):
+    rng = np.random.default_rng(seed)
+    texts, rationales = [], []
+    for _ in range(n_rows):
+        text = ''.join(rng.choice(PIECES, rng.integers(0, 30)))
+        indices = set()
+        for _ in range(rng.integers(0, 4) if text else 0):
+            start = int(rng.integers(0, len(text)))
+            indices.update(range(start, min(len(text), start + int(rng.integers(1, 10)))))
+        texts.append(text)
+        # No rationale is an empty cell (NaN once read), '' or an empty list
+        rationales.append(str(sorted(indices)) if indices else ['', '[]', float('nan')][rng.integers(0, 3)])
+    return texts, rationales
+
+def reference_tokens(text):
+    """The [start, end) runs of characters that are not spaces, one character at a time."""
+    tokens, start = [], None
+    for position, char in enumerate(text + ' '):
+        if char.isspace() and start is not None:
+            tokens.append([start, position])
+            start = None
+        elif not char.isspace() and start is None:
+            start = position
+    return tokens
+
+def reference_spans(indices):
+    spans = []
+    for index in sorted(indices):
+        if spans and spans[-1][1] == index:
+            spans[-1][1] += 1
+        else:
+            spans.append([index, index + 1])
+    return spans
+
+def row_indices(rationale):
+    return json.loads(rationale) if isinstance(rationale, str) and rationale else []
+
+def test_token_labels_match_a_loop_over_the_tokens():
+    texts, rationales = random_rows(400, 1)
+    batch = RationaleBatch(texts, *parse_rationales(rationales))
+    starts, ends, token_offsets = whitespace_offsets(texts)
+    labels = batch.token_labels(starts, ends, token_offsets)
+
+    for row, (text, rationale) in enumerate(zip(texts, rationales)):
+        indices = set(row_indices(rationale))
+        tokens = reference_tokens(text)
+        bounds = slice(token_offsets[row], token_offsets[row + 1])
+        assert np.stack([starts[bounds], ends[bounds]], axis=1).tolist() == tokens
+        assert labels[bounds].tolist() == [int(any(i in indices for i in range(start, end))) for start, end in tokens]
+        assert batch.spans(row) == reference_spans(indices)
+        assert batch.char_labels()[row].tolist() == [int(i in indices) for i in range(len(text))]
+
+def test_special_tokens_are_ignored():
+    texts = ['ciao frocio', 'tutto bene']
+    batch = RationaleBatch(texts, *parse_rationales(['[5, 6, 7]', '']))
+    # Like the offset mapping of a transformer: [CLS] and [SEP] cover no character, sub-words split the words
+    starts = np.array([0, 0, 5, 8, 0, 0, 0, 6, 0], dtype=np.int32)
+    ends = np.array([0, 4, 8, 11, 0, 0, 5, 10, 0], dtype=np.int32)
+    labels = batch.token_labels(starts, ends, np.array([0, 5, 9]))
+    assert labels.tolist() == [IGNORE_LABEL, 0, 1, 0, IGNORE_LABEL, IGNORE_LABEL, 0, 0, IGNORE_LABEL]
+
+def test_index_spans_of_empty_and_adjacent_rows():
+    starts, ends, span_offsets = index_spans(np.array([3, 4, 0, 1, 5, 6, 9]), np.array([0, 2, 2, 7, 7]))
+    assert starts.tolist() == [3, 0, 5, 9] and ends.tolist() == [5, 2, 7, 10]
+    assert span_offsets.tolist() == [0, 1, 1, 4, 4]
+
+def test_invalid_rationales():
+    with pytest.raises(ValueError, match='list of character indices'):
+        parse_rationales(['0, 1, 2'])
+    with pytest.raises(ValueError):
+        parse_rationales(['[0, uno]'])
+    with pytest.raises(ValueError, match='out of the text'):
+        RationaleBatch(['ciao'], *parse_rationales(['[2, 3, 4]']))
+
+@pytest.mark.parametrize('tokenizer', ['whitespace', 'char'])
+def test_hodi_b_entries_point_at_the_rationale_characters(tmp_path, tokenizer):
+    texts, rationales = random_rows(600, 2)
+    data = pd.DataFrame({'id': [f'tweet{row}' for row in range(600)], 'text': texts, 'rationales': rationales,
+                         'homotransphobic': [int(bool(row_indices(rationale))) for rationale in rationales]})
+    entries = [entry for chunk in hodi_b_chunks([data.iloc[:250], data.iloc[250:]], tokenizer) for entry in chunk[0]]
+
+    for entry, rationale in zip(entries, rationales):
+        indices = set(row_indices(rationale))
+        text = entry['text']
+        assert ''.join(text[start:end] for start, end in entry['rationales']) == ''.join(text[i] for i in sorted(indices))
+        if tokenizer == 'char':
+            assert entry['labels'] == [int(i in indices) for i in range(len(text))]
+        else:
+            assert entry['offsets'] == reference_tokens(text)
+            assert entry['labels'] == [int(any(i in indices for i in range(start, end))) for start, end in entry['offsets']]
+
+    # The same entries when written by the converter: the TSV keeps the texts as they are, the new lines and tabs included
+    data.to_csv(tmp_path / 'train.tsv', sep='\t', index=False)
+    hodi_b(str(tmp_path / 'train.tsv'), str(tmp_path / 'train.jsonl'), tokenizer=tokenizer, chunksize=170)
+    with open(tmp_path / 'train.jsonl', encoding='utf-8') as f:
+        assert [json.loads(line) for line in f] == entries
@@ -0,0 +1,63 @@
+# This part is for checking that converting a member streamed from the encrypted HODI zip writes the same bytes as the extracted file
+
+import os
+import sys
+
+import numpy as np
+import pytest
+
+pyzipper = pytest.importorskip('pyzipper')
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from benchmarks.synthetic_corpus import generate_chunk
+from HODI_2023.download_data import unzip_file
+from HODI_2023.scripts import hodi_a, hodi_b
+
+PASSWORD = 'hodi23evalita'
+
+def subtask_b(data, seed):
+    """The rationales of the homotransphobic rows: a run of characters in the text, sometimes two."""
+    rng = np.random.default_rng(seed)
+    rationales = []
+    for text, label in zip(data['text'], data['homotransphobic']):
+        indices = []
+        for _ in range(rng.integers(1, 3) if label and len(text) > 4 else 0):
+            start = int(rng.integers(0, len(text) - 2))
+            indices.extend(range(start, min(len(text), start + int(rng.integers(1, 12)))))
+        rationales.append(str(sorted(set(indices))) if indices else '')
+    return data.assign(rationales=rationales)
+
+@pytest.fixture
+def hodi_zip(tmp_path):
+    """An AES-encrypted, LZMA-compressed zip like HODI_2023_train.zip, and the folder it is extracted to."""
+    data = generate_chunk('hodi', 0, 2500, 43)
+    zip_path = str(tmp_path / 'HODI_2023_train.zip')
+    with pyzipper.AESZipFile(zip_path, 'w', compression=pyzipper.ZIP_LZMA, encryption=pyzipper.WZ_AES) as zf:
+        zf.setpassword(PASSWORD.encode())
+        zf.writestr('HODI_2023_train_subtaskA.tsv', data.to_csv(sep='\t', index=False))
+        zf.writestr('HODI_2023_train_subtaskB.tsv', subtask_b(data, 43).to_csv(sep='\t', index=False))
+    extract_dir = str(tmp_path / 'HODI_2023_train')
+    unzip_file(zip_path, extract_dir, password=PASSWORD, max_workers=1)
+    return zip_path, extract_dir
+
+def read_bytes(path):
+    with open(path, 'rb') as f:
+        return f.read()
+
+@pytest.mark.parametrize('chunksize', [None, 600])
+def test_zip_member_equals_extracted_file(tmp_path, hodi_zip, chunksize):
+    zip_path, extract_dir = hodi_zip
+    for convert, member in [(hodi_a, 'HODI_2023_train_subtaskA.tsv'), (hodi_b, 'HODI_2023_train_subtaskB.tsv')]:
+        streamed, extracted = str(tmp_path / f'streamed_{member}.jsonl'), str(tmp_path / f'extracted_{member}.jsonl')
+        convert(member, streamed, chunksize=chunksize, zip_path=zip_path, password=PASSWORD)
+        convert(os.path.join(extract_dir, member), extracted, chunksize=chunksize)
+
+        assert read_bytes(streamed) == read_bytes(extracted)
+        assert read_bytes(streamed + '.idx') == read_bytes(extracted + '.idx')
+        assert read_bytes(streamed).count(b'\n') == 2500
+
+def test_wrong_password(tmp_path, hodi_zip):
+    zip_path, _ = hodi_zip
+    with pytest.raises(RuntimeError):
+        hodi_a('HODI_2023_train_subtaskA.tsv', str(tmp_path / 'out.jsonl'), zip_path=zip_path, password='sbagliata')
+    assert not os.path.exists(tmp_path / 'out.jsonl')